@@ -0,0 +1,204 @@
+# analytics_mirror.py
+# V6: Columnar analytics mirror of the lot tables in market_reports.db.
+# auction_sales and auction_offers are exported as one Parquet file per sale
+# (analytics_mirror/auction_sales/sale_year=2025/Mombasa_2025-38.parquet) and queried
+# with DuckDB, which scans only the columns an aggregation touches.
+# SQLite stays the source of truth: the mirror is refreshed after each ETL run for
+# the sales change_log reports as written, and can be deleted at any time (the next
+# run rebuilds it in full).
+import argparse
+import logging
+import os
+import re
+import shutil
+import sys
+import pandas as pd
+
+from warehouse_db import connect_database, read_changed_sales, commit_changes
+
+try:
+    import pyarrow as pa  # Required for the export (pip install pyarrow)
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+try:
+    import duckdb  # Required for queries against the mirror (pip install duckdb)
+except ImportError:
+    duckdb = None
+
+# Configuration
+DB_FILE = "market_reports.db"
+MIRROR_DIR = "analytics_mirror"
+MIRROR_TABLES = ['auction_sales', 'auction_offers']
+CHANGE_CONSUMER = "analytics_mirror" # This script's cursor in change_log_cursors
+
+# Column types in the Parquet files. Every other column is a string; sale_date becomes a date.
+NUMERIC_COLUMNS = {
+    'id': 'int64', 'mark_id': 'int64', 'buyer_id': 'int64', 'package_count': 'int64',
+    'quantity_kgs': 'float64', 'price': 'float64', 'valuation_or_rp': 'float64',
+}
+
+# Standard aggregations (DuckDB SQL over the auction_sales / auction_offers views of the mirror)
+STANDARD_QUERIES = {
+    'price_by_grade_by_quarter': """
+        SELECT grade, year(sale_date) AS year, quarter(sale_date) AS quarter,
+               COUNT(*) AS lots, SUM(quantity_kgs) AS total_kgs,
+               SUM(price * quantity_kgs) / SUM(quantity_kgs) AS avg_price
+        FROM auction_sales
+        WHERE price > 0 AND quantity_kgs > 0 AND grade IS NOT NULL AND sale_date IS NOT NULL
+        GROUP BY ALL
+        ORDER BY grade, year, quarter
+    """,
+    'buyer_share_by_quarter': """
+        SELECT year, quarter, buyer, total_kgs,
+               total_kgs / SUM(total_kgs) OVER (PARTITION BY year, quarter) AS share
+        FROM (
+            SELECT year(sale_date) AS year, quarter(sale_date) AS quarter, buyer, SUM(quantity_kgs) AS total_kgs
+            FROM auction_sales
+            WHERE quantity_kgs > 0 AND buyer IS NOT NULL AND sale_date IS NOT NULL
+            GROUP BY ALL
+        )
+        ORDER BY year, quarter, total_kgs DESC
+    """,
+    'offered_kgs_by_sale': """
+        SELECT source_location, sale_number, COUNT(*) AS lots, SUM(quantity_kgs) AS offered_kgs,
+               AVG(valuation_or_rp) AS avg_valuation
+        FROM auction_offers
+        GROUP BY ALL
+        ORDER BY source_location, sale_number
+    """,
+}
+
+logging.basicConfig(level=logging.INFO, format='MIRROR: %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
+
+# =============================================================================
+# Export
+# =============================================================================
+
+def sale_file(table_name, source_location, sale_number):
+    """Parquet file of one sale, under a Hive-style sale_year= directory."""
+    match = re.match(r"(\d{4})-", str(sale_number))
+    year = match.group(1) if match else 'unknown'
+    name = re.sub(r"[^\w.-]", "_", f"{source_location}_{sale_number}")
+    return os.path.join(MIRROR_DIR, table_name, f"sale_year={year}", f"{name}.parquet")
+
+def to_arrow(df):
+    """The rows of a lot view as an Arrow table with fixed column types, so every sale's file
+    has the same schema (a sale without prices would otherwise get a null-typed column)."""
+    fields, arrays = [], []
+    for column in df.columns:
+        if column in NUMERIC_COLUMNS:
+            arrow_type = pa.int64() if NUMERIC_COLUMNS[column] == 'int64' else pa.float64()
+            values = pd.to_numeric(df[column], errors='coerce').astype('Int64' if arrow_type == pa.int64() else 'float64')
+            arrays.append(pa.array(values, arrow_type, from_pandas=True))
+        elif column == 'sale_date':
+            arrow_type = pa.date32()
+            arrays.append(pa.array(pd.to_datetime(df[column], errors='coerce').dt.date, arrow_type, from_pandas=True))
+        else:
+            arrow_type = pa.string()
+            arrays.append(pa.array([None if pd.isna(value) else str(value) for value in df[column]], arrow_type))
+        fields.append(pa.field(column, arrow_type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def export_sale(conn, table_name, source_location, sale_number):
+    """Rewrites the Parquet file of one sale (removes it when the sale has no rows). Returns the row count."""
+    path = sale_file(table_name, source_location, sale_number)
+    df = pd.read_sql_query(f"SELECT * FROM {table_name} WHERE source_location = ? AND sale_number = ?",
+                           conn, params=(source_location, sale_number))
+    if df.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp" # Readers never see a partial file
+    pq.write_table(to_arrow(df), tmp_path)
+    os.replace(tmp_path, path)
+    return len(df)
+
+def all_sales(conn):
+    """Every (source_location, sale_number) pair in the lot tables."""
+    sql = " UNION ".join(f"SELECT source_location, sale_number FROM {table} WHERE sale_number IS NOT NULL"
+                         for table in MIRROR_TABLES)
+    return set(conn.execute(sql).fetchall())
+
+def refresh_mirror(full=False):
+    """Brings the mirror in line with the lot tables: re-exports the sales written since the
+    last refresh (change_log), or every sale on the first run, without the mirror or with full=True.
+    The mirror is optional: without pyarrow or a database it is skipped (returns False) and
+    the change_log cursor stays put, so the next refresh picks the changes up."""
+    if pa is None:
+        logging.warning("Skipping the analytics mirror: the optional 'pyarrow' library is not installed (pip install pyarrow).")
+        return False
+    if not os.path.exists(DB_FILE):
+        logging.warning(f"Skipping the analytics mirror: database not found: {DB_FILE}.")
+        return False
+
+    conn = connect_database(DB_FILE, reader=True)
+    try:
+        changed_sales, last_change_id = read_changed_sales(conn, CHANGE_CONSUMER, MIRROR_TABLES)
+        if full or changed_sales is None or not os.path.exists(MIRROR_DIR):
+            logging.info("Rebuilding the analytics mirror from scratch.")
+            shutil.rmtree(MIRROR_DIR, ignore_errors=True)
+            changed_sales = all_sales(conn)
+        elif not changed_sales:
+            logging.info("No sales changed since the last refresh. The mirror is up to date.")
+
+        rows = 0
+        for source_location, sale_number in sorted(changed_sales):
+            for table_name in MIRROR_TABLES:
+                rows += export_sale(conn, table_name, source_location, sale_number)
+        if changed_sales:
+            logging.info(f"Exported {len(changed_sales)} sales ({rows} rows) to {MIRROR_DIR}.")
+        commit_changes(conn, CHANGE_CONSUMER, last_change_id)
+    finally:
+        conn.close()
+    return True
+
+# =============================================================================
+# Queries
+# =============================================================================
+
+def connect_mirror():
+    """An in-memory DuckDB connection with one view per mirrored table over its Parquet files."""
+    if duckdb is None:
+        raise RuntimeError("The 'duckdb' library is required to query the analytics mirror. Please install it: pip install duckdb")
+    con = duckdb.connect()
+    for table_name in MIRROR_TABLES:
+        pattern = os.path.join(MIRROR_DIR, table_name, "*", "*.parquet").replace(os.sep, '/')
+        con.execute(f"CREATE VIEW {table_name} AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)")
+    return con
+
+def query_mirror(sql, params=None):
+    """Runs DuckDB SQL against the mirror (tables: auction_sales, auction_offers) and returns a DataFrame."""
+    con = connect_mirror()
+    try:
+        return con.execute(sql, params or []).fetchdf()
+    finally:
+        con.close()
+
+def run_standard_query(name):
+    """One of the STANDARD_QUERIES as a DataFrame."""
+    return query_mirror(STANDARD_QUERIES[name])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar analytics mirror of the Mombasa warehouse")
+    parser.add_argument(
+        '--full', action='store_true',
+        help="Re-export every sale instead of the ones changed since the last refresh."
+    )
+    parser.add_argument(
+        '--query', choices=sorted(STANDARD_QUERIES),
+        help="Print a standard aggregation from the mirror instead of refreshing it."
+    )
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.query:
+        with pd.option_context('display.max_rows', 200, 'display.width', 200):
+            print(run_standard_query(args.query))
+        sys.exit(0)
+    # A skipped refresh is not a failure: run_automation must still commit the ETL and analyzer outputs
+    refresh_mirror(full=args.full)
+    sys.exit(0)
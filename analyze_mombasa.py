@@ -1,6 +1,7 @@
 import sqlite3
 import pandas as pd
 import logging
+import argparse
 import os
 import sys
 import datetime
@@ -8,6 +9,8 @@ import altair as alt
 import json
 import numpy as np
 
+from warehouse_db import connect_database, relation_exists, read_changed_sales, commit_changes
+
 # Configuration
 DB_FILE = "market_reports.db"
 DATA_OUTPUT_DIR = "report_data"
@@ -15,6 +18,11 @@ INDEX_FILE = os.path.join(DATA_OUTPUT_DIR, "mombasa_index.json")
 PRIMARY_COLOR = "#4285F4" # Google Blue
 CHART_HEIGHT = 320
 PLACEHOLDER = "N/A (Pending)"
+# V6: Source column -> (canonical ID column, display column). The display column holds the most
+# common spelling of the name's mark_aliases group; the source column keeps the spelling as sold.
+DISPLAY_NAME_COLUMNS = {'mark': ('mark_id', 'mark_name'), 'buyer': ('buyer_id', 'buyer_name')}
+CHANGE_CONSUMER = "analyze_mombasa" # V6: This script's cursor in change_log_cursors
+CHANGE_TABLES = ['auction_sales', 'auction_offers'] # V6: Tables the reports are built from
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='ANALYZER: %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
@@ -30,7 +38,7 @@ def connect_db():
     if not os.path.exists(DB_FILE):
         logging.error(f"Database file not found: {DB_FILE}. Ensure scrapers ran successfully.");
         sys.exit(1)
-    try: return sqlite3.connect(DB_FILE)
+    try: return connect_database(DB_FILE, reader=True)
     except sqlite3.Error as e:
         logging.error(f"Database connection error: {e}"); sys.exit(1)
 
@@ -40,14 +48,43 @@ def clean_text_column(df, column_name):
         df[column_name] = df[column_name].replace(NOISE_VALUES, pd.NA)
     return df
 
+def most_common_spellings(frames, column, id_column):
+    """V6: canonical ID -> the spelling most lots of its mark_aliases group carry (ties: alphabetical)."""
+    parts = [df[[id_column, column]] for df in frames if column in df.columns and id_column in df.columns]
+    if not parts:
+        return {}
+    counts = pd.concat(parts).dropna().groupby([id_column, column]).size().reset_index(name='lots')
+    counts = counts.sort_values([id_column, 'lots', column], ascending=[True, False, True]).drop_duplicates(id_column)
+    return dict(zip(counts[id_column], counts[column]))
+
+def add_display_names(frames):
+    """V6: Adds the DISPLAY_NAME_COLUMNS: one spelling per garden/buyer group (canonical IDs written
+    by the ETL), or the name as loaded for rows without an ID. The source columns stay as loaded."""
+    for column, (id_column, display_column) in DISPLAY_NAME_COLUMNS.items():
+        spellings = most_common_spellings(frames, column, id_column)
+        for df in frames:
+            if column in df.columns:
+                names = df[id_column].map(spellings) if id_column in df.columns else pd.Series(pd.NA, index=df.index)
+                df[display_column] = names.astype(object).where(names.notna(), df[column])
+
+def fetch_lot_outcomes(conn, sale_number, location):
+    """V6: Offered, sold and valued lots per broker of one sale, read from lot_outcomes (built at
+    ingest) through its (source_location, sale_number) index. Empty without lot_outcomes."""
+    if not relation_exists(conn, 'lot_outcomes'):
+        return pd.DataFrame()
+    return pd.read_sql_query("""
+        SELECT broker, COUNT(*) AS lots_offered, SUM(sold) AS lots_sold,
+               COALESCE(SUM(CASE WHEN realization IS NOT NULL THEN price * quantity_kgs END), 0) AS sold_value,
+               COALESCE(SUM(CASE WHEN realization IS NOT NULL THEN valuation * quantity_kgs END), 0) AS valued_value
+        FROM lot_outcomes WHERE source_location = ? AND sale_number = ?
+        GROUP BY broker ORDER BY broker
+    """, conn, params=(location, str(sale_number)))
+
 def fetch_data(conn):
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='auction_sales';")
-        sales_exists = cursor.fetchone() is not None
-        
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='auction_offers';")
-        offers_exists = cursor.fetchone() is not None
+        # V6: The lot tables are TEMP views over the year partitions (see warehouse_db)
+        sales_exists = relation_exists(conn, 'auction_sales')
+        offers_exists = relation_exists(conn, 'auction_offers')
 
         if not sales_exists and not offers_exists:
              logging.warning("Essential tables not found. Returning empty dataframes.")
@@ -69,6 +106,9 @@ def fetch_data(conn):
         if 'buyer' in sales_df.columns:
              sales_df = clean_text_column(sales_df, 'buyer')
 
+        # V6: Garden/buyer names for grouping and display (mark_name, buyer_name)
+        add_display_names([sales_df, offers_df])
+
         # Minimal filtering (Keys only)
         keys = ['broker', 'lot_number', 'sale_number', 'sale_date']
         if not sales_df.empty and all(k in sales_df.columns for k in keys):
@@ -107,11 +147,14 @@ def prepare_sales_data(sales_df_raw):
     sales_df['value_usd'] = sales_df['price'] * sales_df['quantity_kgs']
 
     # Handle missing analytical data gracefully
-    analytical_cols = ['mark', 'grade', 'buyer', 'broker']
+    analytical_cols = ['mark', 'grade', 'buyer', 'broker', 'mark_name', 'buyer_name']
     for col in analytical_cols:
         if col in sales_df.columns:
             sales_df[col] = sales_df[col].astype(str).fillna(PLACEHOLDER)
             sales_df[col] = sales_df[col].replace(['nan', '<NA>'], PLACEHOLDER)
+            # V6: Categorical, so pandas group-bys and merges on these repeated names use its own codes.
+            # The names arrive decoded from the lot views; the warehouse keys are not used here.
+            sales_df[col] = sales_df[col].astype('category')
 
     return sales_df
 
@@ -119,8 +162,9 @@ def prepare_sales_data(sales_df_raw):
 # Analysis Functions (KPIs and Forecast)
 # (These functions remain the same, included for completeness)
 # =============================================================================
-def analyze_kpis_and_forecast(sales_df_week, sales_df_all, sales_df_week_raw, offers_df_week):
-    """Combines KPI calculation, forecast analysis, and snapshot generation."""
+def analyze_kpis_and_forecast(sales_df_week, sales_df_all, sales_df_week_raw, offers_df_week, outcomes_week=None):
+    """Combines KPI calculation, forecast analysis, and snapshot generation.
+    V6: outcomes_week holds the week's lot_outcomes per broker (see fetch_lot_outcomes)."""
     kpis = {}
     tables = {'sell_through': [], 'realization': []}
 
@@ -176,9 +220,18 @@ def analyze_kpis_and_forecast(sales_df_week, sales_df_all, sales_df_week_raw, of
     tables['sell_through'].append({'Metric': 'Lots Sold', 'Value': f"{lots_sold:,.0f}"})
     tables['sell_through'].append({'Metric': 'Rate', 'Value': kpis['SELL_THROUGH_RATE']})
 
-    # 3. Realization
-    kpis['REALIZATION_RATE'] = 'N/A'
-    tables['realization'].append({'Metric': 'Status', 'Value': 'Insufficient Data'})
+    # 3. Realization (V6: price vs valuation of the offered lots that sold, from lot_outcomes)
+    if outcomes_week is not None and not outcomes_week.empty and outcomes_week['valued_value'].sum() > 0:
+        realization = outcomes_week['sold_value'].sum() / outcomes_week['valued_value'].sum()
+        kpis['REALIZATION_RATE'] = f"{realization:.2%}"
+        kpis['REALIZATION_RATE_RAW'] = realization
+        tables['realization'].append({'Metric': 'Overall', 'Value': kpis['REALIZATION_RATE']})
+        for row in outcomes_week.itertuples():
+            if row.valued_value > 0:
+                tables['realization'].append({'Metric': row.broker or PLACEHOLDER, 'Value': f"{row.sold_value / row.valued_value:.2%} ({row.lots_sold:,.0f}/{row.lots_offered:,.0f} lots sold)"})
+    else:
+        kpis['REALIZATION_RATE'] = 'N/A'
+        tables['realization'].append({'Metric': 'Status', 'Value': 'Insufficient Data'})
 
     # 4. Snapshot Generation (Narrative)
     kpis['SNAPSHOT'] = generate_snapshot(kpis)
@@ -284,9 +337,12 @@ def create_interactive_charts(sales_df_week):
 def create_buyer_chart(sales_df_week):
     """Generates an interactive, side-by-side buyer chart with grade drill-down and Value/Volume switch."""
     if sales_df_week.empty or 'buyer' not in sales_df_week.columns or 'value_usd' not in sales_df_week.columns: return {}
+    # V6: Buyers are charted under their display name (one per group of spellings)
+    if 'buyer_name' in sales_df_week.columns:
+        sales_df_week = sales_df_week.assign(buyer=sales_df_week['buyer_name'])
 
     # 1. Main Buyer Aggregation
-    buyer_agg = sales_df_week.groupby('buyer').agg(
+    buyer_agg = sales_df_week.groupby('buyer', observed=True).agg(
         total_value=('value_usd', 'sum'),
         total_volume=('quantity_kgs', 'sum')
     ).reset_index()
@@ -389,8 +445,13 @@ def analyze_price_movements(sales_df_week, sales_df_all):
     previous_sale_number = previous_sales['sale_number'].max()
     prev_week_df = sales_df_all[sales_df_all['sale_number'] == previous_sale_number]
 
+    # V6: Gardens are compared under their display name, so a respelled mark still matches
+    if 'mark_name' in sales_df_week.columns:
+        sales_df_week = sales_df_week.assign(mark=sales_df_week['mark_name'])
+        prev_week_df = prev_week_df.assign(mark=prev_week_df['mark_name'])
+
     # 1. Calculate Current Week Metrics (OHLC)
-    current_metrics = sales_df_week.groupby(['mark', 'grade']).agg(
+    current_metrics = sales_df_week.groupby(['mark', 'grade'], observed=True).agg(
         close=('price', 'mean'),
         high=('price', 'max'),
         low=('price', 'min'),
@@ -398,7 +459,7 @@ def analyze_price_movements(sales_df_week, sales_df_all):
     ).reset_index()
 
     # 2. Calculate Previous Week Average (Open)
-    prev_metrics = prev_week_df.groupby(['mark', 'grade']).agg(
+    prev_metrics = prev_week_df.groupby(['mark', 'grade'], observed=True).agg(
         open=('price', 'mean')
     ).reset_index()
 
@@ -507,7 +568,7 @@ def generate_raw_data_export(sales_df_week):
 
     if not available_cols: return []
 
-    export_df = sales_df_week[available_cols].copy()
+    export_df = sales_df_week[available_cols].astype(object)
     
     # Rename columns for display
     rename_map = {
@@ -561,25 +622,66 @@ def generate_forecast_outlook(week_number, location, offers_df_all):
     return outlook
 
 
+# =============================================================================
+# V6: Incremental Rendering
+# =============================================================================
+
+def load_report_index():
+    """The entries of the existing index file whose report JSON is still there ([] if none)."""
+    try:
+        with open(INDEX_FILE) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return [entry for entry in entries if os.path.exists(os.path.join(DATA_OUTPUT_DIR, entry.get('filename', '')))]
+
+def select_weeks_to_render(all_weeks, changed_weeks, sales_weeks, offer_weeks):
+    """The weeks whose report depends on a changed sale: the sale itself, the next sale with
+    sales (its price change and movers compare against this one) and the weeks whose
+    outlook previews it (those after the previous sale with offers)."""
+    affected = set()
+    for week in changed_weeks:
+        affected.add(week)
+        later_sales = [w for w in sales_weeks if w > week]
+        if later_sales:
+            affected.add(min(later_sales))
+        earlier_offers = [w for w in offer_weeks if w < week]
+        affected.update(w for w in all_weeks if w < week and (not earlier_offers or w >= max(earlier_offers)))
+    return [week for week in all_weeks if week in affected]
+
 # =============================================================================
 # Main Processing Loop
 # =============================================================================
 
-def main():
+def main(full=False):
     logging.info("Starting Mombasa Data Analysis (Final Polish Mode)...")
 
     if not os.path.exists(DATA_OUTPUT_DIR): os.makedirs(DATA_OUTPUT_DIR)
 
     conn = connect_db()
+
+    # V6: Only the sales the ETL wrote since the last run need new reports (change_log).
+    # Without a cursor or an index (first run) or with --full, every week is rendered.
+    changed_sales, last_change_id = read_changed_sales(conn, CHANGE_CONSUMER, CHANGE_TABLES)
+    previous_index = [] if full or changed_sales is None else load_report_index()
+    if previous_index and not changed_sales:
+        logging.info("No sales changed since the last run. Reports are up to date.")
+        commit_changes(conn, CHANGE_CONSUMER, last_change_id)
+        conn.close()
+        return
+
     sales_df_raw, offers_df_raw = fetch_data(conn)
     sales_df_all = prepare_sales_data(sales_df_raw)
 
     # Determine unique weeks
     all_weeks = []
+    sales_weeks, offer_weeks = [], []
     if 'sale_number' in sales_df_raw.columns and not sales_df_raw.empty:
-        all_weeks.extend(sales_df_raw['sale_number'].dropna().unique())
+        sales_weeks = list(sales_df_raw['sale_number'].dropna().unique())
+        all_weeks.extend(sales_weeks)
     if 'sale_number' in offers_df_raw.columns and not offers_df_raw.empty:
-        all_weeks.extend(offers_df_raw['sale_number'].dropna().unique())
+        offer_weeks = list(offers_df_raw['sale_number'].dropna().unique())
+        all_weeks.extend(offer_weeks)
 
     # Ensure sorting is robust
     try:
@@ -592,10 +694,22 @@ def main():
     if len(all_weeks) == 0:
         logging.info("No sale data found in database. Exiting."); return
 
+    # V6: Re-render the affected weeks (and any week without a report); keep the other index entries
+    weeks_to_render = all_weeks
     report_index = []
+    if previous_index:
+        changed_weeks = {sale_number for _, sale_number in changed_sales}
+        indexed_weeks = {entry['sale_number'] for entry in previous_index}
+        weeks_to_render = [week for week in all_weeks
+                           if week in select_weeks_to_render(all_weeks, changed_weeks, sales_weeks, offer_weeks)
+                           or str(week) not in indexed_weeks]
+        rendered = {str(week) for week in weeks_to_render}
+        current = {str(week) for week in all_weeks}
+        report_index = [entry for entry in previous_index if entry['sale_number'] in current and entry['sale_number'] not in rendered]
+        logging.info(f"{len(changed_weeks)} sales changed since the last run; rendering {len(weeks_to_render)} of {len(all_weeks)} weeks.")
 
     # Process each week individually
-    for week_number in all_weeks:
+    for week_number in weeks_to_render:
         logging.info(f"Processing Sale: {week_number}")
 
         # Get the raw data for the week
@@ -624,7 +738,8 @@ def main():
             sale_num_only = week_number
 
         # Run Analysis (KPIs and Forecast)
-        kpis, forecast_tables = analyze_kpis_and_forecast(sales_week, sales_df_all, sales_week_raw, offers_week)
+        outcomes_week = fetch_lot_outcomes(conn, week_number, location)
+        kpis, forecast_tables = analyze_kpis_and_forecast(sales_week, sales_df_all, sales_week_raw, offers_week, outcomes_week)
 
         # Advanced Analysis
         movement_data, analytical_insights = analyze_price_movements(sales_week, sales_df_all)
@@ -690,8 +805,18 @@ def main():
     except Exception as e:
         logging.error(f"Error saving index file: {e}")
 
+    commit_changes(conn, CHANGE_CONSUMER, last_change_id)
     conn.close()
     logging.info("Analysis Complete.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mombasa Data Analyzer (weekly report JSON)")
+    parser.add_argument(
+        '--full', action='store_true',
+        help="Re-render every week instead of the sales changed since the last run."
+    )
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    main(full=args.full)
\ No newline at end of file
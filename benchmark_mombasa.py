@@ -0,0 +1,421 @@
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import openpyxl
+
+import process_mombasa_data as processor
+
+try:
+    import resource # Peak memory (ru_maxrss); not available on Windows
+except ImportError:
+    resource = None
+
+# Configuration
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Mombasa")
+ENGINES = ['openpyxl', 'calamine']
+
+# Configure logging to stdout (process_mombasa_data has already configured the root logger)
+logging.getLogger().handlers = [logging.StreamHandler(sys.stdout)]
+logging.getLogger().handlers[0].setFormatter(logging.Formatter('BENCHMARK: %(message)s'))
+
+# =============================================================================
+# Excel Reader Backends
+# =============================================================================
+
+def available_engines():
+    return [engine for engine in ENGINES if processor.resolve_excel_engine(engine) == engine]
+
+def time_read_workbook(filepath, engine, repeats):
+    """Best-of-N time to open a workbook and read every sheet into a raw grid."""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        workbook = processor.open_workbook(filepath, engine)
+        try:
+            for sheetname in workbook['sheet_names']:
+                processor.read_sheet_rows(workbook, sheetname)
+        finally:
+            processor.close_workbook(workbook)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def parse_with_engine(filepath, filename, engine):
+    """Runs the real handler with a given backend. Returns comparable results and header rows."""
+    processor.set_excel_engine(engine)
+    root_logger = logging.getLogger()
+    previous_level = root_logger.level
+    root_logger.setLevel(logging.WARNING)
+    try:
+        handler = processor.route_structured_file(filename, filepath)
+        results = processor.parse_structured_file(filepath, filename, handler)
+
+        header_rows = {}
+        if handler == processor.HANDLER_COMPLETE_OFFER_LOTS:
+            workbook = processor.open_workbook(filepath)
+            try:
+                for sheetname in workbook['sheet_names']:
+                    header_rows[sheetname] = processor.find_header_row(workbook, sheetname, processor.HEADER_KEYWORDS)
+            finally:
+                processor.close_workbook(workbook)
+    finally:
+        root_logger.setLevel(previous_level)
+
+    frames = {}
+    for result in results:
+        df = result['df']
+        if df is not None:
+            df = df.drop(columns=['processed_timestamp'], errors='ignore').reset_index(drop=True)
+        frames[(result['file_identifier'], result['data_type'])] = (result['status'], df)
+    return frames, header_rows
+
+def results_identical(left, right):
+    if left[1] != right[1] or left[0].keys() != right[0].keys():
+        return False
+    for key, (status, df) in left[0].items():
+        other_status, other_df = right[0][key]
+        if status != other_status:
+            return False
+        if (df is None) != (other_df is None):
+            return False
+        if df is not None and not df.equals(other_df):
+            return False
+    return True
+
+def benchmark_excel_engines(directory, repeats=3):
+    # Time the xlsx readers themselves, not reads served from the Parquet landing zone
+    processor.set_landing_zone(None)
+    engines = available_engines()
+    if len(engines) < 2:
+        logging.warning("python-calamine is not installed; only openpyxl will be timed. pip install python-calamine")
+
+    files = sorted(f for f in os.listdir(directory) if f.lower().endswith('.xlsx') and not f.startswith('~$'))
+    logging.info(f"Timing {len(files)} workbooks in {directory} (best of {repeats}) with: {', '.join(engines)}")
+
+    totals = {engine: 0.0 for engine in engines}
+    all_identical = True
+    header = f"{'File':<50}" + "".join(f"{engine:>12}" for engine in engines) + f"{'Speedup':>10}{'Identical':>11}"
+    logging.info(header)
+    logging.info("-" * len(header))
+
+    for filename in files:
+        filepath = os.path.join(directory, filename)
+        timings = {engine: time_read_workbook(filepath, engine, repeats) for engine in engines}
+        for engine, elapsed in timings.items():
+            totals[engine] += elapsed
+
+        speedup, identical = "", ""
+        if len(engines) > 1:
+            speedup = f"{timings['openpyxl'] / timings['calamine']:.1f}x"
+            parsed = [parse_with_engine(filepath, filename, engine) for engine in engines]
+            identical = results_identical(parsed[0], parsed[1])
+            all_identical = all_identical and identical
+
+        logging.info(f"{filename[:49]:<50}" + "".join(f"{timings[e]:>11.3f}s" for e in engines) + f"{speedup:>10}{str(identical):>11}")
+
+    logging.info("-" * len(header))
+    total_speedup = f"{totals['openpyxl'] / totals['calamine']:.1f}x" if len(engines) > 1 else ""
+    logging.info(f"{'TOTAL':<50}" + "".join(f"{totals[e]:>11.3f}s" for e in engines) + f"{total_speedup:>10}{str(all_identical) if len(engines) > 1 else '':>11}")
+    return all_identical
+
+# =============================================================================
+# Synthetic Workbooks
+# Writes AuctionSummary, CompleteOfferLots, GeneralReport and Sale Catalogue
+# workbooks with the filenames, sheet layouts and headers of the real Mombasa
+# files, so every handler, header detection and column alias path is exercised.
+# Each lot appears in all four reports of its sale, as in a real week.
+# =============================================================================
+
+SYNTHETIC_YEAR = 2025
+SYNTHETIC_FIRST_SALE_DATE = date(2025, 1, 6) # Sales are weekly, on Mondays
+SYNTHETIC_BROKERS = ['ABBL', 'AMBR', 'ANJL', 'ATBL', 'ATLS', 'BICL', 'BTBL', 'CENT', 'COMK', 'CTBL', 'PRME', 'PTBL', 'TBEA', 'TTBL', 'UNTB', 'VENS']
+SYNTHETIC_GARDENS = [
+    'GITHONGO', 'IMENTI', 'KINORO', 'MUNUNGA', 'CHELAL', 'KIMUNYE', 'ROROK', 'KOBEL', 'MOGOGO', 'ANKOLE',
+    'GACHARAGE', 'KITABI', 'NDIMA', 'KANGAITA', 'MICHIMIKURU', 'KAMBAA', 'THETA', 'IRIAINI', 'NYANKOBA', 'TEGAT',
+]
+SYNTHETIC_MAIN_GRADES = ['BP1', 'PF1', 'PD', 'D1']
+SYNTHETIC_SECONDARY_GRADES = ['BP', 'PF', 'DUST', 'F1', 'BMF', 'FNGS', 'D2', 'PDUST']
+SYNTHETIC_BUYERS = [
+    ('ATL', 'ABBAS TRADERS LTD'), ('GTC', 'GLOBAL TEA & COMMODITIES (K) LTD'), ('JTL', 'JAMES FINLAY (K) LTD'),
+    ('MTL', 'MAMBA TEA LTD'), ('CTL', 'CHAI TRADING LTD'), ('STL', 'SAFARI TEA LTD'),
+]
+SYNTHETIC_SOLD_SHARE = 0.85 # Lots without a bid are in the offers but not in the General Report's sold lots
+
+DETAIL_HEADER = ['Auction', 'Type', 'Broker', 'LotNo', 'Garden', 'Grade', 'Invoice', 'Pkgs', 'Kilos', 'RP', 'Country', 'Rift', 'Zone', 'RA', 'Whse', 'Producer']
+SUMMARY_HEADER = ['Region/Grade', 'Lots', 'Pkgs', 'Kilos']
+OFFER_LOTS_HEADER = ['Lot No', 'Re-Print', 'Country', 'Garden', 'Grade', 'Invoice', 'Pkgs', 'TP', 'Nett WT.', 'Kilos', 'Last High', 'Last Low', 'Prev High', 'Prev Low', 'Manf Date', 'Certif.', 'Producer Code.', 'Require Sample?']
+GENERAL_REPORT_HEADER = [
+    'Broker', 'Lot No', 'Selling Mark', 'Grade', 'Invoice No', 'Sub Elevation', 'Sale Code', 'Category', 'RP', 'RA', 'Certifications',
+    'Bags', 'Net Weight', 'Total Weight', 'Valuation', 'Asking Price', 'Total Price', 'Status', 'Purchased Price', 'Buyer', 'Buyer Name',
+    'Factory', 'Producer Country', 'Warehouse company', 'Manufactured Date', 'Selling End Time', 'Producer', 'Final Buyer', '', '', 'Final Price', '',
+]
+# The second header row that the GeneralReport handler drops as noise
+GENERAL_REPORT_SUBHEADER = [''] * 27 + ['Buyer Company Name', 'Buyer Code', 'Buyer Company User', 'Price', 'Total Value']
+CATALOGUE_HEADER = [
+    'Broker', 'Category', 'Factory', 'Selling Mark - MF Mark', 'Lot No', 'Reprint', 'Bags', 'Net Weight', 'Grade', 'Invoice No',
+    'Asking Price', 'Rainforest', 'Certifications', 'Sale Date', 'Total Weight', 'Tare Weight', 'Total Gross Weight', 'Warrant Number',
+    'Original Weight', 'Warehouse', 'Warehouse Location', 'Manufactured Date', 'Producer Name', 'Producer Code', 'Resale Buyer',
+]
+
+def generate_sale_lots(rng, sale, lot_count):
+    """Random but plausible lots of one sale."""
+    lots = []
+    first_lot = 10000 + sale * 1000
+    for index in range(lot_count):
+        main = rng.random() < 0.7
+        bags = rng.choice([20, 40]) if main else rng.choice([10, 20])
+        net = rng.choice([50, 60, 68, 75, 79])
+        valuation = round(rng.uniform(1.5, 4.5), 2)
+        sold = rng.random() < SYNTHETIC_SOLD_SHARE
+        garden = rng.choice(SYNTHETIC_GARDENS)
+        lots.append({
+            'broker': SYNTHETIC_BROKERS[index % len(SYNTHETIC_BROKERS)],
+            'lot_number': first_lot + index,
+            'garden': garden,
+            'grade': rng.choice(SYNTHETIC_MAIN_GRADES if main else SYNTHETIC_SECONDARY_GRADES),
+            'invoice': f"{garden[:2]}{SYNTHETIC_YEAR % 100}{index:06d}",
+            'category': f"M{rng.randint(1, 5)}" if main else f"S{rng.randint(1, 3)}",
+            'main': main,
+            'bags': bags,
+            'net': net,
+            'kilos': bags * net,
+            'valuation': valuation,
+            'price': round(valuation + rng.uniform(-0.3, 0.5), 2) if sold else None,
+            'buyer': rng.choice(SYNTHETIC_BUYERS) if sold else None,
+        })
+    return lots
+
+def write_workbook(path, sheets):
+    """sheets: sheet name -> iterable of rows. Written in write-only mode (streamed)."""
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheetname, rows in sheets.items():
+        worksheet = workbook.create_sheet(sheetname)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+
+def summary_rows(title, lots):
+    totals = {}
+    for lot in lots:
+        grade_totals = totals.setdefault(lot['grade'], [0, 0, 0])
+        grade_totals[0] += 1
+        grade_totals[1] += lot['bags']
+        grade_totals[2] += lot['kilos']
+    yield [title]
+    yield []
+    yield SUMMARY_HEADER
+    for grade, (count, bags, kilos) in sorted(totals.items()):
+        yield [grade, count, bags, kilos]
+    yield ['TOTAL', len(lots), sum(t[1] for t in totals.values()), sum(t[2] for t in totals.values())]
+
+def detail_rows(sale_code, lots):
+    yield DETAIL_HEADER
+    for lot in lots:
+        yield [sale_code, lot['category'], lot['broker'], str(lot['lot_number']), lot['garden'], lot['grade'], lot['invoice'],
+               lot['bags'], lot['kilos'], '', 'Kenya', '', '', 'RA', 'CTCW', 'KTDA']
+
+def offer_lots_rows(broker, sale_code, lots):
+    yield [broker]
+    yield ['DETAILED CATALOGUE']
+    yield ['Sale No:', sale_code]
+    yield ['Sale Date:']
+    yield []
+    yield [''] * 10 + ['Last', 'Last', 'Prev', 'Prev']
+    yield OFFER_LOTS_HEADER
+    for lot in lots:
+        high = int(lot['valuation'] * 100)
+        yield [str(lot['lot_number']), '', 'Kenya', lot['garden'], lot['grade'], lot['invoice'], str(lot['bags']), 'TPP',
+               str(lot['kilos']), str(lot['net']), high, high - 4, high + 6, high - 8, '5 Aug 25', 'RA', 'KTDA', '']
+
+def general_report_rows(sale, sale_date, lots):
+    yield GENERAL_REPORT_HEADER
+    yield GENERAL_REPORT_SUBHEADER
+    selling_end = (sale_date + timedelta(days=1)).strftime("%d/%m/%Y")
+    for index, lot in enumerate(lots):
+        if lot['price'] is None:
+            continue
+        buyer_code, buyer_name = lot['buyer']
+        total_price = round(lot['price'] * lot['kilos'], 2)
+        yield [lot['broker'], lot['lot_number'], lot['garden'], lot['grade'], lot['invoice'], '', f"Sale {sale} - {lot['category']}",
+               lot['category'], 'No', 'Yes', '', lot['bags'], lot['net'], lot['kilos'], lot['valuation'], lot['valuation'], total_price,
+               'Sold', lot['price'], buyer_code, buyer_name, lot['garden'], 'Kenya', 'CTCW', '2025/07/29',
+               f"{selling_end} {10 + index % 6:02d}:{index % 60:02d}:00:000", 'KTDA MANAGEMENT SERVICES LIMITED',
+               buyer_name, buyer_code, 'Trader', lot['price'], total_price]
+
+def catalogue_rows(sale_date, lots):
+    yield CATALOGUE_HEADER
+    for lot in lots:
+        yield [lot['broker'], lot['category'], lot['garden'], f"{lot['garden']} - ", lot['lot_number'], 'No', lot['bags'], lot['net'],
+               lot['grade'], lot['invoice'], lot['valuation'], 'Yes', '', sale_date.isoformat(), lot['kilos'], 30, lot['kilos'] + 30,
+               '', 0, 'CTCW', '', '2025-08-05', 'KTDA MANAGEMENT SERVICES LIMITED', 'KTDA', '']
+
+def generate_workbooks(directory, lots=10000, sales=4, seed=0):
+    """Writes the four workbook types for sales 1..sales with lots lots in total.
+    Returns the number of data rows written."""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    rows_written = 0
+    for sale in range(1, sales + 1):
+        lot_count = lots // sales + (1 if sale <= lots % sales else 0)
+        sale_lots = generate_sale_lots(rng, sale, lot_count)
+        sale_date = SYNTHETIC_FIRST_SALE_DATE + timedelta(weeks=sale - 1)
+        sale_code = f"{SYNTHETIC_YEAR}/{sale:02d}"
+        ddmmyy = sale_date.strftime("%d%m%y")
+
+        write_workbook(os.path.join(directory, f"AuctionSummary_[{SYNTHETIC_YEAR}-{sale:02d}]_{ddmmyy}.xlsx"), {
+            'Main Summary': summary_rows('MAIN AUCTION', [lot for lot in sale_lots if lot['main']]),
+            'Secondary Summary': summary_rows('SECONDARY AUCTION', [lot for lot in sale_lots if not lot['main']]),
+            'Detail': detail_rows(sale_code, sale_lots),
+        })
+        write_workbook(os.path.join(directory, f"CompleteOfferLots_{SYNTHETIC_YEAR}-{sale:02d}_{ddmmyy}.xlsx"), {
+            broker: offer_lots_rows(broker, sale_code, [lot for lot in sale_lots if lot['broker'] == broker])
+            for broker in SYNTHETIC_BROKERS
+        })
+        write_workbook(os.path.join(directory, f"GeneralReport ({sale}).xlsx"), {
+            'General Report': general_report_rows(sale, sale_date, sale_lots),
+        })
+        write_workbook(os.path.join(directory, f"Sale {sale:02d}_Catalogue_{sale_date.strftime('%d_%m_%Y')} 09_00_00 AM.xlsx"), {
+            'Sheet1': catalogue_rows(sale_date, sale_lots),
+        })
+        rows_written += 3 * len(sale_lots) + sum(1 for lot in sale_lots if lot['price'] is not None)
+        logging.info(f"  Sale {sale:02d}: {len(sale_lots)} lots")
+    return rows_written
+
+# =============================================================================
+# Ingestion Throughput
+# Runs run_processor (forced full load) over a directory into a scratch database
+# and reports rows/sec, peak memory and the time spent per handler. Each run is
+# done in a fresh process, so the peak memory is that of the run alone.
+# =============================================================================
+
+def peak_memory_mb():
+    """Peak RSS of this process and of its finished child processes (parse workers), or None."""
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024 # ru_maxrss is bytes on macOS, KiB elsewhere
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / scale
+
+def run_ingestion(directory, workers=1, stream=False, landing=False):
+    """One forced run_processor over directory into a scratch database. Returns the measurements.
+    Handler parse times are only measured serially (with workers > 1 parsing happens in the pool)."""
+    work_dir = tempfile.mkdtemp(prefix="mombasa_ingest_")
+    processor.MOMBASA_DIR = directory
+    processor.DB_FILE = os.path.join(work_dir, "market_reports.db")
+    processor.set_landing_zone(os.path.join(work_dir, "landing_zone") if landing else None)
+
+    handlers = {}
+    def handler_stats(handler):
+        return handlers.setdefault(handler or 'UNRECOGNIZED', {'files': 0, 'rows': 0, 'parse': 0.0, 'load': 0.0})
+
+    parse_structured_file = processor.parse_structured_file
+    write_load_results = processor.write_load_results
+
+    def timed_parse(filepath, filename, handler=None):
+        start = time.perf_counter()
+        try:
+            return parse_structured_file(filepath, filename, handler)
+        finally:
+            handler_stats(handler)['parse'] += time.perf_counter() - start
+
+    def timed_write(conn, results, filename=None, fingerprint=None, handler=None):
+        start = time.perf_counter()
+        rows = write_load_results(conn, results, filename, fingerprint, handler)
+        stats = handler_stats(handler)
+        stats['load'] += time.perf_counter() - start # Includes the parse of streamed files
+        stats['files'] += 1
+        stats['rows'] += rows
+        return rows
+
+    if workers == 1:
+        processor.parse_structured_file = timed_parse
+    processor.write_load_results = timed_write
+    root_logger = logging.getLogger()
+    previous_level = root_logger.level
+    root_logger.setLevel(logging.WARNING)
+    try:
+        start = time.perf_counter()
+        processor.run_processor(workers=workers, force=True, stream=stream, landing=landing)
+        wall = time.perf_counter() - start
+    finally:
+        root_logger.setLevel(previous_level)
+        processor.parse_structured_file = parse_structured_file
+        processor.write_load_results = write_load_results
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'wall': wall, 'handlers': handlers, 'peak_mb': peak_memory_mb(), 'parse_timed': workers == 1}
+
+def benchmark_ingestion(directory, workers=1, stream=False, landing=False):
+    files = [f for f in os.listdir(directory) if not f.startswith('~$')]
+    logging.info(f"Ingesting {len(files)} files from {directory} (workers={workers}, stream={stream}, landing={landing})")
+
+    # A spawned (not forked) process starts with a clean heap, so ru_maxrss is this run's peak.
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        result = pool.submit(run_ingestion, directory, workers, stream, landing).result()
+
+    header = f"{'Handler':<22}{'Files':>7}{'Rows':>11}{'Parse':>10}{'Load':>10}{'Total':>10}{'Rows/s':>11}"
+    logging.info(header)
+    logging.info("-" * len(header))
+    handler_total = 0.0
+    total_rows = 0
+    for handler, stats in sorted(result['handlers'].items()):
+        elapsed = stats['parse'] + stats['load']
+        handler_total += elapsed
+        total_rows += stats['rows']
+        parse = f"{stats['parse']:>9.2f}s" if result['parse_timed'] else f"{'-':>10}"
+        rate = f"{stats['rows'] / elapsed:>11,.0f}" if elapsed else f"{'-':>11}"
+        logging.info(f"{handler:<22}{stats['files']:>7}{stats['rows']:>11,}{parse}{stats['load']:>9.2f}s{elapsed:>9.2f}s{rate}")
+    logging.info(f"{'Other':<22}{'':>7}{'':>11}{'':>10}{'':>10}{max(result['wall'] - handler_total, 0):>9.2f}s")
+    logging.info("-" * len(header))
+    logging.info(f"{'TOTAL':<22}{'':>7}{total_rows:>11,}{'':>10}{'':>10}{result['wall']:>9.2f}s{total_rows / result['wall']:>11,.0f}")
+    logging.info("Other = hashing, waiting on parse workers, unstructured reports, ANALYZE and checkpoint. Streamed files are parsed inside Load.")
+    peak = f"{result['peak_mb']:.0f} MB" if result['peak_mb'] is not None else "n/a (no resource module on this platform)"
+    logging.info(f"Peak memory: {peak}")
+    return result
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the Mombasa ETL")
+    parser.add_argument('--dir', default=DEFAULT_DIR, help="Directory with sample .xlsx workbooks.")
+    parser.add_argument('--repeats', type=int, default=3, help="Timing repeats per file (best is reported).")
+    parser.add_argument('--ingest', action='store_true', help="Benchmark a full run_processor load of --dir instead of the XLSX readers.")
+    parser.add_argument('--generate', type=int, metavar='LOTS', help="Write synthetic workbooks with LOTS lots in total, then run --ingest on them.")
+    parser.add_argument('--sales', type=int, default=4, help="Number of weekly sales for --generate (1-52). Default: 4.")
+    parser.add_argument('--out', help="Directory for --generate (default: a temporary directory, removed afterwards).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for --generate.")
+    parser.add_argument('--workers', type=int, default=1, help="run_processor workers for --ingest.")
+    parser.add_argument('--stream', action='store_true', help="run_processor --stream for --ingest.")
+    parser.add_argument('--landing', action='store_true', help="Use the Parquet landing zone for --ingest (off by default).")
+    args = parser.parse_args(argv)
+    if not 1 <= args.sales <= 52:
+        parser.error("--sales must be between 1 and 52")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.generate:
+        directory = args.out or tempfile.mkdtemp(prefix="mombasa_synthetic_")
+        start = time.perf_counter()
+        logging.info(f"Generating {args.generate} lots over {args.sales} sales in {directory}")
+        rows = generate_workbooks(directory, args.generate, args.sales, args.seed)
+        logging.info(f"Wrote {rows:,} data rows in {time.perf_counter() - start:.1f}s")
+        try:
+            benchmark_ingestion(directory, args.workers, args.stream, args.landing)
+        finally:
+            if not args.out:
+                shutil.rmtree(directory, ignore_errors=True)
+    elif args.ingest:
+        benchmark_ingestion(args.dir, args.workers, args.stream, args.landing)
+    else:
+        identical = benchmark_excel_engines(args.dir, args.repeats)
+        if not identical:
+            logging.error("Backends produced different results. See the Identical column.")
+            sys.exit(1)
@@ -5,12 +5,15 @@ import sys
 import glob
 # Import urllib.parse to safely encode URL parameters
 import urllib.parse
+from warehouse_db import connect_database, read_changed_sales, commit_changes
 
 # Configuration
 DATA_DIR = "report_data"
 LIBRARY_FILE = "market-reports-library.json"
 # Define the viewer page URL
 VIEWER_PAGE = "report_viewer.html"
+DB_FILE = "market_reports.db"
+CHANGE_CONSUMER = "build_library" # V6: This script's cursor in change_log_cursors
 
 # Configure logging to stdout for automation capture
 logging.basicConfig(level=logging.INFO, format='BUILDER: %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
@@ -62,9 +65,25 @@ def transform_to_library_format(item, source_name="TeaTrade Analytics"):
         logging.error(f"Skipping item due to missing key {e}: {item}")
         return None
 
+def library_is_current(changed_sales, index_files):
+    """V6: True when no sale changed since the last build and no index file was rewritten after
+    the library (the analyzer runs in between, so a dirty sale reaches the library through its index)."""
+    if changed_sales is None or changed_sales or not os.path.exists(LIBRARY_FILE):
+        return False
+    library_mtime = os.path.getmtime(LIBRARY_FILE)
+    return all(os.path.getmtime(path) <= library_mtime for path in index_files)
+
 def main():
     logging.info("Starting Library Consolidation Process...")
     index_files = find_index_files(DATA_DIR)
+
+    # V6: Skip the rebuild when change_log has nothing new for this consumer
+    conn = connect_database(DB_FILE, reader=True) if os.path.exists(DB_FILE) else None
+    changed_sales, last_change_id = read_changed_sales(conn, CHANGE_CONSUMER) if conn else (None, None)
+    if library_is_current(changed_sales, index_files):
+        logging.info(f"No sales changed since the last build. {LIBRARY_FILE} is up to date.")
+        conn.close()
+        return
     all_library_data = []
 
     if not index_files:
@@ -104,8 +123,13 @@ def main():
         with open(LIBRARY_FILE, 'w') as f:
             json.dump(all_library_data, f, indent=2)
         logging.info(f"Successfully generated {LIBRARY_FILE} with {len(all_library_data)} entries.")
+        if conn:
+            commit_changes(conn, CHANGE_CONSUMER, last_change_id)
     except Exception as e:
         logging.error(f"Error saving library file: {e}")
 
+    if conn:
+        conn.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,26 @@
 import sqlite3
 import pandas as pd
+import numpy as np
+from pandas.io.parsers import TextParser
+from pandas.errors import EmptyDataError
 import os
 import re
-from datetime import datetime
+from datetime import datetime, date, timedelta, time as datetime_time
 import time
 import logging
 import warnings
+import argparse
+import hashlib
+import json
+import functools
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+from warehouse_db import (
+    connect_database, checkpoint_database, attach_partition, partition_file, partition_schemas,
+    has_table, create_lot_views, partition_schema, FACT_TABLES
+)
 
 # Imports for unstructured data processing
 try:
@@ -16,6 +31,24 @@ try:
     import docx
 except ImportError:
     docx = None
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+try:
+    import python_calamine  # Optional Rust-backed .xlsx reader (pip install python-calamine)
+except ImportError:
+    python_calamine = None
+try:
+    from rapidfuzz.distance import Levenshtein  # Optional C edit distance for mark matching (pip install rapidfuzz)
+except ImportError:
+    Levenshtein = None
+try:
+    import pyarrow as pa  # Optional: Parquet landing zone (pip install pyarrow)
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
 # =============================================================================
 # Configuration
@@ -24,6 +57,15 @@ except ImportError:
 DB_FILE = "market_reports.db"
 MOMBASA_DIR = r"C:\Users\mikin\projects\NewTeaTrade\Mombasa"
 SOURCE_LOCATION = "Mombasa"
+STREAM_CHUNK_ROWS = 5000 # V6: Rows per chunk when streaming GeneralReport sheets (--stream)
+EXCEL_ENGINE = 'auto' # V6: 'auto' (calamine if installed), 'calamine' or 'openpyxl'
+LANDING_ZONE_DIR = "landing_zone" # V6: Parquet copies of parsed sheets, keyed by content hash (None disables)
+PDF_PAGES_PER_TASK = 4 # V6: PDF pages extracted per process pool task
+METRICS_SUMMARY_SUFFIX = ".metrics.json" # V6: Per-run ingest summary written next to DB_FILE
+CLASSIFY_SCAN_ROWS = 20 # V6: Rows per sheet read to recognize a workbook's layout
+WATCH_POLL_SECONDS = 2 # V6: --watch: how often MOMBASA_DIR is listed
+WATCH_SETTLE_SECONDS = 5 # V6: --watch: a file is ingested once its size and mtime stop changing for this long
+INGEST_RUN_ID = None # V6: Set by run_processor; ingest_metrics rows are recorded under it
 
 warnings.filterwarnings("ignore", message="Cannot parse header or footer so it will be ignored")
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -33,6 +75,9 @@ DATA_TYPE_OFFER = 'OFFER'
 DATA_TYPE_SALE = 'SALE'
 DATA_TYPE_SUMMARY = 'SUMMARY'
 DATA_TYPE_COMMENTARY = 'COMMENTARY'
+DATA_TYPE_FILE = 'FILE' # V6: File-level processing_log entry holding the content hash
+DATA_TYPE_PRICES = 'PRICES' # V6: Price tables parsed from average/comparative price PDFs
+DATA_TYPE_QUANTITY = 'QUANTITY' # V6: Season volume series from the "Auction Quantity" workbook
 
 # V5: Define the prioritized list for Mark (Garden) used in COALESCE strategy
 MARK_ALIASES = ['Selling Mark', 'Garden', 'Mark', 'Estate', 'Factory', 'Selling Mark - MF Mark']
@@ -62,42 +107,170 @@ COLUMN_MAP_GRADE_SUMMARY = {
 
 HEADER_KEYWORDS = ['LotNo', 'Garden', 'Grade', 'Invoice', 'Pkgs', 'Kilos', 'RP', 'Valuation']
 
+# V6: Name canonicalization (mark_aliases). Lot tables get the canonical ID of these columns.
+CANONICAL_COLUMNS = {
+    'auction_sales': [('mark', 'MARK', 'mark_id'), ('buyer', 'BUYER', 'buyer_id')],
+    'auction_offers': [('mark', 'MARK', 'mark_id')],
+}
+NAME_NOISE_WORDS = ['TEA', 'TEAS', 'FACTORY', 'ESTATE', 'ESTATES', 'LTD', 'LIMITED'] # Dropped from the end of a name
+FUZZY_MIN_SIMILARITY = 0.88 # 1 - edits / length: one typo from 9 characters up, two from 17
+FUZZY_MIN_LENGTH = 6 # Shorter keys (and buyer codes) only match exactly
+FUZZY_NAME_TYPES = ['MARK']
+
+# V6: Dictionary encoding. auction_sales/auction_offers are views over fact tables (FACT_TABLES,
+# one pair per year partition) that hold integer keys into small dimension tables instead of
+# repeating the names on every row.
+DIMENSION_TABLES = { # dimension table -> (lot columns it holds, key column in the fact tables)
+    'dim_brokers': (['broker'], 'broker_key'),
+    'dim_marks': (['mark'], 'mark_key'), # As loaded; mark_id is still the canonical (mark_aliases) ID
+    'dim_grades': (['grade'], 'grade_key'),
+    'dim_buyers': (['buyer'], 'buyer_key'),
+    'dim_source_files': (['source_file_identifier', 'processed_timestamp'], 'source_file_key'), # One row per sheet load
+}
+
+# V6: Lot validation (rejected_lots). A quantity of zero or less, or one above this multiple of the
+# sheet's median positive quantity, is an outlier. Streamed sheets use the median of their first chunk.
+QUANTITY_OUTLIER_FACTOR = 10
+# Lot columns kept with a rejected row
+REJECTED_COLUMNS = [
+    'source_location', 'sale_date', 'sale_number', 'broker', 'lot_number', 'mark', 'grade', 'invoice_number',
+    'quantity_kgs', 'package_count', 'price', 'buyer', 'valuation_or_rp',
+]
+
+# V6: Secondary indexes (name -> (table, columns)) for per-sale, per-garden and per-buyer lookups.
+# Lookups by source_location (+ sale_number) already use the UNIQUE(source_location, sale_number, ...) index.
+SECONDARY_INDEXES = {
+    'idx_sales_sale_number': ('auction_sales_facts', ['sale_number']),
+    'idx_sales_mark_grade': ('auction_sales_facts', ['mark_key', 'grade_key', 'sale_number', 'price', 'quantity_kgs']),
+    'idx_sales_buyer': ('auction_sales_facts', ['buyer_key', 'sale_number', 'price', 'quantity_kgs']),
+    'idx_offers_sale_number': ('auction_offers_facts', ['sale_number']),
+    'idx_offers_mark_grade': ('auction_offers_facts', ['mark_key', 'grade_key', 'sale_number', 'valuation_or_rp']),
+    'idx_outcomes_sale_number': ('lot_outcome_facts', ['source_location', 'sale_number']),
+    'idx_outcomes_broker': ('lot_outcome_facts', ['broker_key', 'sale_number', 'sold', 'realization']),
+    'idx_outcomes_grade': ('lot_outcome_facts', ['grade_key', 'sale_number', 'sold', 'realization']),
+    'idx_outcomes_mark': ('lot_outcome_facts', ['mark_key', 'sale_number', 'sold', 'realization']),
+    'idx_metrics_run': ('ingest_metrics', ['run_id']),
+    'idx_rejected_source': ('rejected_lots', ['source_file_identifier', 'data_type']),
+}
+
+# V6: Lookups that must never fall back to a full table SCAN (checked with --check-indexes)
+QUERY_PLAN_CHECKS = [
+    "SELECT * FROM auction_sales WHERE sale_number = ?",
+    "SELECT * FROM auction_sales WHERE source_location = ? AND sale_number = ?",
+    "SELECT sale_number, price, quantity_kgs FROM auction_sales WHERE mark = ? AND grade = ?",
+    "SELECT sale_number, price, quantity_kgs FROM auction_sales WHERE mark = ?",
+    "SELECT sale_number, price, quantity_kgs FROM auction_sales WHERE buyer = ? AND sale_number = ?",
+    "SELECT * FROM auction_offers WHERE sale_number = ?",
+    "SELECT * FROM auction_offers WHERE source_location = ? AND sale_number = ?",
+    "SELECT sale_number, valuation_or_rp FROM auction_offers WHERE mark = ? AND grade = ?",
+    "SELECT * FROM lot_outcomes WHERE source_location = ? AND sale_number = ?",
+    "SELECT sale_number, sold, realization FROM lot_outcomes WHERE broker = ?",
+    "SELECT sale_number, sold, realization FROM lot_outcomes WHERE grade = ?",
+    "SELECT sale_number, sold, realization FROM lot_outcomes WHERE mark = ?",
+]
+
+# V6: Measures recorded per sheet (and summed per file) in ingest_metrics
+METRIC_COLUMNS = [
+    'input_bytes', 'rows_in', 'rows_dropped', 'rows_upserted',
+    'read_seconds', 'map_seconds', 'clean_seconds', 'upsert_seconds',
+]
+STAGE_COLUMNS = ['read_seconds', 'map_seconds', 'clean_seconds', 'upsert_seconds']
+COUNT_COLUMNS = ['input_bytes', 'rows_in', 'rows_dropped', 'rows_upserted']
+
 # =============================================================================
 # Database Initialization
 # =============================================================================
 
+def add_missing_columns(conn, table_name, columns):
+    """Adds columns (name -> SQL type) that an older database file does not have yet.
+    Returns the columns added."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+    added = []
+    for column, column_type in columns.items():
+        if column not in existing:
+            logging.info(f"  Migrating {table_name}: adding column {column}")
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {column_type}")
+            added.append(column)
+    return added
+
+def requeue_source_files(conn, table_name, route):
+    """V6: For a table created by this run, drops the FILE entries of the files that feed it
+    (route(filename) returns the table name), so the hash gate re-reads them once even though
+    their bytes are unchanged."""
+    identifiers = [row[0] for row in conn.execute("SELECT file_identifier FROM processing_log WHERE data_type = ?", (DATA_TYPE_FILE,))]
+    requeued = [(identifier, DATA_TYPE_FILE) for identifier in identifiers if route(identifier) == table_name]
+    if requeued:
+        logging.info(f"  Migrating {table_name}: re-reading {len(requeued)} files processed before it existed")
+        conn.executemany("DELETE FROM processing_log WHERE file_identifier = ? AND data_type = ?", requeued)
+
 def initialize_database():
     logging.info("Initializing database schema (Offers, Sales, Summaries, Commentary)...")
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with closing(connect_database(DB_FILE)) as conn:
+            existing_tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
             # Processing Log
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS processing_log (
                     id INTEGER PRIMARY KEY, file_identifier TEXT NOT NULL, processed_timestamp TEXT NOT NULL,
                     records_inserted INTEGER, data_type TEXT NOT NULL, status TEXT NOT NULL,
+                    content_hash TEXT, file_size INTEGER, file_mtime REAL,
                     UNIQUE(file_identifier, data_type)
                 )
             """)
-            # Auction Sales (Note: UNIQUE constraints are crucial for UPSERT)
+            # V6: Migrate processing_log tables created before content hashing existed
+            add_missing_columns(conn, 'processing_log', {
+                'content_hash': 'TEXT', 'file_size': 'INTEGER', 'file_mtime': 'REAL'
+            })
+            # V6: Dimension tables (integer surrogate keys for the names repeated on every lot row)
+            for dim_table, (columns, _) in DIMENSION_TABLES.items():
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {dim_table} (
+                        id INTEGER PRIMARY KEY, {', '.join(f'{col} TEXT NOT NULL' for col in columns)},
+                        UNIQUE({', '.join(columns)})
+                    )
+                """)
+            # V6: Lot fact tables of the catalog (rows without a sale year; the others go to the year partitions)
+            create_fact_tables(conn)
+            # V6: Every spelling of a garden mark or buyer seen at ingest, grouped under a canonical ID
             conn.execute("""
-                CREATE TABLE IF NOT EXISTS auction_sales (
-                    id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_date TEXT, sale_number TEXT,
-                    broker TEXT, mark TEXT, grade TEXT, lot_number TEXT NOT NULL, invoice_number TEXT,
-                    quantity_kgs REAL, package_count INTEGER, price REAL NOT NULL, buyer TEXT NOT NULL,
-                    source_file_identifier TEXT NOT NULL, processed_timestamp TEXT NOT NULL,
-                    UNIQUE(source_location, sale_number, lot_number, broker)
+                CREATE TABLE IF NOT EXISTS mark_aliases (
+                    id INTEGER PRIMARY KEY,
+                    name_type TEXT NOT NULL, -- MARK or BUYER
+                    alias TEXT NOT NULL, -- The name as loaded (upper-cased)
+                    name_key TEXT NOT NULL, -- Normalized spelling used for matching (see name_key)
+                    canonical_id INTEGER NOT NULL, -- Group key (id of its first alias) stored in mark_id/buyer_id; readers display the group's most common alias
+                    match_method TEXT NOT NULL, -- NEW, KEY (same normalized spelling) or FUZZY
+                    match_score REAL,
+                    source_file_identifier TEXT, created_timestamp TEXT NOT NULL,
+                    UNIQUE(name_type, alias)
                 )
             """)
-            # Auction Offers
+            # V6: Lot rows that failed validation, one row per rejected lot with the first rule it failed
             conn.execute("""
-                CREATE TABLE IF NOT EXISTS auction_offers (
-                    id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_date TEXT, sale_number TEXT,
-                    broker TEXT, mark TEXT, grade TEXT, lot_number TEXT NOT NULL, invoice_number TEXT,
-                    quantity_kgs REAL, package_count INTEGER, valuation_or_rp REAL,
-                    source_file_identifier TEXT NOT NULL, processed_timestamp TEXT NOT NULL,
-                    UNIQUE(source_location, sale_number, lot_number, broker)
+                CREATE TABLE IF NOT EXISTS rejected_lots (
+                    id INTEGER PRIMARY KEY, source_file_identifier TEXT NOT NULL, data_type TEXT NOT NULL,
+                    reason TEXT NOT NULL, -- e.g. MISSING_PRICE, NON_POSITIVE_PRICE (see lot_validation_rules)
+                    source_location TEXT, sale_date TEXT, sale_number TEXT, broker TEXT, lot_number TEXT,
+                    mark TEXT, grade TEXT, invoice_number TEXT, quantity_kgs REAL, package_count INTEGER,
+                    price REAL, buyer TEXT, valuation_or_rp REAL,
+                    run_id TEXT, rejected_timestamp TEXT NOT NULL
                 )
             """)
+            # V6: Lot tables from before dictionary encoding are plain tables with the names as text
+            text_lot_tables = [table_name for table_name in FACT_TABLES if table_name in existing_tables]
+            if text_lot_tables:
+                # Migrate lot tables created before canonicalization, then give existing rows their IDs
+                added = add_missing_columns(conn, 'auction_sales', {'mark_id': 'INTEGER', 'buyer_id': 'INTEGER'})
+                added += add_missing_columns(conn, 'auction_offers', {'mark_id': 'INTEGER'})
+                if added:
+                    backfill_canonical_ids(conn)
+                for table_name in text_lot_tables:
+                    migrate_to_fact_table(conn, table_name)
+            # V6: Lot rows move to the year partitions; the lot views become per-connection TEMP views
+            for view_name in FACT_TABLES:
+                conn.execute(f"DROP VIEW IF EXISTS main.{view_name}")
+            migrated_years = migrate_to_partitions(conn)
+            backfill_lot_outcomes(conn)
             # Grade Summary
             conn.execute("""
                  CREATE TABLE IF NOT EXISTS grade_summary (
@@ -121,10 +294,353 @@ def initialize_database():
                     UNIQUE(source_location, sale_number, content_type, source_file)
                 )
             """)
+            # V6: Price tables from the "average prices" / "comparative prices" PDFs
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS average_prices (
+                    id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_number TEXT NOT NULL, sale_date TEXT,
+                    region TEXT, mark TEXT NOT NULL, sale_order TEXT, grade TEXT NOT NULL, -- grade or AVERAGE/MAIN AVG/SEC AVG
+                    price REAL NOT NULL, source_file TEXT NOT NULL, processed_timestamp TEXT NOT NULL,
+                    UNIQUE(source_location, sale_number, mark, sale_order, grade)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS comparative_prices (
+                    id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_number TEXT NOT NULL, sale_date TEXT,
+                    region TEXT, mark TEXT NOT NULL, sale_order TEXT, grade TEXT NOT NULL,
+                    price_band TEXT NOT NULL, -- HIGH or LOW
+                    price REAL NOT NULL, price_change REAL, -- change against the previous sale
+                    source_file TEXT NOT NULL, processed_timestamp TEXT NOT NULL,
+                    UNIQUE(source_location, sale_number, mark, sale_order, grade, price_band)
+                )
+            """)
+            for table_name in ('average_prices', 'comparative_prices'):
+                if table_name not in existing_tables:
+                    requeue_source_files(conn, table_name, route_price_table)
+            # V6: Kgs offered per sale and category, one row per (sale, category)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS auction_quantities (
+                    id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_number TEXT NOT NULL, sale_date TEXT,
+                    category TEXT NOT NULL, -- TOTAL, MAIN, SECONDARY, KENYA, FOREIGN, REPRINTS or FRESH
+                    kgs REAL NOT NULL, source_file_identifier TEXT NOT NULL, processed_timestamp TEXT NOT NULL,
+                    UNIQUE(source_location, sale_number, category)
+                )
+            """)
+            if 'auction_quantities' not in existing_tables:
+                requeue_source_files(conn, 'auction_quantities', route_time_series_table)
+            # V6: Sales touched by each write (see record_changes), read by the analyzer and library builder
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS change_log (
+                    id INTEGER PRIMARY KEY, run_id TEXT,
+                    table_name TEXT NOT NULL, -- e.g. auction_sales, grade_summary
+                    source_location TEXT NOT NULL, sale_number TEXT NOT NULL,
+                    rows_written INTEGER, -- rows of this sale in the batch that changed the table
+                    recorded_timestamp TEXT NOT NULL
+                )
+            """)
+            # V6: How far each downstream stage has read change_log
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS change_log_cursors (
+                    consumer TEXT PRIMARY KEY, -- e.g. analyze_mombasa
+                    last_change_id INTEGER NOT NULL, updated_timestamp TEXT NOT NULL
+                )
+            """)
+            # V6: Per-run ingest measurements, one row per sheet plus one (data_type FILE) per file
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_metrics (
+                    id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, source_file TEXT NOT NULL,
+                    file_identifier TEXT NOT NULL, handler TEXT, data_type TEXT NOT NULL, status TEXT NOT NULL,
+                    input_bytes INTEGER, rows_in INTEGER, rows_dropped INTEGER, rows_upserted INTEGER,
+                    read_seconds REAL, map_seconds REAL, clean_seconds REAL, upsert_seconds REAL,
+                    recorded_timestamp TEXT NOT NULL
+                )
+            """)
+            # V6: Per-page PDF text, so unchanged pages are not re-extracted
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS market_commentary_pages (
+                    id INTEGER PRIMARY KEY,
+                    source_file TEXT NOT NULL,
+                    page_number INTEGER NOT NULL, -- 1-based
+                    page_hash TEXT NOT NULL, -- SHA-256 of the page's content stream and size
+                    content TEXT NOT NULL,
+                    processed_timestamp TEXT NOT NULL,
+                    UNIQUE(source_file, page_number)
+                )
+            """)
             conn.commit()
+            normalize_stored_lot_numbers(conn)
+
+            # V6: Index migration (new indexes get fresh planner statistics)
+            if create_secondary_indexes(conn):
+                analyze_database(conn)
+            if text_lot_tables or migrated_years:
+                logging.info("  Migrating lot tables: reclaiming the space of the moved rows (VACUUM)")
+                conn.execute("VACUUM")
     except sqlite3.Error as e:
         logging.error(f"Database initialization error: {e}")
 
+# V6: Lot fact tables (names stored as dimension keys), created in the catalog and in every year partition
+FACT_TABLE_SQL = [
+    # Auction Sales (Note: UNIQUE constraints are crucial for UPSERT)
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.auction_sales_facts (
+        id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_date TEXT, sale_number TEXT,
+        broker_key INTEGER, mark_key INTEGER, grade_key INTEGER, lot_number TEXT NOT NULL, invoice_number TEXT,
+        quantity_kgs REAL, package_count INTEGER, price REAL NOT NULL, buyer_key INTEGER NOT NULL,
+        source_file_key INTEGER NOT NULL,
+        mark_id INTEGER, buyer_id INTEGER, -- V6: canonical IDs (mark_aliases)
+        UNIQUE(source_location, sale_number, lot_number, broker_key)
+    )
+    """,
+    # Auction Offers
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.auction_offers_facts (
+        id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_date TEXT, sale_number TEXT,
+        broker_key INTEGER, mark_key INTEGER, grade_key INTEGER, lot_number TEXT NOT NULL, invoice_number TEXT,
+        quantity_kgs REAL, package_count INTEGER, valuation_or_rp REAL,
+        source_file_key INTEGER NOT NULL,
+        mark_id INTEGER, -- V6: canonical ID (mark_aliases)
+        UNIQUE(source_location, sale_number, lot_number, broker_key)
+    )
+    """,
+    # V6: Lot Outcomes (every offered lot with its sale, if any; rebuilt per sale by refresh_lot_outcomes)
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.lot_outcome_facts (
+        id INTEGER PRIMARY KEY, source_location TEXT NOT NULL, sale_date TEXT, sale_number TEXT NOT NULL,
+        broker_key INTEGER, mark_key INTEGER, grade_key INTEGER,
+        lot_number TEXT NOT NULL, -- Normalized (see LOT_NUMBER_KEY_SQL): sales sheets write "47996.0" for lot 47996
+        quantity_kgs REAL, valuation REAL, -- From the offer (valuation_or_rp)
+        price REAL, buyer_key INTEGER, -- From the sale; NULL when unsold
+        sold INTEGER NOT NULL, -- 1 when a sale row matched the offered lot
+        realization REAL, -- price / valuation, when both are positive
+        offer_id INTEGER NOT NULL, sale_id INTEGER, mark_id INTEGER,
+        UNIQUE(offer_id)
+    )
+    """,
+]
+
+# V6: Offers and sales match on (source_location, sale_number, lot_number, broker) with the
+# lot number normalized the same way on both sides.
+LOT_NUMBER_KEY_SQL = "CASE WHEN {column} GLOB '*[0-9].0' THEN substr({column}, 1, length({column}) - 2) ELSE {column} END"
+WHOLE_NUMBER_TEXT = r"^(.*[0-9])\.0$" # The same rule in pandas (clean_lot_details)
+
+PARTITIONS_WRITTEN = set() # V6: Year partitions opened for writing by this process (see analyze_database)
+
+def create_fact_tables(conn, schema='main'):
+    for sql in FACT_TABLE_SQL:
+        conn.execute(sql.format(schema=schema))
+
+def open_partition(conn, year):
+    """V6: Schema name of the partition of a sale year, attaching it (and creating its tables,
+    indexes and the lot views over it) on first use. Safe inside the file's transaction: a
+    rollback also drops the tables and views, and they are created again on the next use."""
+    if year is None:
+        return 'main'
+    schema = attach_partition(conn, database_file(conn), year)
+    if not has_table(conn, schema, 'auction_sales_facts'):
+        logging.info(f"  Creating partition {partition_file(database_file(conn), year)}")
+        create_fact_tables(conn, schema)
+        create_secondary_indexes(conn, schema)
+        create_lot_views(conn)
+    PARTITIONS_WRITTEN.add(schema)
+    return schema
+
+def attach_result_partitions(conn, result):
+    """V6: Attaches the partitions a lot load result will write to. Called before the result's
+    first write, so for the first sheet of a file this happens outside its transaction and
+    the partition gets the connection settings (see attach_partition)."""
+    if result['table_name'] in FACT_TABLES and result['df'] is not None:
+        for year in sale_years(result['df']['sale_number']).dropna().unique():
+            attach_partition(conn, database_file(conn), int(year))
+
+def sale_years(sale_numbers):
+    """Partition year of each sale number ("2025-35" -> 2025; None when the year is unknown)."""
+    years = sale_numbers.astype('string').str.extract(r"^(\d{4})-", expand=False)
+    return years.astype('Int64')
+
+def normalize_stored_lot_numbers(conn):
+    """V6: Migration. Rewrites the lot numbers stored before clean_lot_details dropped the ".0"
+    of a float column ("47996.0" -> "47996"), in the lot tables of every database and in
+    rejected_lots, and logs the sales in change_log. A row whose rewritten key already exists
+    keeps its lot number (LOT_NUMBER_KEY_SQL still matches the two). Returns the rows rewritten."""
+    rewritten = 0
+    lot_number = LOT_NUMBER_KEY_SQL.format(column='lot_number')
+    for schema in partition_schemas(conn):
+        for fact_table in FACT_TABLES.values():
+            if not has_table(conn, schema, fact_table):
+                continue
+            sales = {(location, sale_number): rows for location, sale_number, rows in conn.execute(f"""
+                SELECT source_location, sale_number, COUNT(*) FROM {schema}.{fact_table}
+                WHERE lot_number GLOB '*[0-9].0' GROUP BY source_location, sale_number
+            """)}
+            if not sales:
+                continue
+            count = conn.execute(f"UPDATE OR IGNORE {schema}.{fact_table} SET lot_number = {lot_number} WHERE lot_number GLOB '*[0-9].0'").rowcount
+            logging.info(f"  Migrating {schema}.{fact_table}: {count} lot numbers written without '.0'")
+            record_changes(conn, fact_table, sales)
+            rewritten += count
+    if has_table(conn, 'main', 'rejected_lots'):
+        rewritten += conn.execute(f"UPDATE rejected_lots SET lot_number = {lot_number} WHERE lot_number GLOB '*[0-9].0'").rowcount
+    conn.commit()
+    return rewritten
+
+def migrate_to_partitions(conn):
+    """V6: Migration. Moves the lot rows of the catalog's fact tables into their year
+    partitions (same ids). Rows without a sale year stay in the catalog. Returns the years."""
+    years = set()
+    for fact_table in FACT_TABLES.values():
+        years.update(row[0] for row in conn.execute(
+            f"SELECT DISTINCT CAST(substr(sale_number, 1, 4) AS INTEGER) FROM main.{fact_table} WHERE sale_number GLOB '[0-9][0-9][0-9][0-9]-*'"))
+    for year in sorted(years):
+        schema = open_partition(conn, year)
+        for fact_table in FACT_TABLES.values():
+            moved = conn.execute(f"""
+                INSERT INTO {schema}.{fact_table} SELECT * FROM main.{fact_table}
+                WHERE sale_number GLOB '[0-9][0-9][0-9][0-9]-*' AND CAST(substr(sale_number, 1, 4) AS INTEGER) = ?
+                ORDER BY id
+            """, (year,)).rowcount
+            conn.execute(f"""
+                DELETE FROM main.{fact_table}
+                WHERE sale_number GLOB '[0-9][0-9][0-9][0-9]-*' AND CAST(substr(sale_number, 1, 4) AS INTEGER) = ?
+            """, (year,))
+            logging.info(f"  Migrating {fact_table}: {moved} rows of {year} moved to {partition_file(database_file(conn), year)}")
+    conn.commit()
+    return sorted(years)
+
+def migrate_to_fact_table(conn, table_name):
+    """V6: Migration. Moves the rows of a lot table that stores its names as text into its
+    fact table (same row ids, names replaced by dimension keys) and drops it, so the view
+    of the same name can take its place."""
+    fact_table = FACT_TABLES[table_name]
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    fact_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({fact_table})")}
+    select = {col: f"t.{col}" for col in columns if col in fact_columns}
+    for dim_table, (dim_columns, key_column) in DIMENSION_TABLES.items():
+        if key_column in fact_columns and all(col in columns for col in dim_columns):
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {dim_table} ({', '.join(dim_columns)})
+                SELECT DISTINCT {', '.join(dim_columns)} FROM {table_name}
+                WHERE {' AND '.join(f'{col} IS NOT NULL' for col in dim_columns)}
+            """)
+            match = " AND ".join(f"d.{col} = t.{col}" for col in dim_columns)
+            select[key_column] = f"(SELECT d.id FROM {dim_table} d WHERE {match})"
+    logging.info(f"  Migrating {table_name}: moving rows to {fact_table} (names become dimension keys)")
+    conn.execute(f"""
+        INSERT INTO {fact_table} ({', '.join(select)})
+        SELECT {', '.join(select.values())} FROM {table_name} t ORDER BY t.id
+    """)
+    conn.execute(f"DROP TABLE {table_name}")
+    reset_dimension_caches()
+
+def create_secondary_indexes(conn, schema='main'):
+    """V6: Creates the SECONDARY_INDEXES that are missing in a database (the catalog or a year
+    partition) on the tables it holds. Returns the names created. Does not commit."""
+    existing = {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'index'")}
+    created = []
+    for index_name, (table_name, columns) in SECONDARY_INDEXES.items():
+        if index_name not in existing and has_table(conn, schema, table_name):
+            if schema == 'main':
+                logging.info(f"  Migrating {table_name}: creating index {index_name}")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{index_name} ON {table_name} ({', '.join(columns)})")
+            created.append(index_name)
+    return created
+
+def analyze_database(conn):
+    """V6: Refreshes the query planner statistics (sqlite_stat1). analysis_limit keeps this
+    cheap on large tables by sampling each index instead of reading it in full.
+    V6: Covers the catalog and the partitions written by this process, so the files of
+    closed seasons are left untouched."""
+    conn.execute("PRAGMA analysis_limit = 1000")
+    for schema in ['main'] + sorted(PARTITIONS_WRITTEN & set(partition_schemas(conn))):
+        conn.execute(f"ANALYZE {schema}")
+    conn.commit()
+
+def check_query_plans(conn):
+    """V6: Runs EXPLAIN QUERY PLAN for QUERY_PLAN_CHECKS.
+    Returns (sql, plan) pairs for the queries that scan a whole table instead of using an index."""
+    regressions = []
+    for sql in QUERY_PLAN_CHECKS:
+        params = [None] * sql.count('?')
+        plan = " | ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        logging.info(f"  [PLAN] {sql}\n         -> {plan}")
+        if any(step.startswith('SCAN') for step in plan.split(" | ")):
+            regressions.append((sql, plan))
+    return regressions
+
+# =============================================================================
+# V6: Lot Outcomes
+# lot_outcomes pairs every offered lot with its sale: valuation, final price, sold or
+# unsold and the realization ratio. It is rebuilt per sale, in the partition of the sale,
+# whenever a file writes offers or sales of that sale. The join is a build and probe: the
+# sale's sold lots go into a TEMP table keyed on the normalized lot number and broker, and
+# each offered lot is looked up there (no full scan, with or without planner statistics).
+# =============================================================================
+
+SOLD_LOTS_SQL = """
+    INSERT OR IGNORE INTO temp.sold_lots (lot_number, broker_key, sale_id, price, buyer_key)
+    SELECT {lot_number}, broker_key, id, price, buyer_key
+    FROM {schema}.auction_sales_facts
+    WHERE source_location = :location AND sale_number = :sale_number
+    ORDER BY id -- A lot sold twice under two spellings keeps its first sale
+"""
+LOT_OUTCOME_SQL = """
+    INSERT INTO {schema}.lot_outcome_facts (
+        source_location, sale_date, sale_number, broker_key, mark_key, grade_key, lot_number,
+        quantity_kgs, valuation, price, buyer_key, sold, realization, offer_id, sale_id, mark_id
+    )
+    SELECT o.source_location, o.sale_date, o.sale_number, o.broker_key, o.mark_key, o.grade_key, {lot_number},
+           o.quantity_kgs, o.valuation_or_rp, s.price, s.buyer_key, s.sale_id IS NOT NULL,
+           CASE WHEN o.valuation_or_rp > 0 AND s.price > 0 THEN s.price / o.valuation_or_rp END,
+           o.id, s.sale_id, o.mark_id
+    FROM {schema}.auction_offers_facts o
+    LEFT JOIN temp.sold_lots s ON s.lot_number = {lot_number} AND s.broker_key IS o.broker_key
+    WHERE o.source_location = :location AND o.sale_number = :sale_number
+    ORDER BY o.id
+"""
+
+def refresh_lot_outcomes(conn, sales):
+    """V6: Rebuilds the lot_outcomes rows of (schema, source_location, sale_number) sales from
+    their offers and sales. Does not commit. Returns the rows written."""
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sold_lots (
+            lot_number TEXT NOT NULL, broker_key INTEGER, sale_id INTEGER NOT NULL, price REAL, buyer_key INTEGER,
+            PRIMARY KEY (lot_number, broker_key)
+        )
+    """)
+    written = 0
+    for schema, source_location, sale_number in sorted(sales):
+        params = {'location': source_location, 'sale_number': sale_number}
+        conn.execute("DELETE FROM temp.sold_lots")
+        conn.execute(SOLD_LOTS_SQL.format(schema=schema, lot_number=LOT_NUMBER_KEY_SQL.format(column='lot_number')), params)
+        conn.execute(f"DELETE FROM {schema}.lot_outcome_facts WHERE source_location = :location AND sale_number = :sale_number", params)
+        written += conn.execute(LOT_OUTCOME_SQL.format(schema=schema, lot_number=LOT_NUMBER_KEY_SQL.format(column='o.lot_number')), params).rowcount
+    return written
+
+def result_sales(result):
+    """V6: The (schema, source_location, sale_number) sales written by a lot load result."""
+    pairs = result['df'][['source_location', 'sale_number']].dropna().drop_duplicates()
+    years = sale_years(pairs['sale_number'])
+    return {('main' if pd.isna(year) else partition_schema(int(year)), location, sale_number)
+            for location, sale_number, year in zip(pairs['source_location'], pairs['sale_number'], years)}
+
+def backfill_lot_outcomes(conn):
+    """V6: Migration. Builds lot_outcomes in the databases (catalog and partitions) that hold
+    offers but no outcomes yet, i.e. were written before lot_outcomes existed. Returns the sales built."""
+    sales = set()
+    for schema in partition_schemas(conn):
+        create_fact_tables(conn, schema)
+        if schema != 'main': # The catalog's indexes are created with the others by initialize_database
+            create_secondary_indexes(conn, schema)
+        if conn.execute(f"SELECT 1 FROM {schema}.lot_outcome_facts LIMIT 1").fetchone() is None:
+            sales.update((schema, location, sale_number) for location, sale_number in conn.execute(
+                f"SELECT DISTINCT source_location, sale_number FROM {schema}.auction_offers_facts WHERE sale_number IS NOT NULL"))
+    if sales:
+        written = refresh_lot_outcomes(conn, sales)
+        logging.info(f"  Migrating lot_outcomes: {written} offered lots of {len(sales)} sales matched to their sales")
+        PARTITIONS_WRITTEN.update(schema for schema, _, _ in sales)
+    conn.commit()
+    create_lot_views(conn)
+    return sorted(sales)
+
 # =============================================================================
 # Utility Functions (Logging, Mapping, Parsing)
 # =============================================================================
@@ -145,58 +661,194 @@ def is_processed(file_identifier, conn, data_type):
         logging.error(f"Database check error: {e}")
         return False
 
-def log_processed(file_identifier, records_count, conn, data_type, status='SUCCESS'):
+def log_processed(file_identifier, records_count, conn, data_type, status='SUCCESS', fingerprint=None):
+    """V6: Does not commit; the entry is part of the caller's per-file transaction."""
     try:
         timestamp = datetime.now().isoformat()
+        fingerprint = fingerprint or {}
         conn.execute("""
             INSERT OR REPLACE INTO processing_log 
-            (file_identifier, processed_timestamp, records_inserted, data_type, status) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (file_identifier, timestamp, records_count, data_type, status))
-        conn.commit()
+            (file_identifier, processed_timestamp, records_inserted, data_type, status, content_hash, file_size, file_mtime) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (file_identifier, timestamp, records_count, data_type, status,
+              fingerprint.get('content_hash'), fingerprint.get('file_size'), fingerprint.get('file_mtime')))
     except sqlite3.Error as e:
         logging.error(f"Failed to log file processing: {e}")
 
-def map_columns(df_columns, mapping_dict):
-    """Maps Excel columns. V5: Modified to support COALESCE strategy for 'mark'."""
-    mapping = {}
-    normalized_df_cols = {str(col).strip().lower(): col for col in df_columns}
-    priorities = {} 
-
-    # V5: Track mapped 'mark' columns separately
-    mapped_mark_cols = {} 
+def compute_content_hash(filepath, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_file_fingerprint(filepath, content_hash=None):
+    stat = os.stat(filepath)
+    return {'content_hash': content_hash, 'file_size': stat.st_size, 'file_mtime': stat.st_mtime}
+
+def set_ingest_run(run_id):
+    """V6: Starts (or, with None, stops) recording ingest_metrics rows under run_id."""
+    global INGEST_RUN_ID
+    INGEST_RUN_ID = run_id
+
+def merge_metrics(current, new):
+    """Sums two metrics dicts (chunks of one sheet, or the sheets of one file). None is 'not measured'."""
+    merged = dict(current)
+    for column, value in new.items():
+        if value is not None:
+            merged[column] = (merged.get(column) or 0) + value
+    return merged
+
+def record_ingest_metrics(conn, file_identifier, data_type, status, metrics, handler=None):
+    """V6: Adds one ingest_metrics row for the current run. Does not commit."""
+    if not INGEST_RUN_ID:
+        return
+    conn.execute(f"""
+        INSERT INTO ingest_metrics
+        (run_id, source_file, file_identifier, handler, data_type, status, {', '.join(METRIC_COLUMNS)}, recorded_timestamp)
+        VALUES ({', '.join(['?'] * (len(METRIC_COLUMNS) + 7))})
+    """, (INGEST_RUN_ID, file_identifier.split('::')[0], file_identifier, handler, data_type, status,
+          *(metrics.get(column) for column in METRIC_COLUMNS), datetime.now().isoformat()))
+
+def metric_values(values):
+    """Measures (a row or column totals of ingest_metrics) as plain JSON values; None is 'not measured'."""
+    return {
+        column: None if pd.isna(values[column]) else int(values[column]) if column in COUNT_COLUMNS else round(float(values[column]), 4)
+        for column in METRIC_COLUMNS + ['stage_seconds']
+    }
 
-    for db_col, aliases in mapping_dict.items():
+def write_metrics_summary(conn, run_id, total_seconds):
+    """V6: Writes <DB_FILE stem>.metrics.json: per-handler totals and per-file rows of one run.
+    rows_per_second is rows in over the measured stages (read, map, clean, upsert)."""
+    metrics = pd.read_sql_query("SELECT * FROM ingest_metrics WHERE run_id = ? AND data_type = ?", conn, params=(run_id, DATA_TYPE_FILE))
+    metrics['handler'] = metrics['handler'].fillna('UNRECOGNIZED')
+    metrics['stage_seconds'] = metrics[STAGE_COLUMNS].sum(axis=1, min_count=1)
+
+    handlers = {}
+    for handler, files in metrics.groupby('handler'):
+        totals = metric_values(files[METRIC_COLUMNS + ['stage_seconds']].sum(min_count=1))
+        totals['files'] = len(files)
+        totals['rows_per_second'] = round(totals['rows_in'] / totals['stage_seconds'], 1) if totals['rows_in'] and totals['stage_seconds'] else None
+        handlers[handler] = totals
+
+    summary = {
+        'run_id': run_id,
+        'db_file': DB_FILE,
+        'total_seconds': round(total_seconds, 3),
+        'files': len(metrics),
+        'rows_upserted': int(metrics['rows_upserted'].sum()),
+        'handlers': handlers,
+        'per_file': [dict(source_file=row['source_file'], handler=row['handler'], status=row['status'], **metric_values(row))
+                     for _, row in metrics.iterrows()],
+    }
+    summary_path = os.path.splitext(DB_FILE)[0] + METRICS_SUMMARY_SUFFIX
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Ingest metrics for run {run_id}: {summary_path}")
+    return summary
+
+def check_file_unchanged(filepath, filename, conn):
+    """V6: Compares a file against its last successful FILE entry in processing_log.
+
+    Size and mtime are checked first so untouched files are skipped without reading them.
+    When they differ (e.g. after a fresh git checkout) the SHA-256 of the bytes decides.
+    Returns (unchanged, fingerprint); the fingerprint always carries the content hash
+    when the file has to be (re)processed.
+    """
+    fingerprint = get_file_fingerprint(filepath)
+    row = conn.execute(
+        "SELECT content_hash, file_size, file_mtime FROM processing_log WHERE file_identifier = ? AND data_type = ? AND status = 'SUCCESS'",
+        (get_file_identifier(filename), DATA_TYPE_FILE)
+    ).fetchone()
+
+    if row and row[0] and row[1] == fingerprint['file_size'] and row[2] == fingerprint['file_mtime']:
+        fingerprint['content_hash'] = row[0]
+        return True, fingerprint
+
+    fingerprint['content_hash'] = compute_content_hash(filepath)
+    if row and row[0] == fingerprint['content_hash']:
+        # Same bytes, new mtime: remember the new mtime so the next run takes the fast path.
+        conn.execute(
+            "UPDATE processing_log SET file_mtime = ? WHERE file_identifier = ? AND data_type = ?",
+            (fingerprint['file_mtime'], get_file_identifier(filename), DATA_TYPE_FILE)
+        )
+        conn.commit()
+        return True, fingerprint
+    return False, fingerprint
+
+# Columns where the alias with the best (lowest) priority index wins
+PRIORITIZED_COLUMNS = ['price', 'quantity_kgs', 'package_count', 'valuation_or_rp', 'sale_date_internal', 'sale_number_internal']
+
+def freeze_mapping(mapping_dict):
+    """Hashable form of a column mapping dict, used as part of the cache keys below."""
+    return tuple((db_col, tuple(aliases)) for db_col, aliases in mapping_dict.items())
+
+@functools.lru_cache(maxsize=None)
+def compile_alias_index(frozen_mapping):
+    """V6: normalized alias -> [(sequence, db_col, priority_index)], compiled once per mapping.
+    sequence is the position in the original db_col/alias iteration order."""
+    index = {}
+    sequence = 0
+    for db_col, aliases in frozen_mapping:
         for priority_index, alias in enumerate(aliases):
-            normalized_alias = alias.strip().lower()
-            if normalized_alias in normalized_df_cols:
-                
-                # V5: Handle 'mark' columns separately
-                if db_col == 'mark':
-                    # Store the original Excel column name and its priority index
-                    mapped_mark_cols[normalized_df_cols[normalized_alias]] = priority_index
-                    continue
-
-                # Prioritization for non-mark columns
-                prioritized_cols = ['price', 'quantity_kgs', 'package_count', 'valuation_or_rp', 'sale_date_internal', 'sale_number_internal']
-                
-                if db_col in prioritized_cols:
-                    if db_col not in priorities or priority_index < priorities[db_col]:
-                        if db_col in mapping.values():
-                             previous_header = next(k for k, v in mapping.items() if v == db_col)
-                             del mapping[previous_header]
-                        
-                        mapping[normalized_df_cols[normalized_alias]] = db_col
-                        priorities[db_col] = priority_index
-                
-                elif db_col not in mapping.values():
-                    mapping[normalized_df_cols[normalized_alias]] = db_col
-                    
-    return mapping, mapped_mark_cols
+            index.setdefault(alias.strip().lower(), []).append((sequence, db_col, priority_index))
+            sequence += 1
+    return index
+
+@functools.lru_cache(maxsize=256)
+def resolve_header_layout(normalized_headers, frozen_mapping):
+    """V6: Resolves one header layout against a mapping. Returns (mapping, mapped_mark_cols)
+    keyed by header position. Cached, so each recurring layout is resolved once per process."""
+    alias_index = compile_alias_index(frozen_mapping)
+    # Like a dict keyed on the normalized header: the last column with a given header wins
+    positions = {header: position for position, header in enumerate(normalized_headers)}
+    hits = sorted((sequence, db_col, priority_index, header)
+                  for header in positions for sequence, db_col, priority_index in alias_index.get(header, ()))
+
+    mapping = {}  # position -> db_col
+    mapped_positions = {}  # db_col -> position (reverse of mapping)
+    priorities = {}
+    mapped_mark_cols = {}
+
+    def assign(position, db_col):
+        previous = mapping.get(position)
+        if previous is not None:
+            del mapped_positions[previous]
+        mapping[position] = db_col
+        mapped_positions[db_col] = position
+
+    for _, db_col, priority_index, header in hits:
+        position = positions[header]
+
+        # V5: Handle 'mark' columns separately
+        if db_col == 'mark':
+            mapped_mark_cols[position] = priority_index
+            continue
+
+        if db_col in PRIORITIZED_COLUMNS:
+            if db_col not in priorities or priority_index < priorities[db_col]:
+                if db_col in mapped_positions:
+                    del mapping[mapped_positions.pop(db_col)]
+                assign(position, db_col)
+                priorities[db_col] = priority_index
+
+        elif db_col not in mapped_positions:
+            assign(position, db_col)
+
+    return tuple(mapping.items()), tuple(mapped_mark_cols.items())
 
-def find_header_row(xls_file, sheetname, keywords, max_scan_rows=20):
+def map_columns(df_columns, mapping_dict):
+    """Maps Excel columns. V5: Modified to support COALESCE strategy for 'mark'.
+    V6: Resolution goes through the compiled alias index and the header layout cache."""
+    df_columns = list(df_columns)
+    normalized_headers = tuple(str(col).strip().lower() for col in df_columns)
+    mapping, mapped_mark_cols = resolve_header_layout(normalized_headers, freeze_mapping(mapping_dict))
+    return ({df_columns[position]: db_col for position, db_col in mapping},
+            {df_columns[position]: priority for position, priority in mapped_mark_cols})
+
+def find_header_row(workbook, sheetname, keywords, max_scan_rows=20):
     try:
-        df_preview = pd.read_excel(xls_file, sheet_name=sheetname, header=None, nrows=max_scan_rows)
+        df_preview = read_sheet(workbook, sheetname, header=None, nrows=max_scan_rows)
         normalized_keywords = set(k.strip().lower() for k in keywords)
         
         for index, row in df_preview.iterrows():
@@ -209,8 +861,365 @@ def find_header_row(xls_file, sheetname, keywords, max_scan_rows=20):
         logging.error(f"Error while trying to find header row in {sheetname}: {e}")
     return None
 
+# =============================================================================
+# V6: Excel Reader Backends
+# Handlers read workbooks through open_workbook/read_sheet instead of pd.read_excel.
+# Each backend returns a raw cell grid that is normalized exactly like pandas'
+# openpyxl reader does it (cell conversion, trailing row/column trimming), and
+# the grid is turned into a DataFrame with pandas' own TextParser. Header
+# detection and DataFrames are therefore identical whichever backend is used.
+# Grids are cached on the workbook handle, so each sheet is parsed only once
+# however many times header detection, metadata extraction and reads touch it.
+# =============================================================================
+
+def resolve_excel_engine(engine=None):
+    """Returns the backend to use: 'calamine' (Rust, fast) when installed, else 'openpyxl'."""
+    engine = engine or EXCEL_ENGINE
+    if engine == 'auto':
+        return 'calamine' if python_calamine else 'openpyxl'
+    if engine == 'calamine' and not python_calamine:
+        logging.warning("python-calamine is not installed. Falling back to openpyxl.")
+        return 'openpyxl'
+    return engine
+
+def set_excel_engine(engine):
+    """Sets the module-wide backend."""
+    global EXCEL_ENGINE
+    EXCEL_ENGINE = engine
+
+def configure_reader(engine, landing_zone_dir):
+    """Process pool initializer: workers read with the same backend and landing zone."""
+    set_excel_engine(engine)
+    set_landing_zone(landing_zone_dir)
+
+def open_book(filepath, engine):
+    """Opens the xlsx with a backend. Returns (book, sheet_names)."""
+    if engine == 'calamine':
+        book = python_calamine.CalamineWorkbook.from_path(filepath)
+        return book, list(book.sheet_names)
+    book = openpyxl.load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    return book, book.sheetnames
+
+def open_workbook(filepath, engine=None):
+    """Opens a workbook handle. V6: When the file's content is already in the landing zone,
+    the xlsx itself is only opened if a sheet that was never landed is requested."""
+    engine = resolve_excel_engine(engine)
+    workbook = {'engine': engine, 'book': None, 'sheet_names': None, 'filepath': filepath, 'sheet_rows': {},
+                'landing_dir': get_landing_dir(filepath)}
+
+    workbook['sheet_names'] = read_landing_manifest(workbook['landing_dir'])
+    if workbook['sheet_names'] is None:
+        workbook['book'], workbook['sheet_names'] = open_book(filepath, engine)
+        write_landing_manifest(workbook['landing_dir'], workbook['sheet_names'])
+    return workbook
+
+def get_book(workbook):
+    if workbook['book'] is None:
+        workbook['book'], _ = open_book(workbook['filepath'], workbook['engine'])
+    return workbook['book']
+
+def close_workbook(workbook):
+    workbook['sheet_rows'].clear()
+    if workbook['engine'] == 'openpyxl' and workbook['book'] is not None:
+        workbook['book'].close()
+
+def convert_openpyxl_value(value):
+    """Converts an openpyxl cell value the same way pandas' openpyxl reader does."""
+    if value is None:
+        return ""
+    if isinstance(value, str) and value in openpyxl.cell.cell.ERROR_CODES:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def convert_calamine_value(value):
+    """Converts a calamine cell value to what openpyxl would have produced."""
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and openpyxl and value in openpyxl.cell.cell.ERROR_CODES:
+        return np.nan
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+def trim_sheet_rows(rows):
+    """Drops trailing empty cells and rows, then pads rows to a common width."""
+    trimmed = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(rows):
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        if row:
+            last_row_with_data = row_number
+        trimmed.append(row)
+    trimmed = trimmed[:last_row_with_data + 1]
+
+    if trimmed:
+        width = max(len(row) for row in trimmed)
+        trimmed = [row + [""] * (width - len(row)) for row in trimmed]
+    return trimmed
+
+def parse_sheet_rows(workbook, sheetname):
+    """Parses the complete cell grid of a sheet with the workbook's backend."""
+    if workbook['engine'] == 'calamine':
+        sheet = get_book(workbook).get_sheet_by_name(sheetname)
+        raw_rows = sheet.to_python(skip_empty_area=False)
+        rows = [[convert_calamine_value(value) for value in row] for row in raw_rows]
+    else:
+        sheet = get_book(workbook)[sheetname]
+        sheet.reset_dimensions()
+        rows = [[convert_openpyxl_value(value) for value in row] for row in sheet.iter_rows(values_only=True)]
+    return trim_sheet_rows(rows)
+
+def read_sheet_rows(workbook, sheetname, nrows=None):
+    """Raw, normalized cell grid of a sheet (at most nrows rows), parsed once per workbook.
+    V6: Read from the landing zone when the sheet was landed before, and landed otherwise."""
+    cache = workbook['sheet_rows']
+    if sheetname not in cache:
+        rows = read_landed_sheet(workbook, sheetname)
+        if rows is None:
+            rows = parse_sheet_rows(workbook, sheetname)
+            land_sheet(workbook, sheetname, rows)
+        cache[sheetname] = rows
+    rows = cache[sheetname]
+    if nrows is not None and nrows < len(rows):
+        # Re-trim so the slice is padded to its own width, as a partial read would be.
+        return trim_sheet_rows(rows[:nrows])
+    return rows
+
+def rows_to_frame(rows, header=0, nrows=None):
+    """Builds a DataFrame from a cell grid the way pd.read_excel does."""
+    if not rows:
+        return pd.DataFrame()
+    try:
+        return TextParser(rows, header=header, nrows=nrows, skip_blank_lines=False).read(nrows=nrows)
+    except EmptyDataError:
+        return pd.DataFrame()
+
+def read_sheet(workbook, sheetname, header=0, nrows=None):
+    """Drop-in replacement for pd.read_excel(xls_file, sheet_name=..., header=..., nrows=...)."""
+    rows_needed = None
+    if nrows is not None:
+        rows_needed = nrows + (header + 1 if header is not None else 0)
+    return rows_to_frame(read_sheet_rows(workbook, sheetname, rows_needed), header, nrows)
+
+def get_sheet_names(filepath):
+    """Lists sheet names without loading any sheet data."""
+    workbook = open_workbook(filepath)
+    try:
+        return workbook['sheet_names']
+    finally:
+        close_workbook(workbook)
+
+def iter_sheet_chunks(filepath, sheetname, chunk_rows=STREAM_CHUNK_ROWS):
+    """V6: Streams a sheet whose header is on the first row as DataFrames of at most chunk_rows rows.
+
+    Rows come from openpyxl read_only iteration (whatever EXCEL_ENGINE is, since only
+    openpyxl streams), so memory stays flat however long the sheet is. Each chunk is built
+    with pandas' TextParser like read_sheet, so NaN handling matches a full read. Types are
+    inferred per chunk ('Lot No' may be int in one chunk and float in the next);
+    clean_lot_details writes identifiers the same way for either.
+    """
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook[sheetname].iter_rows(values_only=True)
+        header = [convert_openpyxl_value(value) for value in next(rows, ())]
+        while header and header[-1] == "":
+            header.pop()
+        if not header:
+            return
+        width = len(header)
+
+        def build_chunk(batch):
+            return TextParser([header] + batch, header=0, skip_blank_lines=False).read()
+
+        batch = []
+        yielded = False
+        for row in rows:
+            converted = [convert_openpyxl_value(value) for value in row[:width]]
+            batch.append(converted + [""] * (width - len(converted)))
+            if len(batch) >= chunk_rows:
+                yield build_chunk(batch)
+                yielded = True
+                batch = []
+
+        if batch or not yielded:
+            yield build_chunk(batch)
+    finally:
+        workbook.close()
+
+# =============================================================================
+# V6: Parquet Landing Zone
+# Every sheet grid parsed from an xlsx is also written to
+# LANDING_ZONE_DIR/v<N>/<content sha256>/ as Parquet. While a file's bytes are
+# unchanged, its grids are read back from there instead of the xlsx, so a --force
+# re-clean after a mapping change (COLUMN_MAP_LOT_DETAILS, MARK_ALIASES) skips the
+# xlsx parse. Grids are stored cell for cell, with each cell's Python type, so header
+# detection and the DataFrames built from them are identical to an xlsx read.
+# Needs pyarrow; without it (or with LANDING_ZONE_DIR = None) nothing is landed.
+# Streamed reads (--stream) bypass the landing zone.
+# =============================================================================
+
+LANDING_FORMAT_VERSION = 1 # Bump when cell conversion changes, so stale grids are not reused
+LANDING_MANIFEST = "sheets.json"
+
+# Cell kinds stored in the k<col> column of a landed sheet
+CELL_EMPTY, CELL_NAN, CELL_STR, CELL_INT, CELL_FLOAT, CELL_BOOL, CELL_DATETIME, CELL_TIME, CELL_TIMEDELTA = range(9)
+
+def set_landing_zone(directory):
+    global LANDING_ZONE_DIR
+    LANDING_ZONE_DIR = directory
+
+@functools.lru_cache(maxsize=1024)
+def cached_content_hash(filepath, file_size, file_mtime_ns):
+    """compute_content_hash, remembered while the file's size and mtime are unchanged."""
+    return compute_content_hash(filepath)
+
+def get_landing_dir(filepath):
+    """The landing directory for a file's current content, or None when landing is off."""
+    if not LANDING_ZONE_DIR or pa is None:
+        return None
+    stat = os.stat(filepath)
+    content_hash = cached_content_hash(os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    return os.path.join(LANDING_ZONE_DIR, f"v{LANDING_FORMAT_VERSION}", content_hash)
+
+def write_atomically(path, write):
+    """Writes through a temporary file, so readers (or other workers) never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def read_landing_manifest(landing_dir):
+    """Sheet names of a landed workbook, or None if it has not been landed."""
+    if landing_dir is None:
+        return None
+    try:
+        with open(os.path.join(landing_dir, LANDING_MANIFEST), encoding='utf-8') as f:
+            return json.load(f)['sheet_names']
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"  [LANDING] Ignoring unreadable manifest in {landing_dir}: {e}")
+        return None
+
+def write_landing_manifest(landing_dir, sheet_names):
+    if landing_dir is None:
+        return
+    def write(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'sheet_names': sheet_names}, f)
+    try:
+        os.makedirs(landing_dir, exist_ok=True)
+        write_atomically(os.path.join(landing_dir, LANDING_MANIFEST), write)
+    except OSError as e:
+        logging.warning(f"  [LANDING] Could not write manifest to {landing_dir}: {e}")
+
+def landed_sheet_path(workbook, sheetname):
+    # Sheet names may not be valid file names, so sheets are stored by position
+    return os.path.join(workbook['landing_dir'], f"sheet_{workbook['sheet_names'].index(sheetname)}.parquet")
+
+def encode_grid_column(values):
+    """Splits one grid column into a kind code per cell plus typed value columns."""
+    kinds, strings, ints, floats, datetimes = [], [], [], [], []
+    for value in values:
+        string = integer = number = moment = None
+        if isinstance(value, str):
+            kind = CELL_EMPTY if value == "" else CELL_STR
+            string = value or None
+        elif isinstance(value, bool):
+            kind, integer = CELL_BOOL, int(value)
+        elif isinstance(value, int):
+            kind, integer = CELL_INT, value
+        elif isinstance(value, float):
+            kind = CELL_NAN if value != value else CELL_FLOAT
+            number = value
+        elif isinstance(value, datetime):
+            kind, moment = CELL_DATETIME, value
+        elif isinstance(value, datetime_time):
+            kind, string = CELL_TIME, value.isoformat()
+        elif isinstance(value, timedelta):
+            kind, integer = CELL_TIMEDELTA, value // timedelta(microseconds=1)
+        else:
+            raise TypeError(f"Cannot land cell value of type {type(value).__name__}")
+        kinds.append(kind)
+        strings.append(string)
+        ints.append(integer)
+        floats.append(number)
+        datetimes.append(moment)
+    return kinds, {'s': (strings, pa.string()), 'i': (ints, pa.int64()),
+                   'f': (floats, pa.float64()), 'd': (datetimes, pa.timestamp('us'))}
+
+def encode_grid(rows):
+    """Converts a padded cell grid into a pyarrow Table (k<j> kinds plus the typed columns in use)."""
+    arrays, names = [], []
+    for j, values in enumerate(zip(*rows)):
+        kinds, typed = encode_grid_column(values)
+        arrays.append(pa.array(kinds, pa.int8()))
+        names.append(f"k{j}")
+        for prefix, (column, arrow_type) in typed.items():
+            if any(value is not None for value in column):
+                arrays.append(pa.array(column, arrow_type))
+                names.append(f"{prefix}{j}")
+    return pa.Table.from_arrays(arrays, names=names)
+
+def decode_grid(table):
+    """Inverse of encode_grid: rebuilds the list-of-lists grid with the original Python values."""
+    width = sum(1 for name in table.column_names if name.startswith('k'))
+    columns = []
+    for j in range(width):
+        kinds = table.column(f"k{j}").to_numpy()
+        column = np.full(len(kinds), "", dtype=object)
+
+        def fill(kind, prefix, convert=None):
+            mask = kinds == kind
+            if mask.any():
+                values = np.array(table.column(f"{prefix}{j}").to_pylist(), dtype=object)[mask]
+                column[mask] = np.array([convert(value) for value in values], dtype=object) if convert else values
+
+        column[kinds == CELL_NAN] = np.nan
+        fill(CELL_STR, 's')
+        fill(CELL_INT, 'i')
+        fill(CELL_FLOAT, 'f')
+        fill(CELL_BOOL, 'i', bool)
+        fill(CELL_DATETIME, 'd')
+        fill(CELL_TIME, 's', datetime_time.fromisoformat)
+        fill(CELL_TIMEDELTA, 'i', lambda microseconds: timedelta(microseconds=microseconds))
+        columns.append(column.tolist())
+    return [list(row) for row in zip(*columns)]
+
+def read_landed_sheet(workbook, sheetname):
+    """A sheet's grid from the landing zone, or None when it has not been landed."""
+    if workbook['landing_dir'] is None:
+        return None
+    path = landed_sheet_path(workbook, sheetname)
+    if not os.path.exists(path):
+        return None
+    try:
+        return decode_grid(pq.read_table(path))
+    except Exception as e:
+        logging.warning(f"  [LANDING] Re-parsing {sheetname}: unreadable landed copy {path}: {e}")
+        return None
+
+def land_sheet(workbook, sheetname, rows):
+    """Writes a parsed grid to the landing zone. Failures only cost the cache, never the load."""
+    if workbook['landing_dir'] is None:
+        return
+    try:
+        table = encode_grid(rows)
+        write_atomically(landed_sheet_path(workbook, sheetname), lambda path: pq.write_table(table, path))
+    except Exception as e:
+        logging.warning(f"  [LANDING] Could not land {sheetname} of {os.path.basename(workbook['filepath'])}: {e}")
+
 # (Date parsing functions parse_date, extract_sale_number_from_string, extract_metadata remain the same as V4)
 
+# Formats tried by parse_date, in order (DD/MM/YYYY first)
+DATE_FORMATS = [
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%Y-%m-%d", "%Y/%m/%d", 
+    "%m/%d/%Y %H:%M:%S", "%m/%d/%Y"
+]
+
 def parse_date(date_str, year_hint=None):
     """Prioritizes DD/MM/YYYY and handles milliseconds."""
     if isinstance(date_str, datetime):
@@ -227,11 +1236,7 @@ def parse_date(date_str, year_hint=None):
         except ValueError:
             pass
     date_str_cleaned = re.sub(r'[:.]\d{3}$', '', date_str)
-    formats = [
-        "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%Y-%m-%d", "%Y/%m/%d", 
-        "%m/%d/%Y %H:%M:%S", "%m/%d/%Y"
-    ]
-    for fmt in formats:
+    for fmt in DATE_FORMATS:
         try:
             return datetime.strptime(date_str_cleaned, fmt).strftime("%Y-%m-%d")
         except ValueError:
@@ -257,6 +1262,84 @@ def extract_sale_number_from_string(sn_str, sale_date_hint=None):
               return f"{sale_prefix}-{int(match.group(1)):02d}"
     return "Unknown"
 
+def parse_date_series(series):
+    """V6: Vectorized parse_date for a whole column (no year_hint).
+
+    A sheet only holds a handful of distinct dates, so each distinct value is parsed once:
+    datetimes are formatted directly and strings go through one pd.to_datetime pass per
+    entry of DATE_FORMATS. Anything the passes leave unparsed falls back to parse_date,
+    so results are identical to series.apply(parse_date).
+    """
+    codes, uniques = pd.factorize(series)
+    if len(uniques) == 0:
+        return pd.Series([None] * len(series), index=series.index, dtype=object)
+    values = pd.Series(np.asarray(uniques, dtype=object))
+
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    is_datetime = values.map(lambda v: isinstance(v, datetime))
+    parsed[is_datetime] = pd.to_datetime(values[is_datetime], errors='coerce')
+
+    text = values[~is_datetime].astype(str).str.strip()
+    six_digit = text.str.fullmatch(r"\d{6}")
+    parsed[six_digit[six_digit].index] = pd.to_datetime(text[six_digit], format="%d%m%y", errors='coerce')
+
+    text = text.str.replace(r'[:.]\d{3}$', '', regex=True)
+    for fmt in DATE_FORMATS:
+        pending = text.index[parsed[text.index].isna()]
+        if pending.empty:
+            break
+        parsed[pending] = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+
+    formatted = parsed.dt.strftime("%Y-%m-%d").astype(object).where(parsed.notna(), None)
+    leftovers = formatted.index[formatted.isna()]
+    formatted[leftovers] = [parse_date(value) for value in values[leftovers]]
+
+    result = formatted.to_numpy(dtype=object)[codes]
+    result[codes == -1] = None
+    return pd.Series(result, index=series.index, dtype=object)
+
+def extract_sale_number_series(sale_numbers, sale_dates=None):
+    """V6: Vectorized extract_sale_number_from_string(str(value), sale_date) for a whole column.
+
+    Handles "YYYY/NN" and "Sale NN" codes with str.match/str.extract, working on the
+    distinct (code, year) pairs only. sale_dates are parse_date outputs (YYYY-MM-DD or None).
+    """
+    text = sale_numbers.astype(str)
+    if sale_dates is None:
+        dates = [None] * len(text)
+    else:
+        dates = sale_dates.astype(object).where(sale_dates.notna(), None).to_numpy()
+
+    pairs = pd.DataFrame({'code': text.to_numpy(), 'date': dates})
+    distinct = pairs.drop_duplicates().reset_index(drop=True)
+    codes = distinct['code']
+    years = distinct['date'].map(sale_year_from_hint).astype(object)
+
+    sale_number = pd.Series("Unknown", index=distinct.index, dtype=object)
+
+    slash = codes.str.contains('/', regex=False) & codes.str.match(r'\d{4}/\d{1,2}')
+    sale_number[slash] = codes[slash].str.replace('/', '-', regex=False)
+
+    sale_digits = codes.str.extract(r"Sale (\d+)", expand=False)
+    named = ~slash & codes.str.contains('Sale', regex=False) & sale_digits.notna()
+    if named.any():
+        # object dtype on both sides: pandas 3 does not add str-dtype to object columns
+        week = sale_digits[named].astype(int).astype(str).str.zfill(2).astype(object)
+        sale_number[named] = years[named].fillna("UnknownYear").astype(object) + "-" + week
+
+    distinct['sale_number'] = sale_number
+    return pairs.merge(distinct, on=['code', 'date'], how='left')['sale_number'].to_numpy()
+
+def sale_year_from_hint(sale_date_hint):
+    """The year prefix extract_sale_number_from_string takes from a YYYY-MM-DD hint, or None."""
+    if sale_date_hint and isinstance(sale_date_hint, str) and '-' in sale_date_hint:
+        try:
+            datetime.strptime(sale_date_hint, "%Y-%m-%d")
+            return sale_date_hint.split('-')[0]
+        except (ValueError, IndexError):
+            pass
+    return None
+
 def extract_metadata(filename, df=None):
     sale_number, sale_date, year_hint = None, None, None
     
@@ -294,90 +1377,403 @@ def extract_metadata(filename, df=None):
 
     return sale_number or "Unknown", sale_date or "Unknown"
 
+# =============================================================================
+# V6: Name Canonicalization
+# Brokers spell the same garden differently ("GLOBAL VILLAGE TEA", "GLOBAL VILLAGE T",
+# "CHELAL - " from a "Selling Mark - MF Mark" column). Every name written to a lot
+# table is looked up in mark_aliases; a new spelling joins an existing group when
+# its normalized key matches one exactly, or (marks only) when a fuzzy search finds
+# a key within FUZZY_MIN_SIMILARITY. The search is blocked: keys are indexed by
+# character trigram, only keys sharing enough trigrams to possibly be that close
+# are scored, and scoring stops at the allowed number of edits. The lookups run in
+# the writer, so groups are assigned in the same order whatever the worker count.
+# =============================================================================
+
+NAME_INDEXES = {} # (database file, name_type) -> in-memory index of mark_aliases
+
+def database_file(conn):
+    """Path of the main database of a connection (keys the per-process caches)."""
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+def name_key(name):
+    """Normalized spelling: no MF mark suffix, punctuation, repeated letters or trailing
+    noise words (or a truncated noise word, as in "GLOBAL VILLAGE TE")."""
+    name = re.split(r"\s+-\s*|\s*-\s+", str(name).upper())[0] # "CHELAL - CL" -> "CHELAL", keeps "MUGANZA-KIVU"
+    name = re.sub(r"([A-Z])\1+", r"\1", re.sub(r"[^A-Z0-9]+", " ", name))
+    tokens = name.split()
+    while len(tokens) > 1 and any(word.startswith(tokens[-1]) for word in NAME_NOISE_WORDS):
+        tokens.pop()
+    return " ".join(tokens)
+
+def name_trigrams(key):
+    padded = f"##{key}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def bounded_edit_distance(a, b, max_distance):
+    """Levenshtein distance, or max_distance + 1 as soon as it is known to exceed max_distance."""
+    if Levenshtein is not None:
+        return Levenshtein.distance(a, b, score_cutoff=max_distance)
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+def get_name_index(conn, name_type):
+    """The alias/key/trigram index of one name type, loaded from mark_aliases once per process."""
+    db_file = database_file(conn)
+    index = NAME_INDEXES.get((db_file, name_type))
+    if index is None:
+        index = {'aliases': {}, 'keys': {}, 'trigrams': {}, 'names': {}}
+        rows = conn.execute(
+            "SELECT id, alias, name_key, canonical_id FROM mark_aliases WHERE name_type = ? ORDER BY id", (name_type,))
+        for alias_id, alias, key, canonical_id in rows:
+            if alias_id == canonical_id:
+                index['names'][canonical_id] = alias
+            add_to_name_index(index, alias, key, canonical_id)
+        NAME_INDEXES[(db_file, name_type)] = index
+    return index
+
+def add_to_name_index(index, alias, key, canonical_id):
+    index['aliases'][alias] = canonical_id
+    if key not in index['keys']:
+        index['keys'][key] = canonical_id
+        for gram in name_trigrams(key):
+            index['trigrams'].setdefault(gram, []).append(key)
+
+def reset_name_indexes():
+    """Drops the in-memory indexes (after a rollback they may hold aliases that were not kept)."""
+    NAME_INDEXES.clear()
+
+def find_similar_key(index, key):
+    """Best (key, similarity) among the indexed keys at FUZZY_MIN_SIMILARITY or better, or None."""
+    if len(key) < FUZZY_MIN_LENGTH:
+        return None
+    grams = name_trigrams(key)
+    # Prefix filter: each edit changes at most 3 of the key's trigrams, so a close enough key
+    # shares at least one of any 3 * max_edits + 1 of them. Only the posting lists of the
+    # rarest ones are read, which keeps a lookup from growing with the alias table.
+    max_edits = int((1 - FUZZY_MIN_SIMILARITY) * len(key) / FUZZY_MIN_SIMILARITY + 1e-9)
+    rarest = sorted(grams, key=lambda gram: (len(index['trigrams'].get(gram, ())), gram))[:3 * max_edits + 1]
+    candidates = {candidate for gram in rarest for candidate in index['trigrams'].get(gram, ())}
+
+    best = None
+    for candidate in sorted(candidates):
+        longest = max(len(key), len(candidate))
+        max_distance = int((1 - FUZZY_MIN_SIMILARITY) * longest + 1e-9)
+        if len(candidate) < FUZZY_MIN_LENGTH or abs(len(key) - len(candidate)) > max_distance:
+            continue
+        if len(grams & name_trigrams(candidate)) < len(grams) - 3 * max_distance:
+            continue
+        distance = bounded_edit_distance(key, candidate, max_distance)
+        if distance <= max_distance:
+            similarity = 1 - distance / longest
+            if best is None or similarity > best[1]:
+                best = (candidate, similarity)
+    return best
+
+def resolve_canonical_ids(conn, name_type, names, file_identifier=None):
+    """Canonical ID of each name (name -> id), adding the spellings not seen before to mark_aliases."""
+    index = get_name_index(conn, name_type)
+    ids = {}
+    timestamp = None
+    for name in sorted(names):
+        canonical_id = index['aliases'].get(name)
+        if canonical_id is not None:
+            ids[name] = canonical_id
+            continue
+        key = name_key(name)
+        if not key:
+            continue
+
+        canonical_id, method, score = index['keys'].get(key), 'KEY', 1.0
+        if canonical_id is None and name_type in FUZZY_NAME_TYPES:
+            match = find_similar_key(index, key)
+            if match:
+                canonical_id, method, score = index['keys'][match[0]], 'FUZZY', round(match[1], 4)
+        if canonical_id is None:
+            method, score = 'NEW', None
+
+        timestamp = timestamp or datetime.now().isoformat()
+        cursor = conn.execute("""
+            INSERT INTO mark_aliases (name_type, alias, name_key, canonical_id, match_method, match_score, source_file_identifier, created_timestamp)
+            VALUES (?, ?, ?, COALESCE(?, 0), ?, ?, ?, ?)
+        """, (name_type, name, key, canonical_id, method, score, file_identifier, timestamp))
+        if canonical_id is None:
+            canonical_id = cursor.lastrowid
+            conn.execute("UPDATE mark_aliases SET canonical_id = id WHERE id = ?", (canonical_id,))
+            index['names'][canonical_id] = name
+        elif method == 'FUZZY':
+            logging.info(f"    [ALIAS] {name_type} '{name}' -> '{index['names'].get(canonical_id)}' (similarity {score:.2f})")
+        add_to_name_index(index, name, key, canonical_id)
+        ids[name] = canonical_id
+    return ids
+
+def assign_canonical_ids(conn, table_name, df, file_identifier=None):
+    """Adds the CANONICAL_COLUMNS ID columns of a table to a cleaned lot DataFrame."""
+    for column, name_type, id_column in CANONICAL_COLUMNS.get(table_name, []):
+        if column in df.columns:
+            ids = resolve_canonical_ids(conn, name_type, df[column].dropna().unique(), file_identifier)
+            df = df.assign(**{id_column: df[column].map(ids).astype('Int64')})
+    return df
+
+def backfill_canonical_ids(conn):
+    """V6: Migration. Canonicalizes the names already stored in the lot tables (in id order,
+    so earlier spellings start the groups) and writes their IDs."""
+    for table_name, columns in CANONICAL_COLUMNS.items():
+        for column, name_type, id_column in columns:
+            names = [row[0] for row in conn.execute(
+                f"SELECT {column} FROM {table_name} WHERE {column} IS NOT NULL GROUP BY {column} ORDER BY MIN(id)")]
+            ids = {}
+            for name in names: # One at a time, so the first-seen spelling starts the group
+                ids.update(resolve_canonical_ids(conn, name_type, [name]))
+            conn.executemany(f"UPDATE {table_name} SET {id_column} = ? WHERE {column} = ?",
+                             [(canonical_id, name) for name, canonical_id in ids.items()])
+            logging.info(f"  Migrating {table_name}: {id_column} set for {len(ids)} distinct names")
+
+# =============================================================================
+# V6: Dimension Tables
+# The lot fact tables store an integer key for each broker, mark, grade, buyer and
+# source sheet load. Names are resolved to keys in the writer through an in-memory
+# dictionary per dimension table (loaded once per process), so a load only touches
+# the dimension table for names it has not seen before.
+# =============================================================================
+
+DIMENSION_CACHES = {} # (database file, dimension table) -> {value tuple: key}
+
+def get_dimension_cache(conn, dim_table):
+    """The value -> key dictionary of a dimension table, loaded from the database once per process."""
+    db_file = database_file(conn)
+    cache = DIMENSION_CACHES.get((db_file, dim_table))
+    if cache is None:
+        columns = DIMENSION_TABLES[dim_table][0]
+        rows = conn.execute(f"SELECT id, {', '.join(columns)} FROM {dim_table}")
+        cache = {tuple(row[1:]): row[0] for row in rows}
+        DIMENSION_CACHES[(db_file, dim_table)] = cache
+    return cache
+
+def reset_dimension_caches():
+    """Drops the in-memory dictionaries (after a rollback they may hold keys that were not kept)."""
+    DIMENSION_CACHES.clear()
+
+def resolve_dimension_keys(conn, dim_table, values):
+    """Key of each value tuple (value -> key), adding the values not seen before to the dimension table."""
+    cache = get_dimension_cache(conn, dim_table)
+    columns = DIMENSION_TABLES[dim_table][0]
+    sql = f"INSERT INTO {dim_table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+    for value in values:
+        if value not in cache:
+            cache[value] = conn.execute(sql, value).lastrowid
+    return {value: cache[value] for value in values}
+
+def encode_dimensions(conn, df):
+    """Replaces the dimension columns of a cleaned lot DataFrame by their integer keys."""
+    for dim_table, (columns, key_column) in DIMENSION_TABLES.items():
+        if not all(col in df.columns for col in columns):
+            continue
+        values = df[columns].dropna().drop_duplicates()
+        keys = resolve_dimension_keys(conn, dim_table, list(values.itertuples(index=False, name=None)))
+        values[key_column] = list(keys.values())
+        # A left merge keeps the row order, which the staging UPSERT relies on for duplicate keys
+        df = df.merge(values, on=columns, how='left').drop(columns=columns)
+        df[key_column] = df[key_column].astype('Int64')
+    return df
+
 # =============================================================================
 # Data Loading Functions
 # =============================================================================
 
-def execute_insert(conn, table_name, df):
-    """V5: Handles database insertion using UPSERT (INSERT OR UPDATE) for data enrichment."""
+# V6: Tables loaded through the set-based staging UPSERT, with their conflict keys
+UPSERT_KEYS = {
+    'auction_offers_facts': ['source_location', 'sale_number', 'lot_number', 'broker_key'],
+    'auction_sales_facts': ['source_location', 'sale_number', 'lot_number', 'broker_key'],
+}
+
+def dataframe_to_records(df):
+    """Rows as tuples of plain Python values (None for missing).
+
+    V6: Goes through object dtype so numpy/nullable integers are bound as SQLite INTEGERs.
+    (to_records handed numpy.int64 to sqlite3, which stored package_count/lots as 8-byte BLOBs.)
+    """
+    values = df.astype(object).where(df.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+# Offer columns updated using enrichment strategy (COALESCE):
+# if the new data (excluded) is NOT NULL, use it; otherwise, keep the existing data.
+OFFER_ENRICH_COLUMNS = [
+    'valuation_or_rp', 'mark_key', 'quantity_kgs', 'package_count',
+    'invoice_number', 'grade_key', 'sale_date', 'broker_key', 'mark_id'
+]
+# Offer columns always updated with the latest info
+OFFER_ALWAYS_COLUMNS = ['source_file_key']
+
+def build_upsert_update_clause(table_name, columns):
+    """The DO UPDATE SET assignments for a table (None means plain INSERT OR IGNORE)."""
+    if table_name == 'auction_offers_facts':
+        update_statements = [f"{col} = COALESCE(excluded.{col}, {col})" for col in OFFER_ENRICH_COLUMNS if col in columns]
+        update_statements += [f"{col} = excluded.{col}" for col in OFFER_ALWAYS_COLUMNS if col in columns]
+
+    elif table_name == 'auction_sales_facts':
+        # For sales, we generally trust the latest report. If a conflict occurs, we overwrite.
+        update_statements = [f"{col} = excluded.{col}" for col in columns]
+
+    else:
+        return None
+    return ", ".join(update_statements) or None
+
+def build_upsert_change_condition(table_name, columns):
+    """V6: The DO UPDATE WHERE condition matching build_upsert_update_clause: true only when the
+    update would change a data column, so an identical reload is neither counted nor logged as an update.
+    source_file_key is lineage (a new dim_source_files row per load), not data: an unchanged row
+    keeps the key of the load that last changed it."""
+    if table_name == 'auction_offers_facts':
+        conditions = [f"COALESCE(excluded.{col}, {col}) IS NOT {col}" for col in OFFER_ENRICH_COLUMNS if col in columns]
+    else:
+        conditions = [f"excluded.{col} IS NOT {col}" for col in columns
+                      if col not in UPSERT_KEYS[table_name] and col != 'source_file_key']
+    return " OR ".join(conditions) or "false"
+
+def execute_bulk_upsert(conn, table_name, df, schema='main'):
+    """V6: Set-based UPSERT through a TEMP staging table.
+
+    The batch is bulk-loaded into temp.staging_<table> (no indexes to maintain), the exact
+    insert/update split is computed with one index-backed NOT EXISTS query, and the
+    enrichment rules are applied by a single INSERT ... SELECT ... ON CONFLICT statement.
+    Staging rows are applied in DataFrame order, so duplicate keys within a batch resolve
+    exactly as they did with row-by-row executemany. Does not commit.
+    V6: schema is the attached database (year partition) holding the table.
+    V6: Conflicting rows whose values would not change are skipped (DO UPDATE ... WHERE)
+    and counted as ignored.
+    Returns {'inserted': n, 'updated': n, 'ignored': n, 'sales': {(source_location, sale_number): rows}},
+    where sales counts only the rows the statement inserted or changed (RETURNING).
+    """
+    columns = list(df.columns)
+    columns_str = ', '.join(columns)
+    staging = f"staging_{table_name}"
+    keys = UPSERT_KEYS[table_name]
+    update_str = build_upsert_update_clause(table_name, columns)
+
+    conn.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+    conn.execute(f"CREATE TEMP TABLE {staging} ({columns_str})")
+    conn.executemany(
+        f"INSERT INTO temp.{staging} ({columns_str}) VALUES ({', '.join(['?'] * len(columns))})",
+        dataframe_to_records(df)
+    )
+
+    # Exact counts: every distinct new key is one insert (rows with a NULL key part never
+    # conflict and always insert); every other staged row hits an existing row.
+    staged_rows = len(df)
+    if all(key in columns for key in keys):
+        key_match = " AND ".join(f"t.{key} = s.{key}" for key in keys)
+        key_not_null = " AND ".join(f"{key} IS NOT NULL" for key in keys)
+        inserted = conn.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT DISTINCT {', '.join(keys)} FROM temp.{staging} WHERE {key_not_null}) s
+                 WHERE NOT EXISTS (SELECT 1 FROM {schema}.{table_name} t WHERE {key_match}))
+              + (SELECT COUNT(*) FROM temp.{staging} WHERE NOT ({key_not_null}))
+        """).fetchone()[0]
+    else:
+        inserted = staged_rows
+
+    if update_str:
+        # 'WHERE true' resolves the parsing ambiguity between a SELECT and the upsert clause.
+        # RETURNING yields the inserts plus the updates that passed the change condition.
+        written = conn.execute(f"""
+            INSERT INTO {schema}.{table_name} ({columns_str})
+            SELECT {columns_str} FROM temp.{staging} WHERE true ORDER BY rowid
+            ON CONFLICT({', '.join(keys)})
+            DO UPDATE SET {update_str}
+            WHERE {build_upsert_change_condition(table_name, columns)}
+            RETURNING source_location, sale_number
+        """).fetchall()
+        counts = {'inserted': inserted, 'updated': len(written) - inserted, 'ignored': staged_rows - len(written)}
+    else:
+        written = conn.execute(f"""
+            INSERT OR IGNORE INTO {schema}.{table_name} ({columns_str})
+            SELECT {columns_str} FROM temp.{staging} ORDER BY rowid
+            RETURNING source_location, sale_number
+        """).fetchall()
+        counts = {'inserted': inserted, 'updated': 0, 'ignored': staged_rows - inserted}
+    counts['sales'] = dict(Counter(written))
+
+    conn.execute(f"DROP TABLE temp.{staging}")
+    return counts
+
+def execute_insert(conn, table_name, df, schema='main'):
+    """V5: Handles database insertion using UPSERT (INSERT OR UPDATE) for data enrichment.
+    V6: The lot fact tables go through the set-based staging UPSERT.
+    V6: Does not commit. Database errors are logged and re-raised so the caller can roll
+    back the whole file. Returns the number of rows inserted or updated."""
     if df.empty:
         return 0
     
     sql = ""
     try:
-        # Prepare data
-        records = df.where(pd.notnull(df), None).to_records(index=False)
-        records_list = [tuple(rec) for rec in records]
-
-        cursor = conn.cursor()
-        placeholders = ', '.join(['?'] * len(df.columns))
-        columns_str = ', '.join(df.columns)
-        
-        # --- V5: UPSERT Logic ---
-        
-        if table_name == 'auction_offers':
-            # Conflict target based on the unique constraint
-            conflict_target = "(source_location, sale_number, lot_number, broker)"
-            
-            # Columns to update using enrichment strategy (COALESCE)
-            # If the new data (excluded) is NOT NULL, use it; otherwise, keep the existing data.
-            update_enrich_cols = [
-                'valuation_or_rp', 'mark', 'quantity_kgs', 'package_count', 
-                'invoice_number', 'grade', 'sale_date', 'broker'
-            ]
-            # Columns to always update with the latest info
-            update_always_cols = ['source_file_identifier', 'processed_timestamp']
-
-            update_statements = []
-            for col in update_enrich_cols:
-                if col in df.columns:
-                    # COALESCE(excluded.col, col)
-                    update_statements.append(f"{col} = COALESCE(excluded.{col}, {col})")
-            
-            for col in update_always_cols:
-                 if col in df.columns:
-                    update_statements.append(f"{col} = excluded.{col}")
-
-            if not update_statements:
-                 sql = f"INSERT OR IGNORE INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-            else:
-                update_str = ", ".join(update_statements)
-                sql = f"""
-                    INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})
-                    ON CONFLICT{conflict_target}
-                    DO UPDATE SET {update_str}
-                """
-
-        elif table_name == 'auction_sales':
-            # For sales, we generally trust the latest report. If a conflict occurs, we overwrite.
-            conflict_target = "(source_location, sale_number, lot_number, broker)"
-            update_statements = [f"{col} = excluded.{col}" for col in df.columns]
-
-            if not update_statements:
-                 sql = f"INSERT OR IGNORE INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-            else:
-                update_str = ", ".join(update_statements)
-                sql = f"""
-                    INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})
-                    ON CONFLICT{conflict_target}
-                    DO UPDATE SET {update_str}
-                """
-
+        if table_name in UPSERT_KEYS:
+            counts = execute_bulk_upsert(conn, table_name, df, schema)
+            logging.info(f"    [UPSERT] {schema}.{table_name}: {counts['inserted']} inserted, {counts['updated']} updated, {counts['ignored']} ignored.")
+            affected_count = counts['inserted'] + counts['updated']
+            changed_sales = counts['sales']
         else:
             # Fallback for other tables (Summary, Commentary) - use IGNORE
+            columns_str = ', '.join(df.columns)
+            placeholders = ', '.join(['?'] * len(df.columns))
             sql = f"INSERT OR IGNORE INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-        
-        # Execute the command
-        cursor.executemany(sql, records_list)
-        conn.commit()
-        
-        # Returns rows affected (inserted or updated)
-        return cursor.rowcount
+
+            # Execute the command
+            rows_before = count_rows_by_sale(conn, table_name, df)
+            cursor = conn.cursor()
+            cursor.executemany(sql, dataframe_to_records(df))
+            affected_count = cursor.rowcount
+            # V6: INSERT OR IGNORE only adds rows, so a sale changed when its row count grew
+            changed_sales = {sale: rows - rows_before.get(sale, 0)
+                             for sale, rows in count_rows_by_sale(conn, table_name, df).items()
+                             if rows > rows_before.get(sale, 0)} if affected_count > 0 else {}
+
+        # V6: Tell downstream stages which sales changed
+        if changed_sales:
+            record_changes(conn, table_name, changed_sales)
+        return affected_count
 
     except sqlite3.Error as e:
-        logging.error(f"Database insertion (UPSERT) error into {table_name}: {e}. SQL: {sql if sql else 'N/A'}")
-        conn.rollback()
-        return 0
+        logging.error(f"Database insertion (UPSERT) error into {table_name}: {e}. SQL: {sql if sql else 'bulk staging UPSERT'}")
+        raise
+
+def count_rows_by_sale(conn, table_name, df):
+    """V6: {(source_location, sale_number): rows} in table_name for the sales of a batch
+    ({} when the table has no sale columns)."""
+    if 'source_location' not in df.columns or 'sale_number' not in df.columns:
+        return {}
+    sale_numbers = [str(sale) for sale in df['sale_number'].dropna().unique()]
+    if not sale_numbers:
+        return {}
+    pairs = set(df[['source_location', 'sale_number']].itertuples(index=False, name=None))
+    rows = conn.execute(f"""
+        SELECT source_location, sale_number, COUNT(*) FROM {table_name}
+        WHERE sale_number IN ({', '.join(['?'] * len(sale_numbers))})
+        GROUP BY source_location, sale_number
+    """, sale_numbers).fetchall()
+    return {(location, sale): count for location, sale, count in rows if (location, sale) in pairs}
+
+def record_changes(conn, table_name, changed_sales):
+    """V6: Adds the (source_location, sale_number) pairs a write changed to change_log, with
+    the number of rows it inserted or changed for each, under the table name readers use
+    (auction_sales, not auction_sales_facts). Does not commit, so the entries are rolled back
+    with the data."""
+    table_name = {fact_table: view for view, fact_table in FACT_TABLES.items()}.get(table_name, table_name)
+    timestamp = datetime.now().isoformat()
+    conn.executemany("""
+        INSERT INTO change_log (run_id, table_name, source_location, sale_number, rows_written, recorded_timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(INGEST_RUN_ID, table_name, location, sale_number, int(rows), timestamp)
+          for (location, sale_number), rows in changed_sales.items()
+          if location is not None and sale_number is not None])
 
 def clean_numeric_column(df, column_name):
     if column_name in df.columns:
@@ -385,8 +1781,149 @@ def clean_numeric_column(df, column_name):
         df[column_name] = pd.to_numeric(df[column_name], errors='coerce')
     return df
 
-def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False):
-    """Cleans and loads lot data. V5: Implements COALESCE for 'mark' in pandas."""
+def make_load_result(file_identifier, data_type, table_name=None, df=None, status='SUCCESS', metrics=None, rejected=None,
+                     quantity_median=None):
+    """V6: A cleaned sheet ready for the writer. df is None when there is nothing to insert.
+    metrics holds the parse-side measurements (read/map/clean seconds, rows in, rows dropped).
+    rejected holds the rows that failed validation, with a 'reason' column (or None).
+    quantity_median is the reference the QUANTITY_OUTLIER rule used (reused by later chunks of a stream)."""
+    return {
+        'file_identifier': file_identifier,
+        'data_type': data_type,
+        'table_name': table_name,
+        'df': df,
+        'status': status,
+        'metrics': metrics or {},
+        'rejected': rejected,
+        'quantity_median': quantity_median,
+    }
+
+def insert_rejected_rows(conn, result):
+    """V6: Bulk-inserts the rows of a load result that failed validation into rejected_lots."""
+    rejected = result.get('rejected')
+    if rejected is None or rejected.empty:
+        return 0
+    columns = [col for col in REJECTED_COLUMNS if col in rejected.columns]
+    df = rejected[columns + ['reason']].astype(object)
+    for col in ['source_location', 'sale_date', 'sale_number', 'broker', 'lot_number', 'mark', 'grade', 'invoice_number', 'buyer']:
+        if col in df.columns: # Whatever a rejected cell holds (e.g. an unparsed date) is kept as text
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    df = df.assign(source_file_identifier=result['file_identifier'], data_type=result['data_type'],
+                   run_id=INGEST_RUN_ID, rejected_timestamp=datetime.now().isoformat())
+    columns_str = ', '.join(df.columns)
+    conn.executemany(f"INSERT INTO rejected_lots ({columns_str}) VALUES ({', '.join(['?'] * len(df.columns))})",
+                     dataframe_to_records(df))
+    return len(df)
+
+def insert_load_result(conn, result):
+    """V6: Single-writer step. Applies one cleaned sheet (or chunk) to the database."""
+    insert_rejected_rows(conn, result)
+    if result['df'] is None:
+        return 0
+
+    table_name = result['table_name']
+    df = assign_canonical_ids(conn, table_name, result['df'], result['file_identifier'])
+    if table_name in FACT_TABLES:
+        # V6: Each sale year's rows go to that year's partition
+        df = encode_dimensions(conn, df)
+        affected_count = 0
+        for year, rows in df.groupby(sale_years(df['sale_number']), sort=True, dropna=False):
+            schema = open_partition(conn, None if pd.isna(year) else int(year))
+            affected_count += execute_insert(conn, FACT_TABLES[table_name], rows, schema)
+    else:
+        affected_count = execute_insert(conn, table_name, df)
+
+    if affected_count > 0:
+        logging.info(f"    [SUCCESS] Inserted/Updated {affected_count} records in {table_name} ({result['file_identifier']}).")
+    else:
+        logging.info(f"    [INFO] No changes detected in {table_name} ({result['file_identifier']}).")
+    return affected_count
+
+def write_load_result(conn, result, fingerprint=None):
+    """Applies one cleaned sheet to the database and logs it, in one transaction."""
+    return write_load_results(conn, [result], fingerprint=fingerprint)
+
+def merge_status(current, new):
+    """Combines the statuses of several chunks of one sheet: any failure wins, then SUCCESS."""
+    if current is None:
+        return new
+    for status in (current, new):
+        if status.startswith('FAILED'):
+            return status
+    return 'SUCCESS' if 'SUCCESS' in (current, new) else new
+
+def write_load_results(conn, results, filename=None, fingerprint=None, handler=None):
+    """Writes all results of one file. Accepts any iterable, so a streaming parser can hand
+    over chunks as they are read; chunks of the same sheet are logged as a single entry.
+    V6: With a fingerprint, also records the FILE entry that lets later runs skip the file
+    while its bytes are unchanged.
+    V6: The data and its processing_log entries are one transaction (one commit per file).
+    On a database error everything from this file is rolled back and the entries are
+    logged as failed, so the next run retries the file. Any other error is re-raised after
+    the rollback; in both cases the dimension and alias caches are dropped.
+    V6: Also records the ingest_metrics rows of the file (per sheet, plus a FILE total),
+    labelled with the handler the caller routed the file to.
+    V6: Rebuilds the lot_outcomes of the sales the file wrote, in the same transaction."""
+    logged = {}
+    measured = {} # V6: ingest_metrics per sheet
+    outcome_sales = set() # V6: Sales whose lot_outcomes are rebuilt before the commit
+    file_metrics = {'input_bytes': fingerprint.get('file_size') if fingerprint else None}
+    try:
+        with conn:
+            for result in results:
+                attach_result_partitions(conn, result)
+                key = (result['file_identifier'], result['data_type'])
+                if key not in logged:
+                    # V6: The sheet's rejections from an earlier run are replaced by this run's
+                    conn.execute("DELETE FROM rejected_lots WHERE source_file_identifier = ? AND data_type = ?", key)
+                count, status = logged.get(key, (0, None))
+                upsert_start = time.perf_counter()
+                inserted = insert_load_result(conn, result)
+                if inserted and result['table_name'] in FACT_TABLES:
+                    outcome_sales.update(result_sales(result))
+                logged[key] = (count + inserted, merge_status(status, result['status']))
+                measured[key] = merge_metrics(measured.get(key, {}), dict(
+                    result['metrics'], rows_upserted=inserted, upsert_seconds=time.perf_counter() - upsert_start))
+            refresh_lot_outcomes(conn, outcome_sales)
+
+            for (file_identifier, data_type), (count, status) in logged.items():
+                log_processed(file_identifier, count, conn, data_type, status=status, fingerprint=fingerprint)
+                record_ingest_metrics(conn, file_identifier, data_type, status, measured[(file_identifier, data_type)], handler)
+                file_metrics = merge_metrics(file_metrics, measured[(file_identifier, data_type)])
+
+            total = sum(count for count, _ in logged.values())
+            if filename and fingerprint:
+                failed = any(status.startswith('FAILED') for _, status in logged.values())
+                log_processed(get_file_identifier(filename), total, conn, DATA_TYPE_FILE,
+                              status='FAILED' if failed else 'SUCCESS', fingerprint=fingerprint)
+                record_ingest_metrics(conn, get_file_identifier(filename), DATA_TYPE_FILE,
+                                      'FAILED' if failed else 'SUCCESS', file_metrics, handler)
+        return total
+
+    except sqlite3.Error as e:
+        logging.error(f"  [ROLLBACK] No changes kept for {filename or 'this sheet'}: {e}")
+        reset_name_indexes()
+        reset_dimension_caches()
+        with conn:
+            for file_identifier, data_type in logged:
+                log_processed(file_identifier, 0, conn, data_type, status='FAILED_DATABASE', fingerprint=fingerprint)
+                record_ingest_metrics(conn, file_identifier, data_type, 'FAILED_DATABASE',
+                                      dict(measured.get((file_identifier, data_type), {}), rows_upserted=0), handler)
+            if filename and fingerprint:
+                log_processed(get_file_identifier(filename), 0, conn, DATA_TYPE_FILE, status='FAILED', fingerprint=fingerprint)
+                record_ingest_metrics(conn, get_file_identifier(filename), DATA_TYPE_FILE, 'FAILED',
+                                      {'input_bytes': file_metrics['input_bytes'], 'rows_upserted': 0}, handler)
+        return 0
+    except Exception:
+        # Any other error (a bug, a failing streamed parser) also rolled the file back;
+        # the caches must not keep the dimension keys and aliases that went with it
+        reset_name_indexes()
+        reset_dimension_caches()
+        raise
+
+def clean_lot_details(df, metadata, data_type, use_internal_metadata=False):
+    """Cleans lot data into a load result. V5: Implements COALESCE for 'mark' in pandas.
+    V6: No database access, so this can run inside a parser worker process."""
     file_identifier = metadata['file_identifier']
     
     # Determine target table
@@ -401,12 +1938,17 @@ def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
     else:
         raise ValueError(f"Invalid data_type provided: {data_type}")
 
+    # V6: Stage timings travel with the load result (this may run in a worker process)
+    metrics = {'read_seconds': metadata.get('read_seconds'), 'rows_in': len(df), 'rows_dropped': 0}
+    stage_start = time.perf_counter()
     try:
         # 1. Map Columns (V5: Returns standard mapping and specific mark mapping)
         column_mapping, mapped_mark_cols = map_columns(df.columns, COLUMN_MAP_LOT_DETAILS)
         
         # Apply standard renaming
         df = df.rename(columns=column_mapping)
+        metrics['map_seconds'] = time.perf_counter() - stage_start
+        stage_start = time.perf_counter()
 
         # V5: Define noise values for text cleaning
         noise_values = {'NAN', 'NONE', '', '-', 'NIL'}
@@ -432,13 +1974,12 @@ def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
         if use_internal_metadata:
             logging.info("    [INFO] Using internal metadata extraction (Multi-sale file).")
             if 'sale_date_internal' in df.columns or 'sale_number_internal' in df.columns:
+                # V6: Vectorized and memoized on distinct values (was a per-row apply)
                 if 'sale_date_internal' in df.columns:
-                    df['sale_date'] = df['sale_date_internal'].apply(lambda x: parse_date(x))
+                    df['sale_date'] = parse_date_series(df['sale_date_internal'])
                 
                 if 'sale_number_internal' in df.columns:
-                    df['sale_number'] = df.apply(lambda row: extract_sale_number_from_string(
-                        str(row.get('sale_number_internal')), row.get('sale_date')
-                    ), axis=1)
+                    df['sale_number'] = extract_sale_number_series(df['sale_number_internal'], df.get('sale_date'))
 
         # Fallback Metadata
         if 'sale_date' not in df.columns:
@@ -451,13 +1992,6 @@ def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
         else:
             df['sale_number'] = df['sale_number'].fillna(metadata['sale_number'])
 
-        # Filter invalid metadata rows
-        df = df[(df['sale_number'] != 'Unknown') & (df['sale_date'] != 'Unknown') & df['sale_date'].notna() & df['sale_number'].notna()]
-
-        if df.empty:
-            log_processed(file_identifier, 0, conn, data_type, status='SUCCESS_NO_DATA')
-            return
-
         # 4. Clean Data (Numeric)
         numeric_cols = ['price', 'quantity_kgs', 'valuation_or_rp', 'package_count']
         for col in numeric_cols:
@@ -467,10 +2001,12 @@ def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
              df['package_count'] = df['package_count'].round().astype('Int64') 
 
         # Clean Data (Text Identifiers - excluding 'mark' which is already handled)
+        # V6: Whole numbers read into a float column ("47996.0") are written as "47996", so a
+        # key's text does not depend on the dtype the reader inferred (whole sheet or stream chunk)
         text_cols = ['grade', 'lot_number', 'broker', 'buyer', 'invoice_number']
         for col in text_cols:
              if col in df.columns:
-                df[col] = df[col].astype(str).str.strip().str.upper()
+                df[col] = df[col].astype(str).str.strip().str.upper().str.replace(WHOLE_NUMBER_TEXT, r"\1", regex=True)
                 df[col] = df[col].replace(noise_values, None)
 
         # Add remaining metadata
@@ -478,26 +2014,34 @@ def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
         df['source_file_identifier'] = file_identifier
         df['processed_timestamp'] = metadata['timestamp']
 
-        # 5. Filter required columns
+        # 5. Validate rows
         # Broker and Lot Number are required for uniqueness. Mark and Grade are highly desired.
         required_base_cols = ['lot_number', 'broker', 'mark', 'grade'] 
         required_cols = required_base_cols + required_specific_cols
 
-        if all(col in df.columns for col in required_cols):
-             # Drop rows where required columns are None (crucial for Mark/Garden)
-             df = df.dropna(subset=required_cols)
-        else:
-             missing = [col for col in required_cols if col not in df.columns]
-             # Check if the essential keys (lot/broker) are missing
-             if 'lot_number' not in df.columns or 'broker' not in df.columns:
-                logging.warning(f"    Missing essential columns (Lot/Broker) for {data_type}: {missing}. Skipping load.")
-                log_processed(file_identifier, 0, conn, data_type, status='FAILED_MISSING_COLS')
-                return
-             # If only mark/grade/etc are missing, drop those specific rows
-             df = df.dropna(subset=required_cols)
+        if 'lot_number' not in df.columns or 'broker' not in df.columns:
+            missing = [col for col in required_cols if col not in df.columns]
+            logging.warning(f"    Missing essential columns (Lot/Broker) for {data_type}: {missing}. Skipping load.")
+            return make_load_result(file_identifier, data_type, status='FAILED_MISSING_COLS', metrics=metrics)
+
+        # V6: Rows failing a rule (unknown sale, missing required column, bad price or quantity)
+        # are quarantined in rejected_lots instead of being dropped.
+        # The outlier reference is the sheet's (a streamed chunk gets its first chunk's in metadata).
+        quantity_median = metadata.get('quantity_median')
+        if quantity_median is None:
+            quantity_median = positive_quantity_median(df)
+        df, rejected = split_rejected_rows(df, lot_validation_rules(df, data_type, quantity_median))
+        metrics['rows_dropped'] = len(rejected)
+        if not rejected.empty:
+            counts = ", ".join(f"{reason} {count}" for reason, count in rejected['reason'].value_counts(sort=False).items())
+            logging.info(f"    [REJECTED] {len(rejected)} rows: {counts}")
 
+        if df.empty:
+            return make_load_result(file_identifier, data_type, status='SUCCESS_NO_DATA', metrics=metrics, rejected=rejected,
+                                    quantity_median=quantity_median)
 
-        # 6. Load into Database (Now uses UPSERT via execute_insert)
+
+        # 6. Select the columns to load (written via UPSERT by write_load_result)
         db_columns = [
             'source_location', 'sale_date', 'sale_number', 'broker', 'mark', 'grade', 
             'lot_number', 'invoice_number', 'quantity_kgs', 'package_count', 
@@ -509,32 +2053,84 @@ def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
             db_columns.append('valuation_or_rp')
 
         data_to_insert = df[df.columns.intersection(db_columns)]
-        
-        # V5: execute_insert now handles UPSERT logic
-        affected_count = execute_insert(conn, target_table, data_to_insert)
-        
-        if affected_count > 0:
-            logging.info(f"    [SUCCESS] Inserted/Updated {affected_count} records in {target_table}.")
-        else:
-             logging.info(f"    [INFO] No changes detected in {target_table}.")
-
-        log_processed(file_identifier, affected_count, conn, data_type, status='SUCCESS')
+        return make_load_result(file_identifier, data_type, target_table, data_to_insert, metrics=metrics, rejected=rejected,
+                                quantity_median=quantity_median)
 
     except Exception as e:
         logging.error(f"  [ERROR] Unexpected error processing lots {file_identifier}: {e}", exc_info=True)
-        log_processed(file_identifier, 0, conn, data_type, status='FAILED_PROCESSING')
+        return make_load_result(file_identifier, data_type, status='FAILED_PROCESSING', metrics=metrics)
+    finally:
+        # The result holds the same dict, so this also covers the early returns
+        if 'map_seconds' in metrics:
+            metrics['clean_seconds'] = time.perf_counter() - stage_start
+
+def positive_quantity_median(df):
+    """V6: Median of the positive quantity_kgs values (None without any): the QUANTITY_OUTLIER reference."""
+    if 'quantity_kgs' not in df.columns:
+        return None
+    quantity = pd.to_numeric(df['quantity_kgs'], errors='coerce')
+    median = quantity[quantity > 0].median()
+    return None if pd.isna(median) else float(median)
+
+def lot_validation_rules(df, data_type, quantity_median=None):
+    """V6: (reason, boolean mask of failing rows) per rule, in priority order. Vectorized: one
+    pass over a column per rule. A column the sheet does not have fails for every row.
+    quantity_median is the sheet's reference for QUANTITY_OUTLIER (default: the median of df).
+    Quantities of zero or less are outliers too; a missing quantity is not."""
+    def missing(col):
+        return df[col].isna() if col in df.columns else pd.Series(True, index=df.index)
+    def column(col):
+        return pd.to_numeric(df[col], errors='coerce') if col in df.columns else pd.Series(np.nan, index=df.index)
+
+    rules = [
+        ('MISSING_SALE_NUMBER', missing('sale_number') | (df['sale_number'] == 'Unknown')),
+        ('UNPARSEABLE_DATE', missing('sale_date') | (df['sale_date'] == 'Unknown')),
+        ('MISSING_LOT', missing('lot_number')),
+        ('MISSING_BROKER', missing('broker')),
+        ('MISSING_MARK', missing('mark')),
+        ('MISSING_GRADE', missing('grade')),
+    ]
+    if data_type == DATA_TYPE_SALE:
+        rules += [
+            ('MISSING_PRICE', missing('price')),
+            ('MISSING_BUYER', missing('buyer')),
+            ('NON_POSITIVE_PRICE', column('price') <= 0),
+        ]
+    quantity = column('quantity_kgs')
+    if quantity_median is None:
+        quantity_median = positive_quantity_median(df)
+    outlier = quantity <= 0
+    if quantity_median is not None:
+        outlier |= quantity > QUANTITY_OUTLIER_FACTOR * quantity_median
+    rules.append(('QUANTITY_OUTLIER', outlier))
+    return rules
+
+def split_rejected_rows(df, rules):
+    """Splits df into (accepted rows, rejected rows with the 'reason' of the first rule they fail)."""
+    masks = [np.asarray(mask.fillna(False), dtype=bool) for _, mask in rules]
+    reasons = np.select(masks, [reason for reason, _ in rules], default='')
+    rejected = reasons != ''
+    return df[~rejected], df[rejected].assign(reason=reasons[rejected])
 
+def load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False):
+    """Cleans and loads lot data in one step."""
+    write_load_result(conn, clean_lot_details(df, metadata, data_type, use_internal_metadata=use_internal_metadata))
 
-def load_grade_summary(df, metadata, auction_type, conn):
-    # (Logic remains similar, using standard INSERT OR IGNORE via execute_insert)
+
+def clean_grade_summary(df, metadata, auction_type):
+    # (Logic remains similar, loaded with standard INSERT OR IGNORE via execute_insert)
     file_identifier = metadata['file_identifier']
     data_type = DATA_TYPE_SUMMARY
     logging.info(f"  [PROCESSING SUMMARY] {file_identifier} (Type: {auction_type})")
 
+    metrics = {'read_seconds': metadata.get('read_seconds'), 'rows_in': len(df), 'rows_dropped': 0}
+    stage_start = time.perf_counter()
     try:
         # 1. Map Columns
         column_mapping, _ = map_columns(df.columns, COLUMN_MAP_GRADE_SUMMARY)
         df = df.rename(columns=column_mapping)
+        metrics['map_seconds'] = time.perf_counter() - stage_start
+        stage_start = time.perf_counter()
 
         # 2. Clean Data
         df = clean_numeric_column(df, 'quantity_kgs')
@@ -557,122 +2153,506 @@ def load_grade_summary(df, metadata, auction_type, conn):
         df['processed_timestamp'] = metadata['timestamp']
 
         if 'grade' in df.columns:
+             rows_before_drop = len(df)
              df = df.dropna(subset=['grade'])
+             metrics['rows_dropped'] = rows_before_drop - len(df)
              filter_keywords = "TOTAL|KENYA|BURUNDI|UGANDA|RWANDA|MALAWI|TANZANIA|MOZAMBIQUE|ETHIOPIA|DRC"
              df = df[~df['grade'].str.contains(filter_keywords, na=False)]
         else:
-             log_processed(file_identifier, 0, conn, data_type, status='FAILED_MISSING_COLS')
-             return
+             return make_load_result(file_identifier, data_type, status='FAILED_MISSING_COLS', metrics=metrics)
 
-        # 4. Load
+        # 4. Select the columns to load
         db_columns = [
             'source_location', 'sale_date', 'sale_number', 'auction_type', 'grade', 
             'lots', 'quantity_kgs', 'source_file_identifier', 'processed_timestamp'
         ]
         data_to_insert = df[df.columns.intersection(db_columns)]
-        inserted_count = execute_insert(conn, 'grade_summary', data_to_insert)
-        
-        if inserted_count > 0:
-            logging.info(f"    [SUCCESS] Inserted {inserted_count} new summary records.")
-        
-        log_processed(file_identifier, inserted_count, conn, data_type, status='SUCCESS')
+        return make_load_result(file_identifier, data_type, 'grade_summary', data_to_insert, metrics=metrics)
 
     except Exception as e:
         logging.error(f"  [ERROR] Unexpected error processing summary {file_identifier}: {e}", exc_info=True)
-        log_processed(file_identifier, 0, conn, data_type, status='FAILED_PROCESSING')
+        return make_load_result(file_identifier, data_type, status='FAILED_PROCESSING', metrics=metrics)
+    finally:
+        if 'map_seconds' in metrics:
+            metrics['clean_seconds'] = time.perf_counter() - stage_start
+
+def load_grade_summary(df, metadata, auction_type, conn):
+    write_load_result(conn, clean_grade_summary(df, metadata, auction_type))
 
 # =============================================================================
 # File Type Specific Processors (Handlers)
+# V6: Each handler has a parse_* half that reads and cleans without touching the
+# database (safe to run in a worker process), and a process_* wrapper that
+# writes the results through the single writer.
 # =============================================================================
 
-def process_auction_summary(filepath, filename, conn):
+def parse_auction_summary(filepath, filename):
     logging.info(f"\n[HANDLER] AuctionSummary (Offers/Summary): {filename}")
     sheet_configs = {
         'Detail': {'header': 0, 'type': DATA_TYPE_OFFER},
         'Main Summary': {'header': 2, 'type': DATA_TYPE_SUMMARY, 'auction_type': 'Main'},
         'Secondary Summary': {'header': 2, 'type': DATA_TYPE_SUMMARY, 'auction_type': 'Secondary'},
     }
+    results = []
+    workbook = None
     try:
-        xls_file = pd.ExcelFile(filepath, engine='openpyxl')
+        workbook = open_workbook(filepath)
         sale_number, sale_date = extract_metadata(filename)
         
         for sheetname, config in sheet_configs.items():
-            if sheetname in xls_file.sheet_names:
+            if sheetname in workbook['sheet_names']:
                 data_type = config['type']
                 file_identifier = get_file_identifier(filename, sheetname)
                 
                 # V5: We intentionally DO NOT check is_processed here for structured data.
-                # We want the UPSERT logic to run every time to ensure data enrichment.
+                # V6: run_processor skips the whole file instead when its content hash is unchanged.
 
-                df = pd.read_excel(xls_file, sheet_name=sheetname, header=config['header'])
+                read_start = time.perf_counter()
+                df = read_sheet(workbook, sheetname, header=config['header'])
                 
-                metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': datetime.now().isoformat()}
+                metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': datetime.now().isoformat(),
+                            'read_seconds': time.perf_counter() - read_start}
 
                 if data_type in [DATA_TYPE_SALE, DATA_TYPE_OFFER]:
-                    load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
+                    results.append(clean_lot_details(df, metadata, data_type, use_internal_metadata=False))
                 elif data_type == DATA_TYPE_SUMMARY:
-                    load_grade_summary(df, metadata, config['auction_type'], conn)
+                    results.append(clean_grade_summary(df, metadata, config['auction_type']))
     except Exception as e:
         logging.error(f"  [ERROR] Failed to process {filename}: {e}")
+        results.append(make_load_result(get_file_identifier(filename), DATA_TYPE_FILE, status='FAILED_PROCESSING'))
+    finally:
+        if workbook:
+            close_workbook(workbook)
+    return results
 
-def process_complete_offer_lots(filepath, filename, conn):
+def process_auction_summary(filepath, filename, conn):
+    write_load_results(conn, parse_auction_summary(filepath, filename))
+
+def parse_complete_offer_lots(filepath, filename):
     logging.info(f"\n[HANDLER] CompleteOfferLots (Offers): {filename}")
     data_type = DATA_TYPE_OFFER
+    results = []
+    workbook = None
     try:
-        xls_file = pd.ExcelFile(filepath, engine='openpyxl')
+        workbook = open_workbook(filepath)
         sale_number, sale_date = extract_metadata(filename)
 
-        for sheetname in xls_file.sheet_names:
+        for sheetname in workbook['sheet_names']:
             file_identifier = get_file_identifier(filename, sheetname)
             
-            # V5: Intentionally allow re-processing for UPSERT.
+            # V5: Intentionally allow re-processing for UPSERT (V6: gated by content hash in run_processor).
 
-            header_row = find_header_row(xls_file, sheetname, HEADER_KEYWORDS)
+            read_start = time.perf_counter()
+            header_row = find_header_row(workbook, sheetname, HEADER_KEYWORDS)
             if header_row is not None:
                 logging.info(f"  [INFO] Found headers on row {header_row + 1} for sheet {sheetname}")
-                df = pd.read_excel(xls_file, sheet_name=sheetname, header=header_row)
+                df = read_sheet(workbook, sheetname, header=header_row)
                 df['Broker'] = sheetname
-                metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': datetime.now().isoformat()}
-                load_lot_details(df, metadata, data_type, conn, use_internal_metadata=False)
+                metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': datetime.now().isoformat(),
+                            'read_seconds': time.perf_counter() - read_start}
+                results.append(clean_lot_details(df, metadata, data_type, use_internal_metadata=False))
             else:
                 logging.warning(f"  [WARNING] Could not find header row in sheet: {sheetname}.")
-                log_processed(file_identifier, 0, conn, data_type, status='FAILED_DYNAMIC_HEADER')
+                results.append(make_load_result(file_identifier, data_type, status='FAILED_DYNAMIC_HEADER'))
     except Exception as e:
         logging.error(f"  [ERROR] Failed to process {filename}: {e}")
+        results.append(make_load_result(get_file_identifier(filename), DATA_TYPE_FILE, status='FAILED_PROCESSING'))
+    finally:
+        if workbook:
+            close_workbook(workbook)
+    return results
 
-def process_standard_format(filepath, filename, conn, data_type, target_sheet=None, clean_second_row=False, use_internal_metadata=False):
+def process_complete_offer_lots(filepath, filename, conn):
+    write_load_results(conn, parse_complete_offer_lots(filepath, filename))
+
+# V6: "Auction Quantity" layout: one row per sale number ("06.01.25 sale 01") and, per season,
+# a block of columns headed "Ttl'25", "Main", "Sec", ... (older seasons only have Ttl/Reprints/Fresh)
+QUANTITY_SEASON_PATTERN = re.compile(r"^Ttl\W*(\d{2})$", re.IGNORECASE)
+QUANTITY_SALE_PATTERN = r"(?:(\d{2})\.(\d{2})\.(\d{2}))?\s*sale\s*(\d+)"
+QUANTITY_CATEGORIES = {
+    'TTL': 'TOTAL', 'MAIN': 'MAIN', 'SEC': 'SECONDARY', 'KENYA': 'KENYA',
+    'FOREIGN': 'FOREIGN', 'REPRINTS': 'REPRINTS', 'FRESH': 'FRESH',
+}
+
+def map_quantity_columns(header):
+    """Maps each column of a season block to (season year, category)."""
+    columns = {}
+    year = None
+    for index, label in enumerate(header):
+        label = str(label).strip() if label is not None else ''
+        match = QUANTITY_SEASON_PATTERN.match(label)
+        if match:
+            year = 2000 + int(match.group(1))
+            columns[index] = (year, 'TOTAL')
+        elif year and label.upper() in QUANTITY_CATEGORIES:
+            columns[index] = (year, QUANTITY_CATEGORIES[label.upper()])
+    return columns
+
+def clean_auction_quantities(rows, metadata):
+    """Unpivots the season blocks into (sale_number, category, kgs) rows.
+    The row label's date is that sale's date in the current season only."""
+    file_identifier = metadata['file_identifier']
+    data_type = DATA_TYPE_QUANTITY
+    metrics = {'read_seconds': metadata.get('read_seconds'), 'rows_in': max(len(rows) - 1, 0)}
+    stage_start = time.perf_counter()
+    columns = map_quantity_columns(rows[0]) if rows else {}
+    metrics['map_seconds'] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+    if not columns:
+        logging.warning(f"  [WARNING] No season columns found in {file_identifier}.")
+        return make_load_result(file_identifier, data_type, status='FAILED_MISSING_COLS', metrics=metrics)
+
+    df = pd.DataFrame(rows[1:], columns=range(len(rows[0])))
+    label = df[0].astype(str).str.extract(QUANTITY_SALE_PATTERN, flags=re.IGNORECASE)
+    df['sale'] = pd.to_numeric(label[3], errors='coerce')
+    df['label_year'] = 2000 + pd.to_numeric(label[2], errors='coerce')
+    df['label_date'] = label[2].radd('20') + '-' + label[1] + '-' + label[0]
+    df = df.dropna(subset=['sale'])
+
+    df = df.melt(id_vars=['sale', 'label_year', 'label_date'], value_vars=list(columns), var_name='column', value_name='kgs')
+    df['kgs'] = pd.to_numeric(df['kgs'], errors='coerce')
+    df = df.dropna(subset=['kgs'])
+    df['year'] = df['column'].map(lambda column: columns[column][0])
+    df['category'] = df['column'].map(lambda column: columns[column][1])
+
+    df['source_location'] = SOURCE_LOCATION
+    df['sale_number'] = df['year'].astype(str) + '-' + df['sale'].astype(int).map('{:02d}'.format)
+    df['sale_date'] = df['label_date'].where(df['label_year'] == df['year'], None)
+    df['source_file_identifier'] = file_identifier
+    df['processed_timestamp'] = metadata['timestamp']
+
+    db_columns = ['source_location', 'sale_number', 'sale_date', 'category', 'kgs', 'source_file_identifier', 'processed_timestamp']
+    df = df.sort_values(['year', 'sale', 'column'], kind='stable')[db_columns].reset_index(drop=True)
+    metrics['clean_seconds'] = time.perf_counter() - stage_start
+    logging.info(f"  [PROCESSING QUANTITIES] {file_identifier}: {len(df)} values for {df['sale_number'].nunique()} sales.")
+    return make_load_result(file_identifier, data_type, 'auction_quantities', df, metrics=metrics)
+
+def parse_auction_quantities(filepath, filename):
+    """V6: The season volume workbook. Loaded with INSERT OR IGNORE on (sale_number, category),
+    so a re-issued workbook only appends the sales (and categories) not stored yet."""
+    logging.info(f"\n[HANDLER] Auction Quantities (Time Series): {filename}")
+    results = []
+    workbook = None
+    try:
+        workbook = open_workbook(filepath)
+        timestamp = datetime.now().isoformat()
+        for sheetname in workbook['sheet_names']:
+            read_start = time.perf_counter()
+            rows = read_sheet_rows(workbook, sheetname)
+            if not rows or not map_quantity_columns(rows[0]):
+                continue # Empty helper sheets
+            metadata = {'file_identifier': get_file_identifier(filename, sheetname), 'timestamp': timestamp,
+                        'read_seconds': time.perf_counter() - read_start}
+            results.append(clean_auction_quantities(rows, metadata))
+    except Exception as e:
+        logging.error(f"  [ERROR] Failed to process {filename}: {e}")
+        results.append(make_load_result(get_file_identifier(filename), DATA_TYPE_FILE, status='FAILED_PROCESSING'))
+    finally:
+        if workbook:
+            close_workbook(workbook)
+    return results
+
+def process_auction_quantities(filepath, filename, conn):
+    write_load_results(conn, parse_auction_quantities(filepath, filename))
+
+def parse_standard_format(filepath, filename, data_type, target_sheet=None, clean_second_row=False, use_internal_metadata=False):
     handler_name = "Sale Catalogue (Offers)" if data_type == DATA_TYPE_OFFER else "GeneralReport (Sales)"
     logging.info(f"\n[HANDLER] {handler_name}: {filename}")
+    results = []
+    workbook = None
     try:
-        xls_file = pd.ExcelFile(filepath, engine='openpyxl')
+        workbook = open_workbook(filepath)
         
-        if target_sheet and target_sheet in xls_file.sheet_names:
+        if target_sheet and target_sheet in workbook['sheet_names']:
             sheets_to_process = [target_sheet]
-        elif not target_sheet and xls_file.sheet_names:
-            sheets_to_process = [xls_file.sheet_names[0]]
+        elif not target_sheet and workbook['sheet_names']:
+            sheets_to_process = [workbook['sheet_names'][0]]
         else:
-            return
+            return results
 
         first_sheet_name = sheets_to_process[0]
-        df_initial = pd.read_excel(xls_file, sheet_name=first_sheet_name, header=0)
+        read_start = time.perf_counter()
+        df_initial = read_sheet(workbook, first_sheet_name, header=0)
+        first_read_seconds = time.perf_counter() - read_start
         sale_number, sale_date = extract_metadata(filename, df_initial)
 
         for sheetname in sheets_to_process:
             file_identifier = get_file_identifier(filename, sheetname)
             
-            # V5: Intentionally allow re-processing for UPSERT.
+            # V5: Intentionally allow re-processing for UPSERT (V6: gated by content hash in run_processor).
 
-            df = df_initial if sheetname == first_sheet_name else pd.read_excel(xls_file, sheet_name=sheetname, header=0)
+            read_start = time.perf_counter()
+            df = df_initial if sheetname == first_sheet_name else read_sheet(workbook, sheetname, header=0)
+            read_seconds = first_read_seconds if sheetname == first_sheet_name else time.perf_counter() - read_start
 
             if clean_second_row and not df.empty:
                  if df.iloc[0].isnull().sum() > len(df.columns) / 2:
                     logging.info("  [INFO] Cleaning second row (noise/metadata).")
                     df = df.drop(0).reset_index(drop=True)
             
-            metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': datetime.now().isoformat()}
-            load_lot_details(df, metadata, data_type, conn, use_internal_metadata=use_internal_metadata)
+            metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': datetime.now().isoformat(),
+                        'read_seconds': read_seconds}
+            results.append(clean_lot_details(df, metadata, data_type, use_internal_metadata=use_internal_metadata))
+    except Exception as e:
+        logging.error(f"  [ERROR] Failed to process {filename}: {e}")
+        results.append(make_load_result(get_file_identifier(filename), DATA_TYPE_FILE, status='FAILED_PROCESSING'))
+    finally:
+        if workbook:
+            close_workbook(workbook)
+    return results
+
+def process_standard_format(filepath, filename, conn, data_type, target_sheet=None, clean_second_row=False, use_internal_metadata=False):
+    write_load_results(conn, parse_standard_format(
+        filepath, filename, data_type,
+        target_sheet=target_sheet,
+        clean_second_row=clean_second_row,
+        use_internal_metadata=use_internal_metadata
+    ))
+
+def iter_standard_format(filepath, filename, data_type, target_sheet=None, clean_second_row=False, use_internal_metadata=False, chunk_rows=STREAM_CHUNK_ROWS):
+    """V6: Streaming variant of parse_standard_format for very large sheets.
+
+    Yields one load result per chunk of chunk_rows rows, so the writer upserts each chunk
+    before the next one is read and peak memory does not grow with the sheet size.
+    Metadata, the second-row cleaning and the QUANTITY_OUTLIER reference median are taken
+    from the first chunk, so a lot's validation does not depend on which rows share its chunk.
+    """
+    handler_name = "Sale Catalogue (Offers)" if data_type == DATA_TYPE_OFFER else "GeneralReport (Sales)"
+    logging.info(f"\n[HANDLER] {handler_name} (streaming, {chunk_rows} rows per chunk): {filename}")
+    try:
+        sheet_names = get_sheet_names(filepath)
+
+        if target_sheet and target_sheet in sheet_names:
+            sheetname = target_sheet
+        elif not target_sheet and sheet_names:
+            sheetname = sheet_names[0]
+        else:
+            return
+
+        file_identifier = get_file_identifier(filename, sheetname)
+        timestamp = datetime.now().isoformat()
+        sale_number, sale_date = None, None
+        quantity_median = None
+
+        chunks = iter_sheet_chunks(filepath, sheetname, chunk_rows)
+        chunk_index = 0
+        while True:
+            read_start = time.perf_counter()
+            df = next(chunks, None)
+            if df is None:
+                break
+            read_seconds = time.perf_counter() - read_start
+
+            if chunk_index == 0:
+                sale_number, sale_date = extract_metadata(filename, df)
+
+                if clean_second_row and not df.empty:
+                     if df.iloc[0].isnull().sum() > len(df.columns) / 2:
+                        logging.info("  [INFO] Cleaning second row (noise/metadata).")
+                        df = df.drop(0).reset_index(drop=True)
+
+            metadata = {'file_identifier': file_identifier, 'sale_number': sale_number, 'sale_date': sale_date, 'timestamp': timestamp,
+                        'read_seconds': read_seconds, 'quantity_median': quantity_median}
+            result = clean_lot_details(df, metadata, data_type, use_internal_metadata=use_internal_metadata)
+            if quantity_median is None:
+                quantity_median = result['quantity_median']
+            yield result
+            chunk_index += 1
     except Exception as e:
         logging.error(f"  [ERROR] Failed to process {filename}: {e}")
+        yield make_load_result(get_file_identifier(filename), DATA_TYPE_FILE, status='FAILED_PROCESSING')
+
+# Text files in MOMBASA_DIR that are not reports
+IGNORED_REPORT_FILES = ['header diagnostic.txt', 'mombasa i.txt']
+
+# V6: Handler keys returned by route_structured_file
+HANDLER_AUCTION_SUMMARY = 'AUCTION_SUMMARY'
+HANDLER_GENERAL_REPORT = 'GENERAL_REPORT'
+HANDLER_COMPLETE_OFFER_LOTS = 'COMPLETE_OFFER_LOTS'
+HANDLER_SALE_CATALOGUE = 'SALE_CATALOGUE'
+HANDLER_TIME_SERIES = 'TIME_SERIES'
+
+# =============================================================================
+# V6: Content-Based Routing
+# Brokers and staff rename exports before they reach MOMBASA_DIR, so workbooks are
+# routed on what they contain. Only the sheet names and the first
+# CLASSIFY_SCAN_ROWS rows of each sheet are looked at, with no DataFrames, header
+# mapping or cleaning. The header rows found there form the layout fingerprint;
+# decisions are cached per fingerprint, the fingerprint is cached per file (path,
+# size, mtime) and kept in the file's landing directory, so a workbook's rows are
+# peeked at most once for a given content. The filename rules are kept as the
+# fallback for files whose content is not recognized.
+# =============================================================================
+
+LAYOUT_LOT_DETAILS = 'LOT_DETAILS'
+LAYOUT_GRADE_SUMMARY = 'GRADE_SUMMARY'
+LAYOUT_QUANTITY = 'QUANTITY'
+LANDING_LAYOUT = "layout.json"
+
+def peek_workbook(filepath, max_rows=CLASSIFY_SCAN_ROWS):
+    """Sheet name -> its first max_rows rows of raw cell values, read with the configured backend."""
+    engine = resolve_excel_engine()
+    book, sheet_names = open_book(filepath, engine)
+    try:
+        if engine == 'calamine':
+            return {sheetname: book.get_sheet_by_name(sheetname).to_python(skip_empty_area=False, nrows=max_rows)
+                    for sheetname in sheet_names}
+        return {sheetname: [list(row) for row in book[sheetname].iter_rows(max_row=max_rows, values_only=True)]
+                for sheetname in sheet_names}
+    finally:
+        if engine == 'openpyxl':
+            book.close()
+
+def detect_sheet_header(rows):
+    """(row index, layout kind, normalized header) of the first row that reads as a known
+    header (at least 3 recognized columns), or None."""
+    for index, row in enumerate(rows):
+        header = tuple(str(cell).strip().lower() for cell in row if cell is not None and str(cell).strip())
+        if len(header) < 3:
+            continue
+        if map_quantity_columns(row):
+            return (index, LAYOUT_QUANTITY, header)
+        for kind, mapping in ((LAYOUT_GRADE_SUMMARY, COLUMN_MAP_GRADE_SUMMARY), (LAYOUT_LOT_DETAILS, COLUMN_MAP_LOT_DETAILS)):
+            mapped = set(map_columns(header, mapping)[0].values())
+            if len(mapped) >= min(3, len(mapping)):
+                return (index, kind, header)
+    return None
+
+def fingerprint_layout(sheet_rows):
+    """The distinct header rows of a workbook. Sheet names are left out: CompleteOfferLots
+    has one sheet per broker, and which brokers offer changes from sale to sale."""
+    headers = (detect_sheet_header(rows) for rows in sheet_rows.values())
+    return tuple(sorted(set(header for header in headers if header is not None)))
+
+@functools.lru_cache(maxsize=256)
+def classify_layout(layout):
+    """Handler for a layout fingerprint, or None."""
+    kinds = {(kind, index == 0) for index, kind, _ in layout}
+    if (LAYOUT_QUANTITY, True) in kinds:
+        return HANDLER_TIME_SERIES # parse_auction_quantities reads the header from the first row
+    if any(kind == LAYOUT_GRADE_SUMMARY for kind, _ in kinds):
+        return HANDLER_AUCTION_SUMMARY # Main/Secondary Summary sheets next to the Detail sheet
+    if (LAYOUT_LOT_DETAILS, False) in kinds:
+        return HANDLER_COMPLETE_OFFER_LOTS # Lot header under a title block: found by find_header_row
+    for index, kind, header in layout:
+        if kind == LAYOUT_LOT_DETAILS:
+            mapped = set(map_columns(header, COLUMN_MAP_LOT_DETAILS)[0].values())
+            # Sale results carry prices or buyers; a catalogue only asking prices/valuations
+            return HANDLER_GENERAL_REPORT if mapped & {'price', 'buyer'} else HANDLER_SALE_CATALOGUE
+    return None
+
+def read_workbook_layout(filepath):
+    """Layout fingerprint of a workbook. Kept in its landing directory (when landing is on),
+    so a forced rebuild does not peek at unchanged files again."""
+    landing_dir = get_landing_dir(filepath)
+    layout_path = os.path.join(landing_dir, LANDING_LAYOUT) if landing_dir else None
+    if layout_path and os.path.exists(layout_path):
+        try:
+            with open(layout_path, encoding='utf-8') as f:
+                return tuple((index, kind, tuple(header)) for index, kind, header in json.load(f)['layout'])
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"  [LANDING] Ignoring unreadable layout in {landing_dir}: {e}")
+
+    layout = fingerprint_layout(peek_workbook(filepath))
+    if layout_path:
+        def write(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'layout': layout}, f)
+        try:
+            os.makedirs(landing_dir, exist_ok=True)
+            write_atomically(layout_path, write)
+        except OSError as e:
+            logging.warning(f"  [LANDING] Could not write layout to {landing_dir}: {e}")
+    return layout
+
+@functools.lru_cache(maxsize=1024)
+def cached_classification(filepath, file_size, file_mtime_ns):
+    """classify_layout of a file, keyed by its stat so an overwritten file is classified again."""
+    return classify_layout(read_workbook_layout(filepath))
+
+def classify_workbook(filepath):
+    """V6: The handler a workbook's content calls for, or None if it is not recognized."""
+    try:
+        stat = os.stat(filepath)
+        return cached_classification(filepath, stat.st_size, stat.st_mtime_ns)
+    except Exception as e:
+        logging.warning(f"  [WARNING] Could not read the layout of {os.path.basename(filepath)}: {e}")
+        return None
+
+def route_structured_file(filename, filepath=None):
+    """Picks the handler for an XLSX file, or None if the format is not recognized.
+    V6: By content (classify_workbook) when the file is readable (filepath defaults to the
+    file in MOMBASA_DIR), falling back to the filename rules."""
+    filepath = filepath or os.path.join(MOMBASA_DIR, filename)
+    if filename.lower().endswith('.xlsx') and os.path.exists(filepath):
+        handler = classify_workbook(filepath)
+        if handler:
+            return handler
+    return route_by_filename(filename)
+
+def route_by_filename(filename):
+    """V5 routing: substring rules on the filename."""
+    fn_lower = filename.lower()
+
+    # --- File Type Routing ---
+
+    if 'auctionsummary' in fn_lower:
+        return HANDLER_AUCTION_SUMMARY
+    elif 'generalreport' in fn_lower:
+        return HANDLER_GENERAL_REPORT
+    elif 'completeofferlots' in fn_lower:
+        return HANDLER_COMPLETE_OFFER_LOTS
+    elif 'sale' in fn_lower and 'catalogue' in fn_lower:
+        return HANDLER_SALE_CATALOGUE
+    elif 'auction quantity' in fn_lower:
+        return HANDLER_TIME_SERIES
+    return None
+
+def route_time_series_table(filename):
+    """The table a file feeds through the time-series handler (see requeue_source_files)."""
+    return 'auction_quantities' if route_structured_file(filename) == HANDLER_TIME_SERIES else None
+
+# Keyword arguments for the GeneralReport handler (multi-sale sheet with a noise row)
+GENERAL_REPORT_OPTIONS = {
+    'data_type': DATA_TYPE_SALE,
+    'target_sheet': 'General Report',
+    'clean_second_row': True,
+    'use_internal_metadata': True,
+}
+
+def parse_structured_file(filepath, filename, handler=None):
+    """V6: Routes an XLSX file to its parser. Top-level so it can be sent to a process pool.
+    handler is the route already picked by the caller (saves re-reading the layout in a worker)."""
+    handler = handler or route_structured_file(filename, filepath)
+    if handler != route_by_filename(filename):
+        logging.info(f"\n[ROUTE] {filename}: recognized by content as {handler}")
+
+    if handler == HANDLER_AUCTION_SUMMARY:
+        return parse_auction_summary(filepath, filename)
+
+    elif handler == HANDLER_GENERAL_REPORT:
+        return parse_standard_format(filepath, filename, **GENERAL_REPORT_OPTIONS)
+
+    elif handler == HANDLER_COMPLETE_OFFER_LOTS:
+        return parse_complete_offer_lots(filepath, filename)
+
+    elif handler == HANDLER_SALE_CATALOGUE:
+        return parse_standard_format(filepath, filename, data_type=DATA_TYPE_OFFER)
+
+    elif handler == HANDLER_TIME_SERIES:
+        return parse_auction_quantities(filepath, filename)
+
+    else:
+        logging.info(f"\n[INFO] Skipping unrecognized XLSX file format: {filename}")
+
+    return []
+
+def stream_structured_file(filepath, filename, chunk_rows=STREAM_CHUNK_ROWS, handler=None):
+    """V6: Chunked counterpart of parse_structured_file for handlers that support streaming.
+    Returns None when the file's handler has no streaming path."""
+    if (handler or route_structured_file(filename, filepath)) == HANDLER_GENERAL_REPORT:
+        return iter_standard_format(filepath, filename, chunk_rows=chunk_rows, **GENERAL_REPORT_OPTIONS)
+    return None
 
 # =============================================================================
 # V5: Unstructured Data Processor
@@ -684,17 +2664,15 @@ def extract_text_from_file(filepath, extension):
     try:
         if extension == '.pdf':
             if fitz:
-                doc = fitz.open(filepath)
-                for page in doc:
-                    text += page.get_text()
+                with fitz.open(filepath) as doc:
+                    text = "".join(page.get_text() for page in doc)
             else:
                 logging.warning(f"PyMuPDF not installed. Skipping PDF: {os.path.basename(filepath)}")
                 return None
         elif extension == '.docx':
             if docx:
                 doc = docx.Document(filepath)
-                for para in doc.paragraphs:
-                    text += para.text + "\n"
+                text = "".join(para.text + "\n" for para in doc.paragraphs)
             else:
                 logging.warning(f"python-docx not installed. Skipping DOCX: {os.path.basename(filepath)}")
                 return None
@@ -706,78 +2684,518 @@ def extract_text_from_file(filepath, extension):
         return None
     return text.strip()
 
-def process_unstructured_report(filepath, filename, conn):
-    """Handler for PDF, DOCX, TXT reports."""
-    logging.info(f"\n[HANDLER] Unstructured Report: {filename}")
+def get_pdf_page_hashes(filepath):
+    """V6: SHA-256 of each page's content stream and size. No text layout is done, so this
+    is much cheaper than extraction and tells which pages changed since the last run."""
+    with fitz.open(filepath) as doc:
+        return [hashlib.sha256(page.read_contents() + repr(tuple(page.rect)).encode()).hexdigest() for page in doc]
+
+def extract_pdf_pages(filepath, page_numbers):
+    """V6: Text of the given pages (0-based). Top-level so it can be sent to a process pool."""
+    with fitz.open(filepath) as doc:
+        return [doc[page_number].get_text() for page_number in page_numbers]
+
+# =============================================================================
+# V6: PDF Price Tables
+# The "average prices" and "comparative prices" PDFs are grade-by-grade tables.
+# Rows and columns are rebuilt from PyMuPDF word bounding boxes: the header
+# words define the value columns, words are grouped into rows by their vertical
+# position, and each number is assigned to a column by its horizontal position.
+# Comparative prices have a High and a Low column per grade. Each holds a
+# price followed by its change against the previous sale, with negative
+# changes shown in brackets.
+# =============================================================================
+
+PRICE_TABLE_LAYOUTS = {
+    'average_prices': {
+        'filename_keyword': 'average prices',
+        'mark_header': 'Mark',
+        'order_header': 'order',
+        'band_headers': None,
+    },
+    'comparative_prices': {
+        'filename_keyword': 'comparative prices',
+        'mark_header': 'Factory',
+        'order_header': 'Order',
+        'band_headers': ['High', 'Low'],
+    },
+}
+PRICE_TABLE_FOOTERS = ('Compiled', 'Page', 'Subject') # Footer lines on every page
+PRICE_NUMBER_PATTERN = re.compile(r"^\(?\d+(?:\.\d+)?\)?$")
+
+def route_price_table(filename):
+    """The PRICE_TABLE_LAYOUTS key for a price table PDF, or None."""
+    fn_lower = re.sub(r"\s+", " ", filename.lower())
+    if not fn_lower.endswith('.pdf'):
+        return None
+    for table_name, layout in PRICE_TABLE_LAYOUTS.items():
+        if layout['filename_keyword'] in fn_lower:
+            return table_name
+    return None
+
+def parse_price_number(text):
+    """'336' -> 336.0, '(22)' -> -22.0"""
+    value = float(text.strip('()'))
+    return -value if text.startswith('(') else value
+
+def group_words_into_lines(words, tolerance=4):
+    """Groups word boxes whose vertical centres are within tolerance points, top to bottom."""
+    lines = []
+    for word in sorted(words, key=lambda w: (w[1] + w[3]) / 2):
+        center = (word[1] + word[3]) / 2
+        if lines and center - lines[-1]['center'] <= tolerance:
+            lines[-1]['words'].append(word)
+        else:
+            lines.append({'center': center, 'words': [word]})
+    return [sorted(line['words'], key=lambda w: w[0]) for line in lines]
+
+def merge_header_columns(words):
+    """Merges header words that overlap horizontally (multi-line labels) into columns.
+    Returns [{'label', 'x0', 'x1'}] from left to right."""
+    columns = []
+    for word in sorted(words, key=lambda w: w[0]):
+        if columns and word[0] <= columns[-1]['x1']:
+            column = columns[-1]
+            column['words'].append(word)
+            column['x1'] = max(column['x1'], word[2])
+        else:
+            columns.append({'words': [word], 'x0': word[0], 'x1': word[2]})
+    for column in columns:
+        texts = [w[4] for w in sorted(column['words'], key=lambda w: (w[1], w[0]))]
+        # 'Avg' is printed above 'Main'/'Sec': label those columns 'MAIN AVG'/'SEC AVG'
+        labels = [text for text in texts if text.lower() != 'avg'] + [text for text in texts if text.lower() == 'avg']
+        column['label'] = " ".join(labels).upper()
+    return columns
+
+def parse_price_table_page(words, layout):
+    """Parses one page of a price table. Returns (rows, region at the end of the page), where rows
+    are dicts with region, mark, sale_order and values {column label: price or (price, change)}."""
+    mark_header = next((w for w in words if w[4] == layout['mark_header']), None)
+    order_header = next((w for w in words if w[4] == layout['order_header']), None)
+    if mark_header is None or order_header is None:
+        return [], None
+
+    # Header band: between the 'Prompt Date' line and the bottom of the first column's label
+    prompt = next((w for w in words if w[4] == 'Prompt'), None)
+    header_top = prompt[3] if prompt else 0
+    header_bottom = mark_header[3] + 2
+    header_words = [w for w in words if w[1] >= header_top and w[3] <= header_bottom]
+
+    columns = merge_header_columns(header_words)
+    order_column = next(c for c in columns if order_header in c['words'])
+    value_columns = [c for c in columns if c['x0'] > order_column['x1']]
+    if layout['band_headers']:
+        # The High/Low columns carry the values; each belongs to the nearest grade label
+        bands = [c for c in value_columns if c['label'].title() in layout['band_headers']]
+        grades = [c for c in value_columns if c not in bands]
+        if not grades:
+            return [], None
+        for band in bands:
+            center = (band['x0'] + band['x1']) / 2
+            grade = min(grades, key=lambda g: abs((g['x0'] + g['x1']) / 2 - center))
+            band['label'] = (grade['label'], band['label'])
+        value_columns = bands
+    if not value_columns:
+        return [], None
+
+    rows = []
+    region = None
+    for line in group_words_into_lines([w for w in words if w[1] > header_bottom]):
+        # Long marks can run into the order column, so only a number there is the sale order
+        order_words = [w for w in line if w[4].isdigit()
+                       and order_column['x0'] - 4 <= (w[0] + w[2]) / 2 <= order_column['x1'] + 4]
+        mark_words = [w for w in line if w[0] < order_column['x0'] and w not in order_words]
+        number_words = [w for w in line if w[0] > order_column['x1'] + 2 and PRICE_NUMBER_PATTERN.match(w[4])]
+        mark = " ".join(w[4] for w in mark_words)
+
+        if not mark or mark.startswith(PRICE_TABLE_FOOTERS):
+            continue # Footer, or a region/group average row without a mark
+        if len(mark_words) == len(line):
+            if mark.isupper():
+                region = mark # Region heading (e.g. KTDA1, RWANDA)
+            continue
+        if len(order_words) != 1:
+            logging.warning(f"  [PRICES] Skipping unrecognised row: {' '.join(w[4] for w in line)}")
+            continue
+
+        values = {}
+        if layout['band_headers']:
+            last_label = None
+            for word in number_words:
+                price_columns = [c for c in value_columns
+                                 if c['x0'] - 3 <= word[2] <= c['x1'] + 4 and not word[4].startswith('(')]
+                label = min(price_columns, key=lambda c: abs(c['x1'] - word[2]))['label'] if price_columns else None
+                if label is not None and label not in values:
+                    values[label] = (parse_price_number(word[4]), None)
+                    last_label = label
+                elif last_label is not None and values[last_label][1] is None:
+                    # A change follows the price it belongs to
+                    values[last_label] = (values[last_label][0], parse_price_number(word[4]))
+        else:
+            for word in number_words:
+                center = (word[0] + word[2]) / 2
+                column = min(value_columns, key=lambda c: abs((c['x0'] + c['x1']) / 2 - center))
+                values[column['label']] = parse_price_number(word[4])
+
+        rows.append({'region': region, 'mark': mark.upper(), 'sale_order': order_words[0][4], 'values': values})
+    return rows, region
+
+def extract_price_table(filepath, table_name):
+    """V6: Parses a price table PDF into a DataFrame ready for average_prices/comparative_prices
+    (without source/timestamp columns). Top-level so it can be sent to a process pool."""
+    layout = PRICE_TABLE_LAYOUTS[table_name]
+    sale_number, sale_date = None, None
+    records = []
+    region = None
+    with fitz.open(filepath) as doc:
+        for page in doc:
+            if sale_number is None:
+                text = page.get_text()
+                match = re.search(r"Auction No:\s*(\d{4}/\d{1,2})", text)
+                if match:
+                    sale_number = extract_sale_number_from_string(match.group(1))
+                match = re.search(r"Sale Date:\s*(\d{1,2}-\d{1,2}-\d{4})", text)
+                if match:
+                    sale_date = parse_date(match.group(1).replace('-', '/'))
+
+            rows, page_region = parse_price_table_page(page.get_text('words'), layout)
+            for row in rows:
+                # A region heading carries over to the next page until a new one appears
+                row_region = row['region'] or region
+                for label, value in row['values'].items():
+                    record = {'region': row_region, 'mark': row['mark'], 'sale_order': row['sale_order']}
+                    if layout['band_headers']:
+                        record.update({'grade': label[0], 'price_band': label[1], 'price': value[0], 'price_change': value[1]})
+                    else:
+                        record.update({'grade': label, 'price': value})
+                    records.append(record)
+            region = page_region or region
+
+    if sale_number is None:
+        raise ValueError("No 'Auction No:' found; cannot tell which sale the prices belong to.")
+    df = pd.DataFrame(records)
+    df.insert(0, 'sale_date', sale_date)
+    df.insert(0, 'sale_number', sale_number)
+    return df
+
+def load_cached_pages(conn, filename, page_hashes):
+    """V6: {page index: text} for the pages whose stored hash still matches."""
+    cached = {}
+    for page_number, page_hash, content in conn.execute(
+            "SELECT page_number, page_hash, content FROM market_commentary_pages WHERE source_file = ?", (filename,)):
+        if 1 <= page_number <= len(page_hashes) and page_hashes[page_number - 1] == page_hash:
+            cached[page_number - 1] = content
+    return cached
+
+def get_commentary_content_type(filename):
+    """Determine Content Type based on filename heuristics."""
+    if 'weather' in filename.lower():
+        return 'WEATHER'
+    elif 'market report' in filename.lower() or 'weekly report' in filename.lower():
+        return 'MARKET_REPORT'
+    return 'GENERAL'
+
+def write_unstructured_report(conn, filename, content, fingerprint=None, pages=None, price_table=None):
+    """V6: Writes a report's content, its PDF pages (page index -> (hash, text) for the pages
+    that were re-extracted, plus 'page_count'), its price table ((table name, DataFrame or the
+    extraction error)) and the log entries in one transaction."""
     data_type = DATA_TYPE_COMMENTARY
     file_identifier = get_file_identifier(filename)
+    status = 'SUCCESS' if content else 'FAILED_EXTRACTION'
+    inserted_count, price_count = 0, 0
+    prices_failed = price_table is not None and isinstance(price_table[1], Exception)
+    file_metrics = {'input_bytes': fingerprint.get('file_size') if fingerprint else None}
+    upsert_start = time.perf_counter()
 
-    # We only process unstructured data once unless the content changes (which we don't track here)
-    if is_processed(file_identifier, conn, data_type):
-        logging.info(f"  [SKIPPING] Already processed: {file_identifier}")
+    try:
+        with conn:
+            if pages is not None:
+                timestamp = datetime.now().isoformat()
+                conn.executemany("""
+                    INSERT INTO market_commentary_pages (source_file, page_number, page_hash, content, processed_timestamp)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(source_file, page_number) DO UPDATE SET
+                        page_hash = excluded.page_hash, content = excluded.content, processed_timestamp = excluded.processed_timestamp
+                """, [(filename, index + 1, page_hash, text, timestamp) for index, (page_hash, text) in pages['extracted'].items()])
+                conn.execute("DELETE FROM market_commentary_pages WHERE source_file = ? AND page_number > ?",
+                             (filename, pages['page_count']))
+
+            if content:
+                # Attempt to extract metadata (using filename patterns)
+                sale_number, report_date = extract_metadata(filename)
+
+                # Prepare data for insertion
+                data = {
+                    'source_location': SOURCE_LOCATION,
+                    'report_date': report_date,
+                    'sale_number': sale_number,
+                    'content_type': get_commentary_content_type(filename),
+                    'content': content,
+                    'source_file': filename,
+                    'processed_timestamp': datetime.now().isoformat()
+                }
+                # V6: A changed report replaces its previous content
+                conn.execute("DELETE FROM market_commentary WHERE source_location = ? AND source_file = ?",
+                             (SOURCE_LOCATION, filename))
+                inserted_count = execute_insert(conn, 'market_commentary', pd.DataFrame([data]))
+
+            if price_table is not None:
+                table_name, prices = price_table
+                if not prices_failed:
+                    prices = prices.copy()
+                    prices.insert(0, 'source_location', SOURCE_LOCATION)
+                    prices['source_file'] = filename
+                    prices['processed_timestamp'] = datetime.now().isoformat()
+                    # A re-issued price list replaces the rows of its previous version
+                    conn.execute(f"DELETE FROM {table_name} WHERE source_location = ? AND source_file = ?",
+                                 (SOURCE_LOCATION, filename))
+                    price_count = execute_insert(conn, table_name, prices)
+                    logging.info(f"    [SUCCESS] Loaded {price_count} prices into {table_name}.")
+                log_processed(file_identifier, price_count, conn, DATA_TYPE_PRICES,
+                              status='FAILED_EXTRACTION' if prices_failed else 'SUCCESS')
+
+            log_processed(file_identifier, inserted_count, conn, data_type, status=status)
+            if fingerprint:
+                file_status = 'SUCCESS' if content and not prices_failed else 'FAILED'
+                log_processed(file_identifier, inserted_count, conn, DATA_TYPE_FILE, status=file_status, fingerprint=fingerprint)
+                # Text extraction runs batched over files (and the page cache), so only the write is timed
+                record_ingest_metrics(conn, file_identifier, DATA_TYPE_FILE, file_status, dict(
+                    file_metrics, rows_upserted=inserted_count + price_count, upsert_seconds=time.perf_counter() - upsert_start), 'UNSTRUCTURED')
+    except sqlite3.Error:
+        with conn:
+            log_processed(file_identifier, 0, conn, data_type, status='FAILED_DATABASE')
+            if price_table is not None:
+                log_processed(file_identifier, 0, conn, DATA_TYPE_PRICES, status='FAILED_DATABASE')
+            if fingerprint:
+                log_processed(file_identifier, 0, conn, DATA_TYPE_FILE, status='FAILED', fingerprint=fingerprint)
+                record_ingest_metrics(conn, file_identifier, DATA_TYPE_FILE, 'FAILED', dict(file_metrics, rows_upserted=0), 'UNSTRUCTURED')
         return
 
-    _, extension = os.path.splitext(filename.lower())
-    content = extract_text_from_file(filepath, extension)
-
-    if content:
-        # Attempt to extract metadata (using filename patterns)
-        sale_number, report_date = extract_metadata(filename)
-        timestamp = datetime.now().isoformat()
-
-        # Determine Content Type based on filename heuristics
-        if 'weather' in filename.lower():
-            content_type = 'WEATHER'
-        elif 'market report' in filename.lower() or 'weekly report' in filename.lower():
-            content_type = 'MARKET_REPORT'
+    if inserted_count > 0:
+        logging.info(f"    [SUCCESS] Extracted content from {filename}.")
+
+def run_extraction_tasks(tasks, workers=1):
+    """V6: Runs (function, args) tasks, in a process pool when workers > 1.
+    Returns one outcome per task, in order; a failed task's outcome is its exception."""
+    outcomes = []
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(function, *args) for function, args in tasks]
+            for future in futures:
+                try:
+                    outcomes.append(future.result())
+                except Exception as e:
+                    outcomes.append(e)
+    else:
+        for function, args in tasks:
+            try:
+                outcomes.append(function(*args))
+            except Exception as e:
+                outcomes.append(e)
+    return outcomes
+
+def process_unstructured_reports(reports, conn, workers=1):
+    """V6: Extracts and loads (filepath, filename, fingerprint) reports.
+
+    PDFs are extracted page by page. Pages whose content hash matches
+    market_commentary_pages are reused; only new or changed pages are extracted,
+    fanned out in batches of PDF_PAGES_PER_TASK over a process pool when workers > 1.
+    Price table PDFs are also parsed into average_prices/comparative_prices (one
+    pool task per file). DOCX/TXT files are small and read in this process.
+    """
+    plans = {}
+    tasks, task_keys = [], []
+    # Serially, one task per file avoids re-opening a document for every batch of pages
+    pages_per_task = PDF_PAGES_PER_TASK if workers > 1 else None
+    for filepath, filename, _ in reports:
+        if not filename.lower().endswith('.pdf') or not fitz:
+            continue
+        try:
+            page_hashes = get_pdf_page_hashes(filepath)
+        except Exception as e:
+            logging.error(f"Error extracting text from {filename}: {e}")
+            plans[filename] = None
+            continue
+        cached = load_cached_pages(conn, filename, page_hashes)
+        missing = [index for index in range(len(page_hashes)) if index not in cached]
+        plans[filename] = {'page_hashes': page_hashes, 'cached': cached, 'extracted': {}, 'price_table': None}
+        batch_size = pages_per_task or max(len(missing), 1)
+        for start in range(0, len(missing), batch_size):
+            tasks.append((extract_pdf_pages, (filepath, missing[start:start + batch_size])))
+            task_keys.append((filename, missing[start:start + batch_size]))
+
+        table_name = route_price_table(filename)
+        if table_name:
+            tasks.append((extract_price_table, (filepath, table_name)))
+            task_keys.append((filename, table_name))
+
+    page_count = sum(len(key) for _, key in task_keys if isinstance(key, list))
+    table_count = sum(1 for _, key in task_keys if not isinstance(key, list))
+    if tasks:
+        logging.info(f"Extracting {page_count} new or changed PDF pages and {table_count} price tables"
+                     f"{f' with {workers} worker processes' if workers > 1 and len(tasks) > 1 else ''}.")
+    outcomes = run_extraction_tasks(tasks, workers)
+
+    for (filename, key), outcome in zip(task_keys, outcomes):
+        plan = plans[filename]
+        if plan is None:
+            continue
+        if not isinstance(key, list):
+            # Price table: a failure is recorded, but the report text is still loaded
+            if isinstance(outcome, Exception):
+                logging.error(f"Error extracting the price table from {filename}: {outcome}")
+            plan['price_table'] = (key, outcome)
+            continue
+        if isinstance(outcome, Exception):
+            logging.error(f"Error extracting text from {filename}: {outcome}")
+            plans[filename] = None
+            continue
+        for index, text in zip(key, outcome):
+            plan['extracted'][index] = (plan['page_hashes'][index], text)
+
+    for filepath, filename, fingerprint in reports:
+        logging.info(f"\n[HANDLER] Unstructured Report: {filename}")
+        _, extension = os.path.splitext(filename.lower())
+
+        pages = None
+        price_table = None
+        if extension == '.pdf' and fitz:
+            plan = plans[filename]
+            if plan is None:
+                content = None
+            else:
+                texts = [plan['cached'][index] if index in plan['cached'] else plan['extracted'][index][1]
+                         for index in range(len(plan['page_hashes']))]
+                content = "".join(texts).strip()
+                pages = {'extracted': plan['extracted'], 'page_count': len(plan['page_hashes'])}
+                price_table = plan['price_table']
+                if plan['cached']:
+                    logging.info(f"  [CACHED] Reused {len(plan['cached'])} of {len(plan['page_hashes'])} pages.")
         else:
-            content_type = 'GENERAL'
-
-        # Prepare data for insertion
-        data = {
-            'source_location': SOURCE_LOCATION,
-            'report_date': report_date,
-            'sale_number': sale_number,
-            'content_type': content_type,
-            'content': content,
-            'source_file': filename,
-            'processed_timestamp': timestamp
-        }
-        df = pd.DataFrame([data])
-
-        # Insert into database (uses INSERT OR IGNORE via execute_insert)
-        inserted_count = execute_insert(conn, 'market_commentary', df)
-        
-        if inserted_count > 0:
-            logging.info(f"    [SUCCESS] Extracted content from {filename}.")
-        
-        log_processed(file_identifier, inserted_count, conn, data_type, status='SUCCESS')
+            content = extract_text_from_file(filepath, extension)
+
+        write_unstructured_report(conn, filename, content, fingerprint=fingerprint, pages=pages, price_table=price_table)
+
+def split_source_files(filenames):
+    """Splits directory entries into (XLSX files, PDF/DOCX/TXT reports). Excel '~$' lock files
+    and the diagnostic text files are left out."""
+    source_files = [f for f in filenames if not f.startswith('~$') and f.lower() not in IGNORED_REPORT_FILES]
+    structured_files = [f for f in source_files if f.lower().endswith('.xlsx')]
+    unstructured_files = [f for f in source_files if f.lower().endswith(('.pdf', '.docx', '.txt'))]
+    return structured_files, unstructured_files
+
+def select_changed_files(filenames, conn, force=False):
+    """V6: The hash gate. Returns (filepath, filename, fingerprint) for the files in MOMBASA_DIR
+    that are new or changed since their last successful run (all of them with force)."""
+    changed = []
+    for filename in sorted(filenames):
+        filepath = os.path.join(MOMBASA_DIR, filename)
+        if force:
+            fingerprint = get_file_fingerprint(filepath, compute_content_hash(filepath))
+        else:
+            unchanged, fingerprint = check_file_unchanged(filepath, filename, conn)
+            if unchanged:
+                logging.info(f"[SKIPPING] Unchanged since last run: {filename}")
+                continue
+        changed.append((filepath, filename, fingerprint))
+    return changed
+
+def ingest_structured_files(workbooks, conn, workers=1, stream=False, chunk_rows=STREAM_CHUNK_ROWS):
+    """V6: Parses (filepath, filename, fingerprint) workbooks, in a process pool when workers > 1,
+    and writes each through the single writer in the given order.
+    Each workbook is routed once here; its handler goes to the parser and labels the writer's metrics."""
+    handlers = [route_structured_file(fn, fp) for fp, fn, _ in workbooks]
+    # Streamed files are read here, in their sorted position, rather than in a worker.
+    streams = [stream_structured_file(fp, fn, chunk_rows, handler) if stream else None
+               for (fp, fn, _), handler in zip(workbooks, handlers)]
+
+    if workers > 1 and len(workbooks) > 1:
+        logging.info(f"Parsing XLSX files with {workers} worker processes.")
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure_reader, initargs=(EXCEL_ENGINE, LANDING_ZONE_DIR)) as pool:
+            futures = [pool.submit(parse_structured_file, fp, fn, handler) if st is None else None
+                       for (fp, fn, _), handler, st in zip(workbooks, handlers, streams)]
+            # Results are consumed in submission order, keeping the writer deterministic.
+            for (_, filename, fingerprint), handler, future, st in zip(workbooks, handlers, futures, streams):
+                results = st if st is not None else future.result()
+                write_load_results(conn, results, filename, fingerprint, handler)
+    else:
+        for (filepath, filename, fingerprint), handler, st in zip(workbooks, handlers, streams):
+            results = st if st is not None else parse_structured_file(filepath, filename, handler)
+            write_load_results(conn, results, filename, fingerprint, handler)
+
+def process_unstructured_report(filepath, filename, conn, force=False):
+    """Handler for PDF, DOCX, TXT reports.
+    V6: Skipped while the file's content hash is unchanged (unless force)."""
+    if force:
+        fingerprint = get_file_fingerprint(filepath, compute_content_hash(filepath))
     else:
-        log_processed(file_identifier, 0, conn, data_type, status='FAILED_EXTRACTION')
+        unchanged, fingerprint = check_file_unchanged(filepath, filename, conn)
+        if unchanged:
+            logging.info(f"  [SKIPPING] Unchanged since last run: {filename}")
+            return
+    process_unstructured_reports([(filepath, filename, fingerprint)], conn)
 
 # =============================================================================
 # Main Processor
 # =============================================================================
 
-def run_processor():
+def run_processor(workers=1, force=False, stream=False, chunk_rows=STREAM_CHUNK_ROWS, excel_engine=None, landing=True):
+    """Runs the ETL over MOMBASA_DIR.
+
+    V6: With workers > 1, XLSX files are parsed and cleaned in a process pool while
+    this process stays the single writer. Results are consumed in sorted filename
+    order, so execute_insert ordering (and therefore UPSERT/COALESCE outcomes) is
+    identical to a serial run.
+
+    V6: XLSX files whose content hash matches their last successful run are skipped.
+    force=True re-parses everything (full rebuild).
+
+    V6: With stream=True, GeneralReport files are read and upserted in chunks of
+    chunk_rows rows by this process (bounded memory) instead of being parsed whole.
+
+    V6: excel_engine selects the XLSX reader backend ('auto', 'calamine', 'openpyxl').
+
+    V6: PDF/DOCX/TXT reports are hash-gated too. PDFs are extracted page by page (in the
+    pool when workers > 1), and pages unchanged since the last run are reused.
+
+    V6: Parsed sheets are kept in the Parquet landing zone (LANDING_ZONE_DIR) and re-read
+    from there while a file is unchanged, which makes force=True re-cleans cheap.
+    landing=False reads every sheet from its xlsx and lands nothing.
+
+    V6: The connection comes from warehouse_db (WAL, synchronous=NORMAL) and every source
+    file is written in one transaction; the WAL is checkpointed before the run ends.
+
+    V6: Each file and sheet gets ingest_metrics rows (read/map/clean/upsert seconds, bytes,
+    rows in/dropped/upserted) under this run's ID, summarized in <DB_FILE stem>.metrics.json.
+    """
     start_time = time.time()
-    logging.info("--- Starting Mombasa Data Warehouse Processor V5 (Enrichment & Unstructured) ---")
+    logging.info("--- Starting Mombasa Data Warehouse Processor V6 (Enrichment, Unstructured & Parallel Parsing) ---")
     
     if not os.path.exists(MOMBASA_DIR):
         logging.error(f"Directory not found: {MOMBASA_DIR}")
         return
 
     initialize_database()
+
+    if excel_engine:
+        set_excel_engine(excel_engine)
+    logging.info(f"XLSX reader backend: {resolve_excel_engine()}")
+    if not landing:
+        set_landing_zone(None)
+    elif LANDING_ZONE_DIR and pa is None:
+        logging.info("pyarrow is not installed; the Parquet landing zone is disabled. pip install pyarrow")
+    elif LANDING_ZONE_DIR:
+        logging.info(f"Parquet landing zone: {LANDING_ZONE_DIR}")
     
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+    set_ingest_run(run_id)
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with closing(connect_database(DB_FILE)) as conn:
             logging.info(f"Scanning directory: {MOMBASA_DIR}")
             
             try:
                 # V5: Scan for structured and unstructured files
-                all_files = [f for f in os.listdir(MOMBASA_DIR) if not f.startswith('~$')]
-                structured_files = [f for f in all_files if f.lower().endswith('.xlsx')]
-                unstructured_files = [f for f in all_files if f.lower().endswith(('.pdf', '.docx', '.txt'))]
+                structured_files, unstructured_files = split_source_files(os.listdir(MOMBASA_DIR))
             except Exception as e:
                 logging.error(f"Failed to read directory: {e}")
                 return
@@ -785,56 +3203,185 @@ def run_processor():
             logging.info(f"Found {len(structured_files)} XLSX files and {len(unstructured_files)} unstructured files.")
 
             # Process Structured files (XLSX)
-            for filename in sorted(structured_files):
-                filepath = os.path.join(MOMBASA_DIR, filename)
-                fn_lower = filename.lower()
-
-                # --- File Type Routing ---
-                
-                if 'auctionsummary' in fn_lower:
-                    process_auction_summary(filepath, filename, conn)
-                
-                elif 'generalreport' in fn_lower:
-                    process_standard_format(
-                        filepath, filename, conn, 
-                        data_type=DATA_TYPE_SALE, 
-                        target_sheet='General Report', 
-                        clean_second_row=True,
-                        use_internal_metadata=True
-                    )
-
-                elif 'completeofferlots' in fn_lower:
-                    process_complete_offer_lots(filepath, filename, conn)
-                
-                elif 'sale' in fn_lower and 'catalogue' in fn_lower:
-                    process_standard_format(filepath, filename, conn, data_type=DATA_TYPE_OFFER)
-                
-                elif 'auction quantity' in fn_lower:
-                     logging.info(f"\n[INFO] Skipping time-series file: {filename}")
-                
-                else:
-                    logging.info(f"\n[INFO] Skipping unrecognized XLSX file format: {filename}")
+            workbooks = select_changed_files(structured_files, conn, force)
+            logging.info(f"{len(workbooks)} XLSX files are new or changed{' (forced rebuild)' if force else ''}.")
+            ingest_structured_files(workbooks, conn, workers=workers, stream=stream, chunk_rows=chunk_rows)
 
             # Process Unstructured files (PDF/DOCX/TXT)
-            for filename in sorted(unstructured_files):
-                 # Skip the diagnostic files if present
-                 if filename.lower() in ['header diagnostic.txt', 'mombasa i.txt']:
-                     continue
-                 filepath = os.path.join(MOMBASA_DIR, filename)
-                 process_unstructured_report(filepath, filename, conn)
+            # V6: Hash-gated like the XLSX files; PDFs are extracted page by page
+            reports = select_changed_files(unstructured_files, conn, force)
+            process_unstructured_reports(reports, conn, workers=workers)
 
+            # V6: Keep planner statistics current as the tables grow
+            if workbooks:
+                analyze_database(conn)
+            write_metrics_summary(conn, run_id, time.time() - start_time)
+            checkpoint_database(conn)
 
     except sqlite3.Error as e:
         logging.critical(f"Database connection failed: {e}")
+    finally:
+        set_ingest_run(None)
     
     end_time = time.time()
     logging.info(f"\n--- Finished Processor. Total time: {end_time - start_time:.2f} seconds ---")
 
+# =============================================================================
+# V6: Watch Mode
+# A long-running alternative to the daily full scan: MOMBASA_DIR is listed every
+# WATCH_POLL_SECONDS (one os.scandir, no file reads) and a new or changed file is
+# ingested once its size and mtime have been stable for WATCH_SETTLE_SECONDS, so
+# files still being copied or saved are not read half-written. Only the settled
+# files go through the hash gate and their handlers; nothing else is rescanned.
+# =============================================================================
+
+def snapshot_source_files(directory):
+    """(size, mtime_ns) of the source files in a directory, by filename."""
+    with os.scandir(directory) as entries:
+        stats = {entry.name: entry.stat() for entry in entries if entry.is_file()}
+    structured_files, unstructured_files = split_source_files(stats)
+    return {name: (stats[name].st_size, stats[name].st_mtime_ns) for name in structured_files + unstructured_files}
+
+def settle_files(snapshot, pending, ingested, now, settle_seconds=WATCH_SETTLE_SECONDS):
+    """Debounce. pending maps filename -> (signature, first seen with it); ingested maps
+    filename -> the signature it was ingested with. Returns the filenames that are ready."""
+    ready = []
+    for name in set(pending) - set(snapshot):
+        del pending[name]
+    for name in set(ingested) - set(snapshot):
+        del ingested[name] # Deleted; a file copied back under the same name is ingested again
+    for name, signature in snapshot.items():
+        if ingested.get(name) == signature:
+            continue
+        seen = pending.get(name)
+        if seen is None or seen[0] != signature:
+            pending[name] = (signature, now) # New, or still being written
+        elif now - seen[1] >= settle_seconds:
+            ready.append(name)
+    return sorted(ready)
+
+def ingest_files(filenames, conn, workers=1, stream=False, chunk_rows=STREAM_CHUNK_ROWS):
+    """V6: Sends settled files through the hash gate to their handlers as one ingest run."""
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+    set_ingest_run(run_id)
+    start_time = time.time()
+    try:
+        structured_files, unstructured_files = split_source_files(filenames)
+        workbooks = select_changed_files(structured_files, conn)
+        ingest_structured_files(workbooks, conn, workers=workers, stream=stream, chunk_rows=chunk_rows)
+        process_unstructured_reports(select_changed_files(unstructured_files, conn), conn, workers=workers)
+        if workbooks:
+            analyze_database(conn)
+        write_metrics_summary(conn, run_id, time.time() - start_time)
+    finally:
+        set_ingest_run(None)
+
+def watch_directory(poll_seconds=WATCH_POLL_SECONDS, settle_seconds=WATCH_SETTLE_SECONDS, workers=1,
+                    stream=False, chunk_rows=STREAM_CHUNK_ROWS, excel_engine=None, max_polls=None):
+    """V6: Ingests files dropped into MOMBASA_DIR until interrupted (Ctrl+C) or after max_polls polls.
+    Files already in the directory at start-up are caught up through the hash gate (unchanged
+    ones are skipped on size and mtime alone)."""
+    if not os.path.exists(MOMBASA_DIR):
+        logging.error(f"Directory not found: {MOMBASA_DIR}")
+        return
+    initialize_database()
+    if excel_engine:
+        set_excel_engine(excel_engine)
+    logging.info(f"Watching {MOMBASA_DIR} (poll every {poll_seconds}s, files settle after {settle_seconds}s). Ctrl+C to stop.")
+
+    pending, ingested = {}, {}
+    polls = 0
+    with closing(connect_database(DB_FILE)) as conn:
+        try:
+            while max_polls is None or polls < max_polls:
+                try:
+                    snapshot = snapshot_source_files(MOMBASA_DIR)
+                except OSError as e:
+                    logging.error(f"Failed to read directory: {e}")
+                    snapshot = None
+                if snapshot is not None:
+                    ready = settle_files(snapshot, pending, ingested, time.monotonic(), settle_seconds)
+                    if ready:
+                        logging.info(f"\n[WATCH] Ingesting {len(ready)} settled files: {', '.join(ready)}")
+                        try:
+                            ingest_files(ready, conn, workers=workers, stream=stream, chunk_rows=chunk_rows)
+                        except Exception as e:
+                            # A file that fails is retried once it changes again
+                            logging.error(f"[WATCH] Ingest failed: {e}", exc_info=True)
+                        for name in ready:
+                            ingested[name] = snapshot[name]
+                            pending.pop(name, None)
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(poll_seconds)
+        except KeyboardInterrupt:
+            logging.info("\n[WATCH] Stopped.")
+        finally:
+            checkpoint_database(conn)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mombasa Data Warehouse Processor")
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="Number of processes used to parse XLSX files (0 = one per CPU core). Default: 1 (serial)."
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help="Re-process every file even if its content hash is unchanged (full rebuild)."
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help="Read GeneralReport sheets in fixed-size chunks to keep memory flat on very large files."
+    )
+    parser.add_argument(
+        '--chunk-rows', type=int, default=STREAM_CHUNK_ROWS,
+        help=f"Rows per chunk in --stream mode. Default: {STREAM_CHUNK_ROWS}."
+    )
+    parser.add_argument(
+        '--no-landing', action='store_true',
+        help="Always parse the .xlsx files and do not write the Parquet landing zone."
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help="Keep running and ingest files as they are dropped into MOMBASA_DIR (instead of one full scan)."
+    )
+    parser.add_argument(
+        '--poll-seconds', type=float, default=WATCH_POLL_SECONDS,
+        help=f"--watch: seconds between directory listings. Default: {WATCH_POLL_SECONDS}."
+    )
+    parser.add_argument(
+        '--settle-seconds', type=float, default=WATCH_SETTLE_SECONDS,
+        help=f"--watch: a file is ingested once unchanged for this long (partial copies are skipped). Default: {WATCH_SETTLE_SECONDS}."
+    )
+    parser.add_argument(
+        '--check-indexes', action='store_true',
+        help="Apply the index migration and verify with EXPLAIN QUERY PLAN that lookups use an index, then exit."
+    )
+    parser.add_argument(
+        '--excel-engine', choices=['auto', 'calamine', 'openpyxl'], default=EXCEL_ENGINE,
+        help="XLSX reader backend. 'auto' uses calamine when python-calamine is installed."
+    )
+    return parser.parse_args(argv)
+
+def run_index_check():
+    """V6: Returns True when no QUERY_PLAN_CHECKS query falls back to a full table scan."""
+    initialize_database()
+    with closing(connect_database(DB_FILE)) as conn:
+        regressions = check_query_plans(conn)
+    for sql, plan in regressions:
+        logging.error(f"[PLAN REGRESSION] Full table scan: {sql} -> {plan}")
+    if not regressions:
+        logging.info(f"All {len(QUERY_PLAN_CHECKS)} lookups use an index.")
+    return not regressions
+
 if __name__ == "__main__":
+    args = parse_args()
+
+    if args.check_indexes:
+        exit(0 if run_index_check() else 1)
+
     # Dependency checks
-    try:
-        import openpyxl
-    except ImportError:
+    if not openpyxl:
         logging.error("The 'openpyxl' library is required. Please install it: pip install pandas openpyxl")
         exit(1)
 
@@ -848,4 +3395,22 @@ if __name__ == "__main__":
         logging.warning("before running this script to ensure the new UPSERT and COALESCE logic functions correctly on a fresh import.")
         logging.warning("***************\n")
         
-    run_processor()
\ No newline at end of file
+    if args.watch:
+        watch_directory(
+            poll_seconds=args.poll_seconds,
+            settle_seconds=args.settle_seconds,
+            workers=args.workers or os.cpu_count() or 1,
+            stream=args.stream,
+            chunk_rows=args.chunk_rows,
+            excel_engine=args.excel_engine
+        )
+        exit(0)
+
+    run_processor(
+        workers=args.workers or os.cpu_count() or 1,
+        force=args.force,
+        stream=args.stream,
+        chunk_rows=args.chunk_rows,
+        excel_engine=args.excel_engine,
+        landing=not args.no_landing
+    )
\ No newline at end of file
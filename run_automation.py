@@ -1,6 +1,7 @@
 import subprocess
 import logging
 import datetime
+import glob
 import os
 import sys
 
@@ -15,6 +16,8 @@ PYTHON_EXECUTABLE = sys.executable
 JOBS_TO_RUN = [
     {"name": "Mombasa Processor (ETL)", "script": "process_mombasa_data.py"},
     {"name": "Mombasa Analyzer (JSON Generation)", "script": "analyze_mombasa.py"},
+    # Optional: its failure does not block the Git sync. Not committed; rebuilt from the DB when missing.
+    {"name": "Analytics Mirror (Parquet)", "script": "analytics_mirror.py", "optional": True},
     # Add your news scraper here as well if it's managed by this script
     # {"name": "News Scraper", "script": "scraper_news.py"},
 ]
@@ -22,6 +25,7 @@ JOBS_TO_RUN = [
 # Files/Directories to commit automatically
 FILES_TO_COMMIT = [
     "market_reports.db",
+    "market_reports_*.db", # Year partitions of the lot tables (closed seasons stay unchanged)
     "market-reports.html",
     "report_data/" # Commit the entire data directory
 ]
@@ -68,6 +72,20 @@ def run_script(script_name):
         logging.error(f"An unexpected error occurred while running {script_name}: {e}")
         return False
 
+def paths_to_commit():
+    """FILES_TO_COMMIT with the wildcard patterns expanded against REPO_PATH.
+    A pattern without matches (e.g. no year partition yet) is skipped: git add fails on it."""
+    paths = []
+    for entry in FILES_TO_COMMIT:
+        if any(char in entry for char in '*?['):
+            matches = sorted(glob.glob(os.path.join(REPO_PATH, entry)))
+            if not matches:
+                logging.info(f"Nothing matches {entry}. Skipping it.")
+            paths.extend(os.path.relpath(match, REPO_PATH) for match in matches)
+        else:
+            paths.append(entry)
+    return paths
+
 def git_sync_repository():
     """Implements the Commit-Pull-Push strategy for robust automation."""
     logging.info("--- Starting Git Operations (Commit-Pull-Push Strategy) ---")
@@ -79,7 +97,7 @@ def git_sync_repository():
         # We must add the changes generated by the scripts first.
         logging.info("Staging changes...")
         # Use repo.git.add() for robust handling of directories/new files
-        repo.git.add(FILES_TO_COMMIT)
+        repo.git.add(paths_to_commit())
         
         # 2. Check if there are changes staged (comparing index to HEAD)
         if repo.index.diff('HEAD'):
@@ -137,6 +155,9 @@ def main():
     all_jobs_successful = True
     for job in JOBS_TO_RUN:
         if not run_script(job['script']):
+            if job.get('optional'):
+                logging.warning(f"{job['name']} failed (optional job). Continuing.")
+                continue
             logging.error(f"{job['name']} failed. Aborting pipeline.")
             all_jobs_successful = False
             break
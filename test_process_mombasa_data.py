@@ -0,0 +1,80 @@
+# test_process_mombasa_data.py
+# The vectorized column parsers must give the same results as their per-value versions.
+import numpy as np
+import pandas as pd
+import pytest
+
+import process_mombasa_data as etl
+
+SALE_DATE = '2025-09-02'
+
+@pytest.mark.parametrize('codes', [
+    ['2025/37', '2025/38'],             # Slash codes only
+    ['Sale 37', 'Sale 38', 'Sale 7'],   # "Sale NN" codes only
+    ['2025/37', 'Sale 38', None, 'x'],  # Mixed
+    [None, None],                       # All null
+    [np.nan, np.nan],
+])
+@pytest.mark.parametrize('sale_date', [SALE_DATE, None])
+def test_extract_sale_number_series_matches_scalar(codes, sale_date):
+    sale_numbers = pd.Series(codes, dtype=object)
+    sale_dates = pd.Series([sale_date] * len(codes), dtype=object)
+    expected = [etl.extract_sale_number_from_string(str(code), sale_date) for code in codes]
+    assert list(etl.extract_sale_number_series(sale_numbers, sale_dates)) == expected
+
+@pytest.mark.parametrize('values', [
+    ['02/09/2025', '020925', None],
+    [None, None],
+    [np.nan],
+])
+def test_parse_date_series_matches_scalar(values):
+    series = pd.Series(values, dtype=object)
+    assert etl.parse_date_series(series).tolist() == [etl.parse_date(value) for value in values]
+
+def offer_sheet(quantities):
+    """An offer sheet with one lot per quantity."""
+    return pd.DataFrame({
+        'Broker': 'ABC', 'Garden': 'KIPTORA', 'Grade': 'BP1',
+        'Lot No': [str(1000 + i) for i in range(len(quantities))], 'Kgs': quantities,
+    })
+
+def clean_offers(df, **metadata):
+    metadata = dict({'file_identifier': 'test.xlsx::Sheet1', 'sale_number': '2025-37',
+                     'sale_date': SALE_DATE, 'timestamp': '2025-09-02T00:00:00'}, **metadata)
+    return etl.clean_lot_details(df, metadata, etl.DATA_TYPE_OFFER)
+
+def test_quantity_outlier_rejects_non_positive_and_far_above_median():
+    result = clean_offers(offer_sheet([100, 120, 0, -5, 5000, None]))
+    assert result['quantity_median'] == 120
+    assert result['rejected']['lot_number'].tolist() == ['1002', '1003', '1004']
+    assert set(result['rejected']['reason']) == {'QUANTITY_OUTLIER'}
+    assert result['df']['lot_number'].tolist() == ['1000', '1001', '1005'] # A missing quantity is not an outlier
+
+def test_quantity_outlier_uses_the_reference_median_of_the_sheet():
+    # A later streamed chunk of small lots: 900 kg is an outlier only against its own median
+    chunk = offer_sheet([50, 60, 900])
+    assert clean_offers(chunk)['rejected']['lot_number'].tolist() == ['1002']
+    assert clean_offers(chunk, quantity_median=120.0)['rejected'].empty
+
+def test_streamed_sheet_matches_full_read(tmp_path):
+    # 'Lot No' is int in the first chunk and float in the next (blank cell), as a whole column it is float
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Broker', 'Garden', 'Grade', 'Lot No', 'Invoice', 'Kgs'])
+    for lot, invoice, kgs in [(1001, 'GG1', 100), (1002, 'GG2', 120), (None, 'GG3', 110), (1004, 'GG4', 130), (1005, 'GG5', 90)]:
+        sheet.append(['ABC', 'KIPTORA', 'BP1', lot, invoice, kgs])
+    filename = 'Sale 37_Catalogue_02_09_2025.xlsx'
+    workbook.save(tmp_path / filename)
+
+    options = dict(data_type=etl.DATA_TYPE_OFFER)
+    full = etl.parse_standard_format(str(tmp_path / filename), filename, **options)
+    streamed = list(etl.iter_standard_format(str(tmp_path / filename), filename, chunk_rows=2, **options))
+    assert len(full) == 1 and len(streamed) == 3
+
+    def lots(frames):
+        return pd.concat(frames).reset_index(drop=True)
+    pd.testing.assert_frame_equal(lots(r['df'] for r in streamed).drop(columns='processed_timestamp'),
+                                  lots([full[0]['df']]).drop(columns='processed_timestamp'), check_dtype=False)
+    assert full[0]['df']['lot_number'].tolist() == ['1001', '1002', '1004', '1005']
+    assert lots(r['rejected'] for r in streamed)['reason'].tolist() == full[0]['rejected']['reason'].tolist() == ['MISSING_LOT']
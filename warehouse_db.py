@@ -0,0 +1,191 @@
+# warehouse_db.py
+# Shared SQLite connection settings for the Mombasa warehouse (market_reports.db).
+# Used by process_mombasa_data.py (writer) and analyze_mombasa.py (reader).
+import glob
+import os
+from datetime import datetime
+import re
+import sqlite3
+
+# V6: Connection tuning applied to every connection
+PRAGMAS = [
+    ('journal_mode', 'WAL'),     # Readers (the analyzer) are not blocked while the ETL writes
+    ('synchronous', 'NORMAL'),   # With WAL: no fsync per commit, only at checkpoints
+    ('cache_size', -65536),      # 64 MB page cache (negative values are KiB)
+    ('temp_store', 'MEMORY'),    # Staging tables and sorts stay in RAM
+]
+# V6: Per-database write settings, applied to the attached partitions too. Reader connections
+# skip them: journal_mode is stored in the file, so only the writer should change it.
+WRITE_PRAGMAS = ['journal_mode', 'synchronous']
+BUSY_TIMEOUT_SECONDS = 30
+
+# V6: Year partitions. Lot rows live in one file per sale year next to the catalog
+# (market_reports.db -> market_reports_2025.db), attached to every connection as y2025.
+# market_reports.db keeps everything else (processing log, dimension tables, summaries),
+# so a closed season's file is never written again unless its reports are reloaded.
+# SQLite attaches at most 10 databases per connection by default, i.e. ten seasons;
+# attach_partition raises a clear error beyond that instead of failing deep in a query.
+PARTITION_PREFIX = 'y'
+
+# V6: The lot tables as readers know them: one TEMP view per connection, a UNION ALL over
+# the catalog and every partition of the fact rows with their dimension keys decoded.
+# Each arm is a complete join, so a filter on the view (sale_number, mark, buyer) is
+# pushed into every arm and answered from that partition's indexes.
+LOT_VIEWS = {
+    'auction_sales': """
+        SELECT f.id, f.source_location, f.sale_date, f.sale_number, b.broker, m.mark, g.grade, f.lot_number,
+               f.invoice_number, f.quantity_kgs, f.package_count, f.price, u.buyer,
+               s.source_file_identifier, s.processed_timestamp, f.mark_id, f.buyer_id
+        FROM {schema}.auction_sales_facts f
+        LEFT JOIN main.dim_brokers b ON b.id = f.broker_key
+        LEFT JOIN main.dim_marks m ON m.id = f.mark_key
+        LEFT JOIN main.dim_grades g ON g.id = f.grade_key
+        LEFT JOIN main.dim_buyers u ON u.id = f.buyer_key
+        LEFT JOIN main.dim_source_files s ON s.id = f.source_file_key
+    """,
+    'auction_offers': """
+        SELECT f.id, f.source_location, f.sale_date, f.sale_number, b.broker, m.mark, g.grade, f.lot_number,
+               f.invoice_number, f.quantity_kgs, f.package_count, f.valuation_or_rp,
+               s.source_file_identifier, s.processed_timestamp, f.mark_id
+        FROM {schema}.auction_offers_facts f
+        LEFT JOIN main.dim_brokers b ON b.id = f.broker_key
+        LEFT JOIN main.dim_marks m ON m.id = f.mark_key
+        LEFT JOIN main.dim_grades g ON g.id = f.grade_key
+        LEFT JOIN main.dim_source_files s ON s.id = f.source_file_key
+    """,
+    'lot_outcomes': """
+        SELECT f.id, f.source_location, f.sale_date, f.sale_number, b.broker, m.mark, g.grade, f.lot_number,
+               f.quantity_kgs, f.valuation, f.price, u.buyer, f.sold, f.realization,
+               f.offer_id, f.sale_id, f.mark_id
+        FROM {schema}.lot_outcome_facts f
+        LEFT JOIN main.dim_brokers b ON b.id = f.broker_key
+        LEFT JOIN main.dim_marks m ON m.id = f.mark_key
+        LEFT JOIN main.dim_grades g ON g.id = f.grade_key
+        LEFT JOIN main.dim_buyers u ON u.id = f.buyer_key
+    """,
+}
+FACT_TABLES = {'auction_sales': 'auction_sales_facts', 'auction_offers': 'auction_offers_facts'}
+DERIVED_FACT_TABLES = {'lot_outcomes': 'lot_outcome_facts'} # V6: Built from the lot tables at ingest, not loaded
+
+def connect_database(db_file, reader=False):
+    """Opens a tuned connection. Transactions are left to the caller (one per source file).
+    V6: Attaches the year partitions of db_file and creates the lot views over them.
+    V6: reader=True (analyzer, library builder, mirror) leaves the WRITE_PRAGMAS alone."""
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_SECONDS)
+    for pragma, value in PRAGMAS:
+        if not (reader and pragma in WRITE_PRAGMAS):
+            conn.execute(f"PRAGMA {pragma} = {value}")
+    for year in list_partition_years(db_file):
+        attach_partition(conn, db_file, year, reader)
+    create_lot_views(conn)
+    return conn
+
+def checkpoint_database(conn):
+    """Folds the write-ahead log back into the main file, so market_reports.db is
+    self-contained when it is committed or copied. V6: Covers the attached partitions too."""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+# =============================================================================
+# V6: Year Partitions
+# =============================================================================
+
+def partition_file(db_file, year):
+    root, extension = os.path.splitext(db_file)
+    return f"{root}_{year}{extension}"
+
+def partition_schema(year):
+    return f"{PARTITION_PREFIX}{year}"
+
+def list_partition_years(db_file):
+    """Years of the partition files that exist next to db_file, oldest first."""
+    root, extension = os.path.splitext(db_file)
+    pattern = re.compile(re.escape(root) + r"_(\d{4})" + re.escape(extension) + "$")
+    matches = (pattern.match(path) for path in glob.glob(f"{glob.escape(root)}_*{extension}"))
+    return sorted(int(match.group(1)) for match in matches if match)
+
+def attached_schemas(conn):
+    return [row[1] for row in conn.execute("PRAGMA database_list")]
+
+def attach_partition(conn, db_file, year, reader=False):
+    """Attaches the partition of a year (creating the file if needed). Returns its schema name.
+    The per-database settings cannot change inside a transaction; a partition attached
+    mid-transaction keeps SQLite's defaults until the next connect.
+    Raises sqlite3.OperationalError when the connection already holds as many partitions
+    as SQLite can attach (SQLITE_MAX_ATTACHED)."""
+    schema = partition_schema(year)
+    attached = attached_schemas(conn)
+    if schema not in attached:
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len([name for name in attached if name not in ('main', 'temp')]) >= limit:
+            raise sqlite3.OperationalError(
+                f"Cannot attach {partition_file(db_file, year)}: SQLite attaches at most {limit} databases per "
+                f"connection and {limit} year partitions of {db_file} are already attached. Merge the oldest "
+                f"seasons into one file or use an SQLite build with a higher SQLITE_MAX_ATTACHED.")
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (partition_file(db_file, year),))
+        for pragma, value in PRAGMAS:
+            if pragma in WRITE_PRAGMAS and not reader and not conn.in_transaction:
+                conn.execute(f"PRAGMA {schema}.{pragma} = {value}")
+    return schema
+
+def partition_schemas(conn):
+    """The catalog and the attached partitions, oldest year first."""
+    years = sorted(schema for schema in attached_schemas(conn) if re.fullmatch(rf"{PARTITION_PREFIX}\d{{4}}", schema))
+    return ['main'] + years
+
+def has_table(conn, schema, table_name):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                        (table_name,)).fetchone() is not None
+
+def create_lot_views(conn):
+    """(Re)creates the TEMP lot views over every database that holds the fact table.
+    Does nothing for a view whose fact table does not exist yet (a new catalog)."""
+    fact_tables = dict(FACT_TABLES, **DERIVED_FACT_TABLES)
+    for view_name, sql in LOT_VIEWS.items():
+        schemas = [schema for schema in partition_schemas(conn) if has_table(conn, schema, fact_tables[view_name])]
+        if schemas:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{view_name}")
+            conn.execute(f"CREATE TEMP VIEW {view_name} AS " + " UNION ALL ".join(sql.format(schema=schema) for schema in schemas))
+
+def relation_exists(conn, name):
+    """True if a table or view of this name exists in the catalog or as a TEMP view."""
+    return conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?
+        UNION ALL SELECT 1 FROM sqlite_temp_master WHERE type = 'view' AND name = ?
+    """, (name, name)).fetchone() is not None
+
+# =============================================================================
+# V6: Change Log Consumers
+# The ETL appends the (source_location, sale_number) pairs of every write to
+# change_log. A downstream stage reads the entries after its cursor, handles those
+# sales and then moves its cursor, so it only redoes the work a run invalidated.
+# =============================================================================
+
+def read_changed_sales(conn, consumer, tables=None):
+    """Returns (sales, last_change_id): the (source_location, sale_number) pairs written to the
+    given tables (all when None) since the consumer's cursor, and the id to pass to
+    commit_changes once they are handled. sales is None when the consumer has no cursor
+    yet or the database has no change_log: everything needs handling."""
+    try:
+        cursor = conn.execute("SELECT last_change_id FROM change_log_cursors WHERE consumer = ?", (consumer,)).fetchone()
+        last_change_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_log").fetchone()[0]
+    except sqlite3.Error:
+        return None, None
+    if cursor is None:
+        return None, last_change_id
+    sql = "SELECT DISTINCT source_location, sale_number FROM change_log WHERE id > ? AND id <= ?"
+    params = [cursor[0], last_change_id]
+    if tables:
+        sql += f" AND table_name IN ({', '.join(['?'] * len(tables))})"
+        params += list(tables)
+    return set(conn.execute(sql, params).fetchall()), last_change_id
+
+def commit_changes(conn, consumer, last_change_id):
+    """Moves the consumer's cursor to last_change_id (from read_changed_sales)."""
+    if last_change_id is None:
+        return
+    with conn:
+        conn.execute("""
+            INSERT INTO change_log_cursors (consumer, last_change_id, updated_timestamp) VALUES (?, ?, ?)
+            ON CONFLICT(consumer) DO UPDATE SET
+                last_change_id = excluded.last_change_id, updated_timestamp = excluded.updated_timestamp
+        """, (consumer, last_change_id, datetime.now().isoformat()))